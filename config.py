@@ -12,11 +12,65 @@ USE_SERIAL = True       # Communicate with custom serial-port controller
 
 QUICKLOAD = False       # If true, commandline-startup bits aren't rendered
 FORCE_DOWNLOAD = False  # Don't use cached map-data, if online
+GPSFIXTIMEOUT = 30      # Seconds to wait for a GPS-fix at boot, before using saved/default coords
 
 # Render screen-objects at this size - smaller is faster
 WIDTH = 320
 HEIGHT = 240
 
+# How the canvas is scaled up to the display:
+#   'hardware' - SDL scales a canvas-sized display (needs Pygame 2, otherwise uses 'software')
+#   'integer' - Scale by largest whole-number multiple that fits, centred on screen
+#               (crisp, but letterboxed: e.g. 320x240 on a 480x320 screen is drawn at 1x with black borders)
+#   'software' - Stretch to fill screen (slowest)
+SCALEMODE = 'hardware'
+
+# Map-image source:
+#   'static' - Download one Google Static Maps image per map
+#   'tiles' - Fetch/cache 256px map-tiles as they're needed, allowing unlimited panning
+#             (default TILEURLS use Google's undocumented tile-server; check its terms before enabling)
+#   'mbtiles' - Read tiles from local MBTiles files (e.g. pre-built regional packs), for use offline
+MAPSOURCE = 'static'
+# Tile-server URLs: may use {x}, {y}, {z} (Google/OSM tile-numbering) or {quadkey}
+TILEURLS = {
+    'local': 'http://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+    'world': 'http://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}',
+}
+TILECACHESIZE = 64      # Max decoded tiles kept in memory, per map
+
+# Map/places/geocode provider:
+#   'google' - Google's map-services
+#   'standin' - Local stand-in server (pipboy_standin.py), serving canned tiles/places/geocode data
+MAPPROVIDER = 'google'
+STANDINURL = 'http://localhost:8089'
+PROVIDERURLS = {
+    'google': {
+        'staticmap': 'http://maps.googleapis.com/maps/api/staticmap',
+        'places': 'https://maps.googleapis.com/maps/api/place/nearbysearch/json',
+        'geocode': 'http://maps.google.com/maps/api/geocode/json',
+        'tiles': TILEURLS,
+    },
+    'standin': {
+        'staticmap': STANDINURL + '/staticmap',
+        'places': STANDINURL + '/places',
+        'geocode': STANDINURL + '/geocode',
+        'tiles': {
+            'local': STANDINURL + '/tiles/local/{z}/{x}/{y}',
+            'world': STANDINURL + '/tiles/world/{z}/{x}/{y}',
+        },
+    },
+}
+HTTPTIMEOUT = 10    # Seconds
+HTTPRETRIES = 2     # Retries after connection-failures or server-errors
+PLACESCACHETTL = (7 * 24 * 60 * 60)     # Seconds before cached places are re-fetched
+GEOCODECACHESIZE = 256  # Max geocoding results kept in cache-file
+GAZETTEERFILE = 'maps/cities15000.txt'   # GeoNames cities-extract, for reverse-geocoding with no internet
+# MBTiles files used by 'mbtiles' map-source:
+MBTILESFILES = {
+    'local': 'maps/local.mbtiles',
+    'world': 'maps/world.mbtiles',
+}
+
 # Address for map's default position:
 #   (used if GPS is inactive)
 defaultPlace = "Washington DC"
@@ -27,9 +81,28 @@ PLAYERLEVEL = 33
 
 FPS = 15
 
+# Power-saving, based on time since last keyboard/mouse/serial input:
+IDLEFPS = 2         # Frame-rate once idle (scanline-animation is paused)
+IDLETIME = 15       # Seconds before going idle
+BLANKTIME = 300     # Seconds before blanking screen (0 = never blank)
+
 import pygame
 import os
 
+# Headless runs (e.g. pipboy_bench.py) use SDL's dummy drivers, with devices/network switched off:
+HEADLESS = (os.environ.get('PIPBOY_HEADLESS') == '1')
+MAPPROVIDER = os.environ.get('PIPBOY_PROVIDER', MAPPROVIDER)
+if HEADLESS:
+    # Stand-in server is local, so is still usable:
+    USE_INTERNET = (MAPPROVIDER == 'standin')
+    # As is the gpsd stand-in (pipboy_gpsreplay.py), if requested:
+    USE_GPS = (os.environ.get('PIPBOY_GPS') == '1')
+    USE_CAMERA = False
+    USE_SERIAL = False
+    QUICKLOAD = True
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
 # My Google-API key:
 gKey = '<api-key-here>'
 
@@ -48,13 +121,15 @@ if USE_SERIAL:
     def loadSerial():
         try:
             print("Importing Serial libraries...")
-            global serial
+            global serial, USE_SERIAL
             import serial
         except:
             # Deactivate serial-related systems if load failed:
             print("SERIAL LIBRARY NOT FOUND!")
             USE_SERIAL = False
     loadSerial()
+# If port isn't there yet, serial-reader thread keeps trying, so controller can be plugged in later:
+ser = None
 if USE_SERIAL:
     try:
         print("Init serial: %s" % (SERIALPORT))
@@ -73,8 +148,8 @@ if USE_SERIAL:
             # config.USE_SERIAL = False
 
     except:
-        print("* Failed to access serial! Ignoring serial port")
-        USE_SERIAL = False
+        print("* Failed to access serial! Will keep trying to connect")
+        ser = None
 print("SERIAL: %s" % (USE_SERIAL))
 
 # Test camera:
@@ -93,7 +168,7 @@ if USE_CAMERA:
 print("CAMERA: %s" % (USE_CAMERA))
 
 # Downloaded/auto-generated data will be put here:
-CACHEPATH = 'cache'
+CACHEPATH = os.environ.get('PIPBOY_CACHEPATH', 'cache')
 if not os.path.exists(CACHEPATH):
     os.makedirs(CACHEPATH)
 
@@ -106,17 +181,20 @@ EVENTS = {
 }
 
 print("Loading images...")
-IMAGES = {
-    "background":pygame.image.load('images/pipboy_back.png'),
-    "scanline":pygame.image.load('images/pipboyscanlines.png'),
-    "distort":pygame.image.load('images/pipboydistorteffectmap.png'),
-    "statusboy":pygame.image.load('images/pipboy_statusboy.png'),
+IMAGEFILES = {
+    "background":'images/pipboy_back.png',
+    "scanline":'images/pipboyscanlines.png',
+    "distort":'images/pipboydistorteffectmap.png',
+    "statusboy":'images/pipboy_statusboy.png',
 }
+IMAGES = {}
+for imageName in IMAGEFILES:
+    IMAGES[imageName] = pygame.image.load(IMAGEFILES[imageName])
 
 print("(done)")
 
 # Test internet connection:
-if USE_INTERNET:
+if USE_INTERNET and (MAPPROVIDER == 'google'):
     import urllib2
 
     def internet_on():
@@ -65,6 +65,13 @@ Class is available under the open-source GDAL license (www.gdal.org).
 
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAXZOOMLEVEL = 32
+
 class GlobalMercator(object):
     """
     TMS Global Mercator Profile
@@ -171,6 +178,9 @@ class GlobalMercator(object):
         self.originShift = 2 * math.pi * 6378137 / 2.0
         # 20037508.342789244
 
+        # Per-zoom resolutions, worked out once:
+        self.resolutions = [self.initialResolution / (2**zoom) for zoom in range(MAXZOOMLEVEL)]
+
     def LatLonToMeters(self, lat, lon ):
         "Converts given lat/lon in WGS84 Datum to XY in Spherical Mercator EPSG:900913"
 
@@ -244,8 +254,35 @@ class GlobalMercator(object):
         "Resolution (meters/pixel) for given zoom level (measured at Equator)"
 
         # return (2 * math.pi * 6378137) / (self.tileSize * 2**zoom)
+        if 0 <= zoom < MAXZOOMLEVEL:
+            return self.resolutions[zoom]
         return self.initialResolution / (2**zoom)
 
+    # Array variants: take/return NumPy arrays (or anything numpy.asarray accepts), converting all values in one pass
+
+    def LatLonToMetersArray(self, lats, lons ):
+        "Converts arrays of lat/lon in WGS84 Datum to arrays of XY in Spherical Mercator EPSG:900913"
+
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lons = numpy.asarray(lons, dtype=numpy.float64)
+        mx = lons * (self.originShift / 180.0)
+        my = numpy.log( numpy.tan((90 + lats) * (math.pi / 360.0) )) * (self.originShift / math.pi)
+        return mx, my
+
+    def MetersToPixelsArray(self, mx, my, zoom):
+        "Converts arrays of EPSG:900913 coordinates to pyramid pixel coordinates in given zoom level"
+
+        res = self.Resolution( zoom )
+        px = (numpy.asarray(mx, dtype=numpy.float64) + self.originShift) / res
+        py = (numpy.asarray(my, dtype=numpy.float64) + self.originShift) / res
+        return px, py
+
+    def LatLonToPixelsArray(self, lats, lons, zoom):
+        "Converts arrays of lat/lon to pyramid pixel coordinates in given zoom level"
+
+        mx, my = self.LatLonToMetersArray( lats, lons )
+        return self.MetersToPixelsArray( mx, my, zoom )
+
     def ZoomForPixelSize(self, pixelSize ):
         "Maximal scaledown zoom of the pyramid closest to the pixelSize."
 
@@ -275,6 +312,16 @@ class GlobalMercator(object):
 
         return quadKey
 
+_sharedMercators = {}
+
+def SharedMercator(tileSize=256):
+    "Returns a GlobalMercator instance shared by all callers using the same tile-size"
+
+    mercator = _sharedMercators.get(tileSize)
+    if mercator is None:
+        mercator = _sharedMercators.setdefault(tileSize, GlobalMercator(tileSize))
+    return mercator
+
 #---------------------
 
 class GlobalGeodetic(object):
@@ -8,6 +8,7 @@ import time
 import random
 import math
 import datetime
+import hashlib
 from pygame.locals import *
 import config
 
@@ -16,6 +17,9 @@ from pipboy_tab_stats import *
 from pipboy_tab_items import *
 from pipboy_tab_data import *
 from pipboy_cmdline import *
+from pipboy_profiler import FrameProfiler
+from pipboy_tasks import startTask
+from pipboy_serial import SerialReader, isReading
 
 # Load optional libraries: (these will have been tested by config.py)
 if config.USE_SERIAL:
@@ -35,20 +39,66 @@ def getTimeStr():
     return curTimeStr
 
 
+def rectsCoverage(rects):
+    '''Return the summed area of a list of rects, as a fraction of the canvas:'''
+    area = 0
+    for rect in rects:
+        area += (rect.width * rect.height)
+    return float(area) / (config.WIDTH * config.HEIGHT)
+
+
+def mergeRects(rects):
+    '''Union overlapping rects together, so no canvas-area is listed twice:'''
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        idx = rect.collidelist(merged)
+        while idx != -1:
+            rect.union_ip(merged.pop(idx))
+            idx = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
 class Engine:
 
     # Default page-settings:
     torch_mode = False
     tab_num = 0
     mode_num = 0
-    ser_buffer = ""
 
     background = None
 
+    # Canvas-to-screen scaling, worked out from config.SCALEMODE when display is first opened:
+    scale_mode = None
+
+    # Canvas-rects changed since the last drawAll call; None means the whole screen:
+    dirty_rects = None
+    # Redraw whole screen if dirty-rects cover more than this fraction of it:
+    max_dirty_coverage = 0.5
+
+    # Frame-profiler HUD, toggled via 'h' key:
+    show_hud = False
+    hud_image = None
+    hud_pos = (12, 40)
+
+    # Pre-generated overlay-frames are saved here:
+    overlay_cache_filename = ("%s/overlay_frames.bin" % (config.CACHEPATH))
+    overlay_cache_version = 1
+
+    # Power-saving state:
+    last_input_tick = 0
+    page_dirty = True
+    idle = False
+    blanked = False
+    input_poll_ms = 20
+
     def __init__(self, *dummy_args, **dummy_kwargs):
 
         if config.USE_SERIAL:
-            self.ser = config.ser
+            # Serial-controller is read on its own thread, which connects if port wasn't there at boot:
+            self.ser = SerialReader(config.SERIALPORT, 9600, config.ser)
+            self.ser.start()
             True  # self.ser.write("gaugeMode=2")
 
         print("Init pygame:")
@@ -59,13 +109,17 @@ class Engine:
         self.root_parent = self
         self.screen_size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
         self.canvas_size = (config.WIDTH, config.HEIGHT)
+        # Headless display-drivers report no screen-size, so use canvas-size:
+        if not all(self.screen_size):
+            self.screen_size = self.canvas_size
+        self.canvas_rect = pygame.Rect((0, 0), self.canvas_size)
 
         print('Resolution: {0}x{1}'.format(self.screen_size[0], self.screen_size[1]))
         print('Canvas Size: {0}x{1}'.format(self.canvas_size[0], self.canvas_size[1]))
 
         # Don't show mouse-pointer:
         pygame.mouse.set_visible(0)
-        pygame.display.set_mode(self.screen_size, pygame.FULLSCREEN)
+        self.setDisplayMode(pygame.FULLSCREEN)
 
         # Block queuing for unused events:
         pygame.event.set_blocked(None)
@@ -74,7 +128,13 @@ class Engine:
 
         # Set up gps, clock, tab-list:
         self.gpsmodule = GpsModuleClass()
+
+        # Tabs, pages and command-line use camelCase names for these:
+        self.rootParent = self
+        self.gpsModule = self.gpsmodule
+        self.canvasSize = self.canvas_size
         self.clock = pygame.time.Clock()
+        self.profiler = FrameProfiler(["serial", "events", "drawTab", "updateCanvas", "ctrlEvents", "drawAll", "tick"])
 
         if config.USE_CAMERA:
             self.tabs = (Tab_Stats(self), VATS(self), Tab_Data(self))
@@ -83,7 +143,12 @@ class Engine:
 
         self.current_tab = self.tabs[self.tab_num]
 
-        self.screen = pygame.display.set_mode(self.screen_size)
+        # Start GPS-fix and map/place downloads now, so they run while boot-text is animating:
+        gps_task = startTask("GPS", self.gpsmodule.getCoords)
+        local_map_task = startTask("Local map", self.root_parent.localMapPage.getMap, [gps_task])
+        world_map_task = startTask("World map", self.root_parent.worldMapPage.getMap, [gps_task])
+
+        self.screen = self.setDisplayMode()
 
         self.background = config.IMAGES["background"]
         self.background = pygame.transform.smoothscale(self.background, self.canvas_size)
@@ -134,7 +199,20 @@ class Engine:
         dostort_line = dostort_line.convert()
         distort_y = -dostort_line_height
         distort_speed = (config.HEIGHT / 40)
-        self.overlay_frames = []
+
+        # Canvas-area covered by each frame's distortion-line, for dirty-rect updates:
+        self.overlay_rects = []
+        rect_y = distort_y
+        while rect_y < config.HEIGHT:
+            self.overlay_rects.append(pygame.Rect(0, rect_y, config.WIDTH, dostort_line_height).clip(self.canvas_rect))
+            rect_y += distort_speed
+
+        # Load previously-generated frames, if settings/images match:
+        overlay_key = self.overlayCacheKey(line_count, scan_mult, dostort_line_height, distort_speed)
+        self.overlay_frames = self.loadOverlayFrames(overlay_key)
+        gen_overlays = (self.overlay_frames is None)
+        if gen_overlays:
+            self.overlay_frames = []
 
         print("START")
 
@@ -167,7 +245,6 @@ class Engine:
         # Print Robco boot-up text, interleaving lines with overlay-frame generation:
         line_num = 0
         can_print = True
-        gen_overlays = True
         while can_print or gen_overlays:
             will_print = (line_num < len(boot_print_queue))
             if can_print:
@@ -195,6 +272,7 @@ class Engine:
                     distort_y += distort_speed
                 else:
                     gen_overlays = False
+                    self.saveOverlayFrames(overlay_key)
 
         self.anim_delay_frames = len(self.overlay_frames)
         self.overlay_frames_count = (2 * self.anim_delay_frames)
@@ -203,17 +281,23 @@ class Engine:
         print("END GENERATE")
 
         # Get coordinates:
-        self.gpsmodule.getCoords(cmdline)
+        cmdline.printText(">GPSD.LOCATE")
+        cmdline.printText("Acquiring GPS Fix...")
+        cmdline.waitForTask(gps_task, "beacon")
+        cmdline.printText("\t(%s,%s)" % (str(self.gpsmodule.lat), str(self.gpsmodule.lon)))
+        cmdline.printText("\tLocality: \"%s\"" % (self.gpsmodule.locality))
 
         # Initial map-downloads:
         cmdline.printText(">MAPS.DOWNLOAD")
         cmdline.printText("\tDownloading Local map...")
         if config.USE_SOUND:
             config.SOUNDS["tapestart"].play()
+        cmdline.waitForTask(local_map_task)
         self.root_parent.localMapPage.drawPage()
         cmdline.printText("\tDownloading World map...")
         if config.USE_SOUND:
             config.SOUNDS["tapestart"].play()
+        cmdline.waitForTask(world_map_task)
         self.root_parent.worldMapPage.drawPage()
         if config.USE_SOUND:
             config.SOUNDS["tapestop"].play()
@@ -229,10 +313,126 @@ class Engine:
         print("END INIT PROCESS")
 
         self.current_tab.resetPage(self.mode_num)
-        tab_canvas, tab_changed = self.drawTab()
+        tab_canvas, tab_changed, tab_rects = self.drawTab()
         self.screen_canvas = tab_canvas.convert()
+        self.draw_image = self.screen_canvas.convert()
+        self.used_frame = 0
         self.updateCanvas("changetab")
 
+    def setDisplayMode(self, flags=0):
+        '''Open display-surface to suit config.SCALEMODE, and work out canvas-to-screen scaling:'''
+
+        scale_mode = self.scale_mode
+        log_mode = (scale_mode is None)
+        if scale_mode is None:
+            scale_mode = config.SCALEMODE
+
+            # SDL-scaled displays need Pygame 2; stretch to fill screen otherwise, as software-scaling always did:
+            if scale_mode == 'hardware' and not hasattr(pygame, 'SCALED'):
+                print("Hardware scaling unavailable, using software scaling")
+                scale_mode = 'software'
+
+        if scale_mode == 'hardware':
+            # Display-surface is canvas-sized, SDL upscales it when presenting:
+            self.screen_scale = (1, 1)
+            self.screen_offset = (0, 0)
+            screen = pygame.display.set_mode(self.canvas_size, flags | pygame.SCALED | pygame.DOUBLEBUF)
+        else:
+            if scale_mode == 'integer':
+                # Largest whole-number scale that fits, centred on screen:
+                scale = max(1, min(self.screen_size[0] // self.canvas_size[0],
+                                   self.screen_size[1] // self.canvas_size[1]))
+                self.screen_scale = (scale, scale)
+            else:
+                self.screen_scale = (float(self.screen_size[0]) / self.canvas_size[0],
+                                     float(self.screen_size[1]) / self.canvas_size[1])
+            self.screen_offset = (int((self.screen_size[0] - (self.canvas_size[0] * self.screen_scale[0])) / 2),
+                                  int((self.screen_size[1] - (self.canvas_size[1] * self.screen_scale[1])) / 2))
+            screen = pygame.display.set_mode(self.screen_size, flags)
+
+        self.scale_mode = scale_mode
+        if log_mode:
+            print('Scale Mode: {0} {1}x{2}'.format(scale_mode, self.screen_scale[0], self.screen_scale[1]))
+        return screen
+
+    def blitToScreen(self, image, rect=None):
+        '''Scale a canvas-sized image (or a rect of it) onto the display, returning the screen-rect drawn to:'''
+
+        if rect is None:
+            rect = self.canvas_rect
+
+        screen_x = int(rect.left * self.screen_scale[0])
+        screen_y = int(rect.top * self.screen_scale[1])
+        screen_rect = pygame.Rect(screen_x + self.screen_offset[0],
+                                  screen_y + self.screen_offset[1],
+                                  int(rect.right * self.screen_scale[0]) - screen_x,
+                                  int(rect.bottom * self.screen_scale[1]) - screen_y)
+
+        if self.scale_mode == 'hardware':
+            self.screen.blit(image, screen_rect, rect)
+        else:
+            # Scale straight into the display-surface, rather than into a new surface:
+            pygame.transform.scale(image.subsurface(rect), screen_rect.size, self.screen.subsurface(screen_rect))
+
+        return screen_rect
+
+    def overlayCacheKey(self, *settings):
+        '''Get hash identifying overlay-frames made from current resolution, tint, settings and source-images:'''
+        key_hash = hashlib.sha1()
+        key_hash.update(repr((self.overlay_cache_version,
+                              self.canvas_size,
+                              tuple(config.TINTCOLOUR),
+                              settings)).encode('utf-8'))
+        for image_name in ("scanline", "distort"):
+            with open(config.IMAGEFILES[image_name], 'rb') as f:
+                key_hash.update(f.read())
+        return key_hash.hexdigest()
+
+    def loadOverlayFrames(self, overlay_key):
+        '''Read overlay-frames from cache-file in one go, if its key matches. Returns None if unavailable'''
+        if not os.path.exists(self.overlay_cache_filename):
+            return None
+
+        with open(self.overlay_cache_filename, 'rb') as f:
+            data = f.read()
+
+        # Header-line: key, width, height, frame-count
+        header_end = data.find(b'\n')
+        try:
+            saved_key, width, height, frame_count = data[:header_end].decode('ascii').split()
+            width, height, frame_count = int(width), int(height), int(frame_count)
+        except ValueError:
+            print("  Invalid overlay-cache, ignoring file")
+            return None
+
+        frame_bytes = (width * height * 3)
+        if (saved_key != overlay_key) or ((width, height) != self.canvas_size) or \
+                (len(data) != (header_end + 1 + (frame_bytes * frame_count))):
+            print("  Overlay-cache is out of date, regenerating")
+            return None
+
+        print("  Loading overlay-frames: %s" % (self.overlay_cache_filename))
+        overlay_frames = []
+        offset = (header_end + 1)
+        for frame_num in range(frame_count):
+            frame = pygame.image.fromstring(data[offset:offset + frame_bytes], self.canvas_size, 'RGB')
+            overlay_frames.append(frame.convert())
+            offset += frame_bytes
+        return overlay_frames
+
+    def saveOverlayFrames(self, overlay_key):
+        '''Write overlay-frames to cache-file as raw RGB pixels:'''
+        print("  Saving overlay-frames: %s" % (self.overlay_cache_filename))
+        header = "%s %s %s %s\n" % (overlay_key, self.canvas_size[0], self.canvas_size[1], len(self.overlay_frames))
+
+        # Write to temporary file first, so an interrupted write can't leave a broken cache:
+        temp_filename = (self.overlay_cache_filename + ".tmp")
+        with open(temp_filename, 'wb') as f:
+            f.write(header.encode('ascii'))
+            for frame in self.overlay_frames:
+                f.write(pygame.image.tostring(frame, 'RGB'))
+        os.rename(temp_filename, self.overlay_cache_filename)
+
     def showBootLogo(self):
         '''Show bootup-logo, play sound:'''
 
@@ -282,11 +482,17 @@ class Engine:
             draw_image.blit(self.overlay_frames[0], (0, 0), None, pygame.BLEND_RGB_MULT)
 
             # Scale up and draw:
-            draw_image = pygame.transform.scale(draw_image, self.screen_size)
-            self.screen.blit(draw_image, (0, 0))
+            self.blitToScreen(draw_image)
             pygame.display.update()
 
-    def updateCanvas(self, update_sound=None):
+    def addDirtyRects(self, rects):
+        '''Mark canvas-rects as needing to be redrawn by drawAll; None marks the whole screen:'''
+        if rects is None:
+            self.dirty_rects = None
+        elif self.dirty_rects is not None:
+            self.dirty_rects.extend(rects)
+
+    def updateCanvas(self, update_sound=None, dirty_rects=None):
         '''Generate black & white outline-image:'''
 
         if config.USE_SOUND and update_sound:
@@ -295,36 +501,82 @@ class Engine:
         # Do focus-in effect when changing tab (i.e. the lit buttons)
         if update_sound == "changetab":
             self.focusInDraw(self.screen_canvas)
+            dirty_rects = None
 
         # Bake the background into the canvas-image:
         if self.background:
-            self.screen_canvas.blit(self.background, (0, 0), None, pygame.BLEND_RGB_ADD)
+            if dirty_rects is None:
+                self.screen_canvas.blit(self.background, (0, 0), None, pygame.BLEND_RGB_ADD)
+            else:
+                for rect in dirty_rects:
+                    self.screen_canvas.blit(self.background, rect, rect, pygame.BLEND_RGB_ADD)
 
-    def drawAll(self):
+        self.addDirtyRects(dirty_rects)
 
-        # Start with copy of display-stuff:
-        #   (generated by updateCanvas)
-        draw_image = self.screen_canvas.convert()
+    def drawAll(self):
 
         # Don't tint camera-output if VATS mode is set to untinted:
         is_vats = (self.current_tab.name == 'V.A.T.S.')
-        if not is_vats or self.current_tab.showTint:
+        use_tint = (not is_vats or self.current_tab.showTint)
+
+        # Pick scanlines/tint frame: (animation is paused while idle)
+        use_frame = 0
+        if not (is_vats or self.idle):
+            use_frame = (self.frame_num - self.anim_delay_frames)
+            if use_frame < 0:
+                use_frame = 0
+
+        # Animated distortion-line has moved, so redraw the area it left and entered:
+        if use_tint and (use_frame != self.used_frame):
+            self.addDirtyRects([self.overlay_rects[self.used_frame], self.overlay_rects[use_frame]])
+        self.used_frame = use_frame
+
+        # Refresh profiler-HUD about once a second:
+        if self.show_hud:
+            if (self.hud_image is None) or (self.frame_num % config.FPS == 0):
+                self.hud_image = self.profiler.drawHud()
+            self.addDirtyRects([self.hud_image.get_rect(topleft=self.hud_pos)])
+
+        dirty_rects = self.dirty_rects
+        if dirty_rects is not None:
+            dirty_rects = [rect.clip(self.canvas_rect) for rect in dirty_rects]
+            dirty_rects = [rect for rect in dirty_rects if rect.width and rect.height]
+            if rectsCoverage(dirty_rects) > self.max_dirty_coverage:
+                dirty_rects = None
+
+        if dirty_rects is None:
+            draw_rects = [self.canvas_rect]
+        else:
+            draw_rects = dirty_rects
+
+        screen_rects = []
+        for rect in draw_rects:
+            # Start with copy of display-stuff:
+            #   (generated by updateCanvas)
+            self.draw_image.blit(self.screen_canvas, rect, rect)
 
             # Add scanlines/tint:
-            use_frame = 0
-            if not is_vats:
-                use_frame = (self.frame_num - self.anim_delay_frames)
-                if use_frame < 0:
-                    use_frame = 0
-            draw_image.blit(self.overlay_frames[use_frame], (0, 0), None, pygame.BLEND_RGB_MULT)
-
-        # Make screen extra-bright in torch-mode:
-        if self.torch_mode:
-            draw_image.fill((0, 128, 0), None, pygame.BLEND_ADD)
-
-        draw_image = pygame.transform.scale(draw_image, self.screen_size)
-        self.screen.blit(draw_image, (0, 0))
-        pygame.display.update()
+            if use_tint:
+                self.draw_image.blit(self.overlay_frames[use_frame], rect, rect, pygame.BLEND_RGB_MULT)
+
+            # Make screen extra-bright in torch-mode:
+            if self.torch_mode:
+                self.draw_image.fill((0, 128, 0), rect, pygame.BLEND_ADD)
+
+            if self.show_hud:
+                self.draw_image.set_clip(rect)
+                self.draw_image.blit(self.hud_image, self.hud_pos)
+                self.draw_image.set_clip(None)
+
+            # Scale rect up to matching screen-area:
+            screen_rects.append(self.blitToScreen(self.draw_image, rect))
+
+        if dirty_rects is None:
+            pygame.display.update()
+        elif screen_rects:
+            pygame.display.update(screen_rects)
+
+        self.dirty_rects = []
 
         # Vary hum-volume:
         if config.USE_SOUND:
@@ -346,6 +598,7 @@ class Engine:
     drawn_page = []
 
     def drawTab(self):
+        '''Composite current page, header and footer; returns canvas, changed-flag and dirty-rects (None if all changed)'''
 
         page_nums = [self.tab_num, self.mode_num]
         tab = self.current_tab
@@ -356,180 +609,284 @@ class Engine:
 
         canvas_change = (page_changed or header_changed or different_page)
 
+        # Work out which parts of the tab-canvas need recompositing:
+        dirty_rects = []
+        if different_page:
+            dirty_rects = None
+        else:
+            if page_changed:
+                page_rects = getattr(tab, 'dirtyRects', None)
+                if page_rects is None:
+                    dirty_rects = None
+                else:
+                    dirty_rects.extend(page_rects)
+            if header_changed and (dirty_rects is not None):
+                dirty_rects.append(tab.header.dirtyRect)
+            if dirty_rects is not None:
+                dirty_rects = mergeRects(dirty_rects)
+
         if canvas_change:
             # print("%s tab_changed: Page:%s Head:%s Different:%s %s" % (tab.name,
             #                                                           page_changed,
             #                                                           header_changed,
             #                                                           different_page,
             #                                                           str(page_nums)))
-            tab.canvas = page_canvas.convert()
-            tab.canvas.blit(header_canvas, (0, 0), None, pygame.BLEND_ADD)
-            tab.canvas.blit(tab.footerImgs[self.mode_num], (0, 0), None, pygame.BLEND_ADD)
+            if dirty_rects is None:
+                tab.canvas = page_canvas.convert()
+                tab.canvas.blit(header_canvas, (0, 0), None, pygame.BLEND_ADD)
+                tab.canvas.blit(tab.footerImgs[self.mode_num], (0, 0), None, pygame.BLEND_ADD)
+            else:
+                for rect in dirty_rects:
+                    tab.canvas.blit(page_canvas, rect, rect)
+                    tab.canvas.blit(header_canvas, rect, rect, pygame.BLEND_ADD)
+                    tab.canvas.blit(tab.footerImgs[self.mode_num], rect, rect, pygame.BLEND_ADD)
 
         self.drawn_page = page_nums
 
-        return tab.canvas, canvas_change
-
-    def run(self):
-        '''Main Loop'''
+        return tab.canvas, canvas_change, dirty_rects
+
+    def serialCommand(self, command, mode_vals, page_events):
+        '''Apply a line from the serial-controller, adding to this frame's mode-values/page-events:'''
+        ser_mouse_dist = 10
+
+        if not isReading(command):
+            self.last_input_tick = pygame.time.get_ticks()
+
+        if command == 'lighton':              # Torch On
+            self.torch_mode = True
+        elif command == 'lightoff':           # Torch Off
+            self.torch_mode = False
+        elif command == '1':
+            self.tab_num = 0
+        elif command == '2':
+            self.tab_num = 1
+        elif command == '3':
+            self.tab_num = 2
+        elif command == 'q':
+            self.mode_num = 0
+        elif command == 'w':
+            self.mode_num = 1
+        elif command == 'e':
+            self.mode_num = 2
+        elif command == 'r':
+            self.mode_num = 3
+        elif command == 't':
+            self.mode_num = 4
+        elif command == 'select':             # Select
+            page_events.append('sel')
+        elif command == 'cursorup':           # List up
+            mode_vals[2] += 1
+        elif command == 'cursordown':         # List down
+            mode_vals[2] -= 1
+        elif command == 'left':               # Mouse left
+            mode_vals[0] -= ser_mouse_dist
+        elif command == 'right':              # Mouse right
+            mode_vals[0] += ser_mouse_dist
+        elif command == 'up':                 # Mouse up
+            mode_vals[1] += ser_mouse_dist
+        elif command == 'down':               # Mouse down
+            mode_vals[1] -= ser_mouse_dist
+        elif command.startswith('volts'):     # Battery Voltage
+            page_events.append(command)
+        elif command.startswith('temp'):      # Temperature
+            page_events.append(command)
+        elif command == 'hud':                # Toggle profiler-HUD
+            self.toggleHud()
+
+    def toggleHud(self):
+        '''Show/hide frame-profiler overlay:'''
+        self.show_hud = not self.show_hud
+        self.hud_image = None
+        # Redraw whole screen to clear HUD away:
+        self.addDirtyRects(None)
+
+    def runFrame(self, commands=()):
+        '''Process input and draw one frame; commands are extra serial-style command lines. Returns False on quit'''
         running = True
-        while running:
-
-            tab_was = self.tab_num
-            mode_was = self.mode_num
-            torch_was = self.torch_mode
-            mode_vals = [0, 0, 0]
-
-            page_events = []
-
-            do_update = False
-            update_sound = None
-
-            if config.USE_SERIAL:
-                # Run through serial-buffer characters, converting to pygame events if required:
-                ser = self.ser
-                ser_mouse_dist = 10
-                try:
-                    while ser.inWaiting():
-                        char = ser.read(1)
-
-                        if char != '\n' and char != '\r':
-                            self.ser_buffer = (self.ser_buffer + char)
-                            # print char
-                        else:
-                            ser_buffer = self.ser_buffer
-                            # print ser_buffer
-
-                            if ser_buffer == 'lighton':              # Torch On
-                                self.torch_mode = True
-                            elif ser_buffer == 'lightoff':           # Torch Off
-                                self.torch_mode = False
-                            elif ser_buffer == '1':
-                                self.tab_num = 0
-                            elif ser_buffer == '2':
-                                self.tab_num = 1
-                            elif ser_buffer == '3':
-                                self.tab_num = 2
-                            elif ser_buffer == 'q':
-                                self.mode_num = 0
-                            elif ser_buffer == 'w':
-                                self.mode_num = 1
-                            elif ser_buffer == 'e':
-                                self.mode_num = 2
-                            elif ser_buffer == 'r':
-                                self.mode_num = 3
-                            elif ser_buffer == 't':
-                                self.mode_num = 4
-                            elif ser_buffer == 'select':             # Select
-                                page_events.append('sel')
-                            elif ser_buffer == 'cursorup':           # List up
-                                mode_vals[2] += 1
-                            elif ser_buffer == 'cursordown':         # List down
-                                mode_vals[2] -= 1
-                            elif ser_buffer == 'left':               # Mouse left
-                                mode_vals[0] -= ser_mouse_dist
-                            elif ser_buffer == 'right':              # Mouse right
-                                mode_vals[0] += ser_mouse_dist
-                            elif ser_buffer == 'up':                 # Mouse up
-                                mode_vals[1] += ser_mouse_dist
-                            elif ser_buffer == 'down':               # Mouse down
-                                mode_vals[1] -= ser_mouse_dist
-                            elif ser_buffer.startswith('volts'):     # Battery Voltage
-                                page_events.append(ser_buffer)
-                            elif ser_buffer.startswith('temp'):      # Temperature
-                                page_events.append(ser_buffer)
-
-                            # Clear serial buffer:
-                            self.ser_buffer = ""
-                except:
-                    print("Serial-port failure!")
-                    config.USE_SERIAL = False
-
-            # Run through Pygame's keyboard/mouse event-queue:
-            for event in pygame.event.get():
-                # print event
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    page_events.append('sel')
-                elif event.type == pygame.MOUSEMOTION:
-                    mouse_x, mouse_y = pygame.mouse.get_rel()
-                    mode_vals[0] += mouse_x
-                    mode_vals[1] += mouse_y
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        running = False
-                    elif event.key == pygame.K_o:  # Torch On
-                        self.torch_mode = True
-                    elif event.key == pygame.K_p:  # Torch Off
-                        self.torch_mode = False
-                    elif event.key == pygame.K_1:
-                        self.tab_num = 0
-                    elif event.key == pygame.K_2:
-                        self.tab_num = 1
-                    elif event.key == pygame.K_3:
-                        self.tab_num = 2
-                    elif event.key == pygame.K_q:
-                        self.mode_num = 0
-                    elif event.key == pygame.K_w:
-                        self.mode_num = 1
-                    elif event.key == pygame.K_e:
-                        self.mode_num = 2
-                    elif event.key == pygame.K_r:
-                        self.mode_num = 3
-                    elif event.key == pygame.K_t:
-                        self.mode_num = 4
-                    elif event.key == pygame.K_RETURN:
-                        page_events.append('sel')
-                    elif event.key == pygame.K_UP:  # List up
-                        mode_vals[2] += 1
-                    elif event.key == pygame.K_DOWN:  # List down
-                        mode_vals[2] -= 1
-
-            if (mode_vals != [0, 0, 0]):
-                page_events.append(mode_vals)
-
-            changed_tab = (self.tab_num != tab_was)
-            changed_mode = (self.mode_num != mode_was)
-            changed_torch = (self.torch_mode != torch_was)
-
-            if changed_torch:
-                if self.torch_mode:
-                    update_sound = "lighton"
-                else:
-                    update_sound = "lightoff"
+        profiler = self.profiler
+        profiler.startFrame()
 
-            if changed_tab:
-                update_sound = "changetab"
+        tab_was = self.tab_num
+        mode_was = self.mode_num
+        torch_was = self.torch_mode
+        mode_vals = [0, 0, 0]
 
-            do_update = (changed_torch or changed_tab or changed_mode)
+        page_events = []
 
-            if do_update:
-                self.current_tab = self.tabs[self.tab_num]
-                self.current_tab.resetPage(self.mode_num)
+        do_update = False
+        update_sound = None
 
-            # Update current tab, see if it's changed:
-            tab_canvas, tab_changed = self.drawTab()
-            if do_update or tab_changed:
-                # updateCanvas will add background to this:
+        if config.USE_SERIAL:
+            # Run through lines queued by serial-reader thread:
+            for line_time, line in self.ser.getLines():
+                # print line
+                self.serialCommand(line, mode_vals, page_events)
+
+        for command in commands:
+            self.serialCommand(command, mode_vals, page_events)
+        profiler.mark("serial")
+
+        # Run through Pygame's keyboard/mouse event-queue:
+        for event in pygame.event.get():
+            # print event
+            self.last_input_tick = pygame.time.get_ticks()
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                page_events.append('sel')
+            elif event.type == pygame.MOUSEMOTION:
+                mouse_x, mouse_y = pygame.mouse.get_rel()
+                mode_vals[0] += mouse_x
+                mode_vals[1] += mouse_y
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_o:  # Torch On
+                    self.torch_mode = True
+                elif event.key == pygame.K_p:  # Torch Off
+                    self.torch_mode = False
+                elif event.key == pygame.K_1:
+                    self.tab_num = 0
+                elif event.key == pygame.K_2:
+                    self.tab_num = 1
+                elif event.key == pygame.K_3:
+                    self.tab_num = 2
+                elif event.key == pygame.K_q:
+                    self.mode_num = 0
+                elif event.key == pygame.K_w:
+                    self.mode_num = 1
+                elif event.key == pygame.K_e:
+                    self.mode_num = 2
+                elif event.key == pygame.K_r:
+                    self.mode_num = 3
+                elif event.key == pygame.K_t:
+                    self.mode_num = 4
+                elif event.key == pygame.K_RETURN:
+                    page_events.append('sel')
+                elif event.key == pygame.K_UP:  # List up
+                    mode_vals[2] += 1
+                elif event.key == pygame.K_DOWN:  # List down
+                    mode_vals[2] -= 1
+                elif event.key == pygame.K_h:  # Toggle profiler-HUD
+                    self.toggleHud()
+
+        if (mode_vals != [0, 0, 0]):
+            page_events.append(mode_vals)
+        profiler.mark("events")
+
+        changed_tab = (self.tab_num != tab_was)
+        changed_mode = (self.mode_num != mode_was)
+        changed_torch = (self.torch_mode != torch_was)
+
+        if changed_torch:
+            if self.torch_mode:
+                update_sound = "lighton"
+            else:
+                update_sound = "lightoff"
+
+        if changed_tab:
+            update_sound = "changetab"
+
+        do_update = (changed_torch or changed_tab or changed_mode)
+
+        if do_update:
+            self.current_tab = self.tabs[self.tab_num]
+            self.current_tab.resetPage(self.mode_num)
+
+        # Update current tab, see if it's changed:
+        tab_canvas, tab_changed, tab_rects = self.drawTab()
+        profiler.mark("drawTab")
+        if do_update:
+            tab_rects = None
+        if do_update or tab_changed:
+            # updateCanvas will add background to this:
+            if tab_rects is None:
                 self.screen_canvas = tab_canvas.convert()
-                do_update = True
+            else:
+                for rect in tab_rects:
+                    self.screen_canvas.blit(tab_canvas, rect, rect)
+            do_update = True
 
-            if do_update or update_sound:
-                self.updateCanvas(update_sound)
+        if do_update or update_sound:
+            self.updateCanvas(update_sound, tab_rects)
+        profiler.mark("updateCanvas")
+        self.page_dirty = do_update
 
-            if len(page_events) != 0:
-                self.current_tab.ctrlEvents(page_events, self.mode_num)
+        if len(page_events) != 0:
+            self.current_tab.ctrlEvents(page_events, self.mode_num)
+        profiler.mark("ctrlEvents")
 
-            self.drawAll()
+        self.drawAll()
+        profiler.mark("drawAll")
 
-            self.clock.tick(config.FPS)
+        return running
+
+    def quit(self):
+        '''Close devices and shut down Pygame:'''
+        self.profiler.dump()
 
         if config.USE_SERIAL:
             self.ser.close()
 
         pygame.quit()
 
+    def waitForInput(self, timeout_ms):
+        '''Sleep for up to timeout_ms, waking early on keyboard/mouse or serial input. Returns True if woken by input'''
+        end_tick = pygame.time.get_ticks() + timeout_ms
+        while pygame.time.get_ticks() < end_tick:
+            if pygame.event.peek():
+                return True
+            if config.USE_SERIAL and self.ser.hasInput():
+                return True
+            pygame.time.wait(self.input_poll_ms)
+        return False
+
+    def blankScreen(self):
+        '''Power-save: blank display and silence hum, until input arrives:'''
+        print("BLANK SCREEN")
+        self.blanked = True
+        self.screen.fill((0, 0, 0))
+        pygame.display.update()
+        if config.USE_SOUND:
+            self.humsound.set_volume(0)
+
+        while not self.waitForInput(1000):
+            pass
+
+        print("WAKE SCREEN")
+        self.blanked = False
+        self.last_input_tick = pygame.time.get_ticks()
+        self.addDirtyRects(None)
+        if config.USE_SOUND:
+            self.humsound.set_volume(self.humvolume)
+
+    def pace(self):
+        '''Wait until next frame is due; frame-rate drops when there's been no input for a while:'''
+        idle_ms = (pygame.time.get_ticks() - self.last_input_tick)
+
+        if config.BLANKTIME and (idle_ms > (1000 * config.BLANKTIME)):
+            self.blankScreen()
+            self.clock.tick()
+        elif (idle_ms > (1000 * config.IDLETIME)) and not self.page_dirty:
+            self.idle = True
+            self.waitForInput(1000 / config.IDLEFPS)
+            self.clock.tick()
+        else:
+            self.idle = False
+            self.clock.tick(config.FPS)
+
+    def run(self):
+        '''Main Loop'''
+        running = True
+        self.last_input_tick = pygame.time.get_ticks()
+        while running:
+            running = self.runFrame()
+
+            self.pace()
+            self.profiler.mark("tick")
+
+        self.quit()
+
 if __name__ == '__main__':
     engine = Engine()
     engine.run()
@@ -0,0 +1,359 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Headless render benchmark
+#
+# Boots the Engine with SDL's dummy video/audio drivers and no serial, camera, GPS or internet,
+# then tours every tab/mode and prints frame-time percentiles, boot time and peak RSS as JSON:
+#   python pipboy_bench.py [--frames 60] [--output bench.json]
+#
+# With --standin, caches aren't pre-populated; maps/places/geocoding are fetched from a local stand-in server
+# (pipboy_standin.py) instead. Boot-time then measures a cold boot, or a warm one if PIPBOY_CACHEPATH is re-used:
+#   PIPBOY_CACHEPATH=/tmp/pipboy python pipboy_bench.py --standin [--latency 100] [--fail-rate 0.1]
+#
+# With --gps, GPS is read from a gpsd stand-in (pipboy_gpsreplay.py, needs the gps library) instead; this times
+# first-fix handling for cold-start/fix-loss/no-device/no-gpsd cases, then measures map re-centring on the
+# Local map page while a fast track is replayed. Maps for the moving position are fetched from the stand-in server:
+#   python pipboy_bench.py --gps [--gps-rate 20] [--gps-seconds 10]
+
+import os
+import sys
+import time
+import json
+import random
+import resource
+import argparse
+import tempfile
+
+# Must be set up before config is imported:
+os.environ['PIPBOY_HEADLESS'] = '1'
+if ('--standin' in sys.argv) or ('--gps' in sys.argv):
+    os.environ['PIPBOY_PROVIDER'] = 'standin'
+if '--gps' in sys.argv:
+    os.environ['PIPBOY_GPS'] = '1'
+if 'PIPBOY_CACHEPATH' not in os.environ:
+    os.environ['PIPBOY_CACHEPATH'] = tempfile.mkdtemp(prefix='pipboy_bench_')
+
+# Images/fonts/sounds are loaded via relative paths:
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import config
+from gdal2tiles import SharedMercator
+from pipboy_gps import GpsModuleClass, GpsStream, noFix
+import pipboy_tab_data_maps as dataMap
+import pipboy_tiles
+import pipboy_cache
+import pipboy_standin
+import pipboy_gpsreplay
+import main
+
+# Stand-in position, used instead of GPS/geocoding:
+BENCH_LAT, BENCH_LON = 38.8951, -77.0364
+BENCH_LOCALITY = "Washington"
+BENCH_PLACE_COUNT = 60
+
+# Serial-controller commands for selecting each tab/mode:
+TAB_COMMANDS = ['1', '2', '3']
+MODE_COMMANDS = ['q', 'w', 'e', 'r', 't']
+
+# Cursor-moves used to pan across map pages:
+PAN_COMMANDS = (['right'] * 20) + (['down'] * 20) + (['left'] * 20) + (['up'] * 20)
+ZOOM_COMMANDS = (['cursordown'] * 4) + (['cursorup'] * 4)
+
+# gpsd stand-in: Engine connects to gpsd's own port, first-fix cases use the ports after it:
+GPS_PORT = 2947
+GPS_TRACK_SPEED = 15.0
+FIX_CASES = [
+    ('cold_start', {'fixDelay': 2.0}),
+    ('warm_start', {}),
+    ('fix_loss', {'fixLoss': 0.5, 'jitter': 5.0}),
+    ('no_device', {'noDevice': True}),
+    ('no_gpsd', None),
+]
+
+
+def percentiles(samples):
+    '''Summarise a list of frame-times (seconds) as millisecond percentiles:'''
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(1000.0 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    return {
+        'frames': len(ordered),
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'max': round(1000.0 * ordered[-1], 3),
+    }
+
+
+def peakRss():
+    '''Peak resident-set size of this process, in KB:'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak
+
+
+def writeMapCache(mapName, mapZoom, lat, lon, mapLocation, places):
+    '''Generate a stand-in map image/data-file in the cache-folder, so map pages load without downloading:'''
+    mapSize = dataMap.Mode_Map.mapSize
+    imageSize = (mapSize * dataMap.Mode_Map.mapScale)
+
+    # Noisy image, so scaling/blitting costs are representative:
+    mapImage = pygame.Surface((imageSize, imageSize))
+    rng = random.Random(0)
+    blockSize = 32
+    for y in range(0, imageSize, blockSize):
+        for x in range(0, imageSize, blockSize):
+            grey = rng.randint(10, 80)
+            mapImage.fill((grey, grey, grey), (x, y, blockSize, blockSize))
+    pygame.image.save(mapImage, "%s/map_%s.jpg" % (config.CACHEPATH, mapName))
+
+    # Same bounds-calculation as Mode_Map.getMapBounds:
+    mercator = SharedMercator()
+    mx, my = mercator.LatLonToMeters(lat, lon)
+    px, py = mercator.MetersToPixels(mx, my, mapZoom)
+    halfMapSize = mapSize / 2
+    minLat, minLon = mercator.MetersToLatLon(*mercator.PixelsToMeters(px - halfMapSize, py - halfMapSize, mapZoom))
+    maxLat, maxLon = mercator.MetersToLatLon(*mercator.PixelsToMeters(px + halfMapSize, py + halfMapSize, mapZoom))
+
+    pipboy_cache.saveCache("%s/map_%s.json" % (config.CACHEPATH, mapName), dataMap.Mode_Map.saveVersion, {
+        'mapLocation': mapLocation,
+        'bounds': [minLat, minLon, maxLat, maxLon],
+        'places': places,
+    })
+
+
+def writeTileCache(mapName, mapZoom, lat, lon, tileRadius=6):
+    '''Generate stand-in tiles around a position in the tile disk-cache:'''
+    tileZoom = mapZoom + 1
+    mercator = SharedMercator()
+    mx, my = mercator.LatLonToMeters(lat, lon)
+    centreX, centreY = mercator.MetersToTile(mx, my, tileZoom)
+
+    rng = random.Random(2)
+    tile = pygame.Surface((mercator.tileSize, mercator.tileSize))
+    for tx in range(centreX - tileRadius, centreX + tileRadius + 1):
+        for ty in range(centreY - tileRadius, centreY + tileRadius + 1):
+            grey = rng.randint(10, 80)
+            tile.fill((grey, grey, grey))
+            filename = pipboy_tiles.tileFilename(mapName, tileZoom, tx, ty)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            # Cache-files hold the tile-server's image data as-is, so use a real image format:
+            pygame.image.save(tile, filename + ".png")
+            os.rename(filename + ".png", filename)
+
+
+def prepareStandIns(seedCaches=True):
+    '''Fake GPS position/locality and pre-populate map caches:'''
+    GpsModuleClass.lat, GpsModuleClass.lon = BENCH_LAT, BENCH_LON
+    GpsModuleClass.position = noFix._replace(lat=BENCH_LAT, lon=BENCH_LON)
+    GpsModuleClass.localityLat, GpsModuleClass.localityLon = BENCH_LAT, BENCH_LON
+
+    # Otherwise, locality and maps come from the stand-in server:
+    if not seedCaches:
+        return
+    GpsModuleClass.locality = BENCH_LOCALITY
+
+    writeMapCache('local', 18, BENCH_LAT, BENCH_LON, "%s,%s" % (str(BENCH_LAT), str(BENCH_LON)), [])
+    writeTileCache('local_map', 18, BENCH_LAT, BENCH_LON)
+
+    # Scatter places across the world-map:
+    rng = random.Random(1)
+    icons = ['military', 'office', 'vault', 'cave', 'factory', 'monument', 'settlement', 'metro', 'ruins_town']
+    spread = 0.03
+    places = []
+    for n in range(BENCH_PLACE_COUNT):
+        places.append({
+            'name': "Place %s" % (n),
+            'icon': rng.choice(icons),
+            'lat': BENCH_LAT + rng.uniform(-spread, spread),
+            'lon': BENCH_LON + rng.uniform(-spread, spread),
+        })
+    writeMapCache('world', 14, BENCH_LAT, BENCH_LON, BENCH_LOCALITY, places)
+    writeTileCache('world_map', 14, BENCH_LAT, BENCH_LON)
+
+
+def tourSteps(engine, frameCount):
+    '''Yield (step-name, commands) for each frame of a tour through every tab/mode:'''
+    for tabNum, tab in enumerate(engine.tabs):
+        for modeNum in range(len(MODE_COMMANDS)):
+            stepName = "%s/%s" % (tab.name, tab.modeNames[modeNum])
+
+            # Switch to page:
+            yield stepName, [TAB_COMMANDS[tabNum], MODE_COMMANDS[modeNum]]
+
+            # Scroll through status sub-pages, and back:
+            if isinstance(tab.modes[modeNum], main.Tab_Stats.Mode_Status):
+                subPageCount = len(tab.modes[modeNum].subPages)
+                for n in range(subPageCount):
+                    yield stepName + ":scroll", ['cursordown']
+                for n in range(subPageCount):
+                    yield stepName + ":scroll", ['cursorup']
+
+            # Pan around map pages:
+            if isinstance(tab.modes[modeNum], dataMap.Mode_Map):
+                for command in PAN_COMMANDS:
+                    yield stepName + ":pan", [command]
+
+                # Zoom out through map-levels, and back in:
+                for command in ZOOM_COMMANDS:
+                    yield stepName + ":zoom", [command]
+
+            # Idle frames, e.g. header-clock/scanline animation only:
+            for n in range(frameCount):
+                yield stepName, []
+
+
+def runBenchmark(frameCount, standin=False, latency=0.0, failRate=0.0):
+    if standin:
+        standinPort = int(config.STANDINURL.rsplit(':', 1)[1])
+        pipboy_standin.startServer(standinPort, latency, failRate)
+    prepareStandIns(seedCaches=not standin)
+
+    bootStart = time.time()
+    engine = main.Engine()
+    bootTime = time.time() - bootStart
+
+    frameTimes = {}
+    allTimes = []
+    for stepName, commands in tourSteps(engine, frameCount):
+        frameStart = time.time()
+        engine.runFrame(commands)
+        frameTime = time.time() - frameStart
+
+        frameTimes.setdefault(stepName, []).append(frameTime)
+        allTimes.append(frameTime)
+
+    results = {
+        'resolution': [config.WIDTH, config.HEIGHT],
+        'screen': list(engine.screen_size),
+        'scale_mode': engine.scale_mode,
+        'map_source': config.MAPSOURCE,
+        'provider': config.MAPPROVIDER,
+        'boot_seconds': round(bootTime, 3),
+        'peak_rss_kb': peakRss(),
+        'overall': percentiles(allTimes),
+        'pages': dict((name, percentiles(times)) for name, times in frameTimes.items()),
+        'stages': dict((stageName, {'p50': round(p50, 3), 'p99': round(p99, 3)})
+                       for stageName, p50, p99 in engine.profiler.summary()),
+    }
+
+    engine.quit()
+    return results
+
+
+def timeToFix(port, timeout=30):
+    '''Time from starting a GPS stream until it has a fix, or gives up on gpsd/device:'''
+    stream = GpsStream(port=str(port))
+    start = time.time()
+    stream.start()
+    stream.ready.wait(timeout)
+    return (time.time() - start), stream.fix.mode
+
+
+def runGpsBenchmark(rate=20.0, seconds=10.0):
+    # First-fix handling, each case on its own stand-in port:
+    track = pipboy_gpsreplay.generateTrack(BENCH_LAT, BENCH_LON, GPS_TRACK_SPEED)
+    fixResults = {}
+    for caseNum, (caseName, options) in enumerate(FIX_CASES):
+        port = (GPS_PORT + 1 + caseNum)
+        if options is not None:
+            pipboy_gpsreplay.startServer(port, track, **options)
+        readySeconds, mode = timeToFix(port)
+        fixResults[caseName] = {
+            'seconds': round(readySeconds, 3),
+            # Time beyond the stand-in's own first-fix delay:
+            'overhead_seconds': round(readySeconds - (options or {}).get('fixDelay', 0), 3),
+            'mode': mode,
+        }
+
+    # Re-centring while a fast track is replayed; the track moves off the pre-populated maps, so
+    # refreshes fetch new ones from the stand-in server:
+    pipboy_gpsreplay.startServer(GPS_PORT, track, rate=rate)
+    pipboy_standin.startServer(int(config.STANDINURL.rsplit(':', 1)[1]))
+    prepareStandIns()
+
+    bootStart = time.time()
+    engine = main.Engine()
+    bootTime = time.time() - bootStart
+
+    # Local map page:
+    mapPage = engine.tabs[2].modes[0]
+    engine.runFrame(['3', 'q'])
+
+    frameTimes = []
+    positionsSeen, markerMoves, refreshesStarted, refreshesApplied = 0, 0, 0, 0
+    lastPosition = None
+    runStart = time.time()
+    while (time.time() - runStart) < seconds:
+        position = mapPage.rootParent.gpsModule.position
+        curPos = (mapPage.curPosX, mapPage.curPosY)
+        # Page has no mapLocation until its first map has loaded:
+        refreshTask, mapLocation = mapPage.refreshTask, getattr(mapPage, 'mapLocation', None)
+
+        frameStart = time.time()
+        engine.runFrame()
+        frameTimes.append(time.time() - frameStart)
+
+        if position is not lastPosition:
+            positionsSeen += 1
+            lastPosition = position
+        if (mapPage.curPosX, mapPage.curPosY) != curPos:
+            markerMoves += 1
+        if (refreshTask is None) and (mapPage.refreshTask is not None):
+            refreshesStarted += 1
+        # First map to load isn't a refresh:
+        if (mapLocation is not None) and (mapPage.mapLocation != mapLocation):
+            refreshesApplied += 1
+    runTime = time.time() - runStart
+
+    results = {
+        'map_source': config.MAPSOURCE,
+        'boot_seconds': round(bootTime, 3),
+        'time_to_fix': fixResults,
+        'recentring': {
+            'replay_rate': rate,
+            'track_speed': (GPS_TRACK_SPEED * rate),
+            'seconds': round(runTime, 3),
+            'positions_per_second': round(positionsSeen / runTime, 3),
+            'marker_moves': markerMoves,
+            'refreshes_started': refreshesStarted,
+            'refreshes_applied': refreshesApplied,
+            'frames': percentiles(frameTimes),
+        },
+        'peak_rss_kb': peakRss(),
+    }
+
+    engine.quit()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless RasPipBoy render benchmark")
+    parser.add_argument('--frames', type=int, default=60, help="Idle frames to render on each page")
+    parser.add_argument('--output', help="Write JSON results to this file, rather than stdout")
+    parser.add_argument('--standin', action='store_true', help="Fetch data from local stand-in server, not caches")
+    parser.add_argument('--latency', type=float, default=0, help="Stand-in server's added delay per request, in ms")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of stand-in requests that fail")
+    parser.add_argument('--gps', action='store_true', help="Benchmark GPS handling via local gpsd stand-in")
+    parser.add_argument('--gps-rate', type=float, default=20, help="gpsd stand-in's track replay-speed multiplier")
+    parser.add_argument('--gps-seconds', type=float, default=10, help="Seconds to replay track for")
+    args = parser.parse_args()
+
+    if args.gps:
+        results = runGpsBenchmark(args.gps_rate, args.gps_seconds)
+    else:
+        results = runBenchmark(args.frames, args.standin, args.latency / 1000.0, args.fail_rate)
+    resultsJson = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(resultsJson + "\n")
+    else:
+        print(resultsJson)
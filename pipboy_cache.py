@@ -0,0 +1,34 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Versioned JSON cache-files
+
+import os
+import json
+
+
+def saveCache(filename, version, data):
+    '''Write dict to a versioned cache-file, via a temporary file so a half-written cache is never read:'''
+    doc = dict(data)
+    doc['version'] = version
+
+    tempFilename = (filename + ".tmp")
+    with open(tempFilename, 'w') as f:
+        json.dump(doc, f)
+    os.rename(tempFilename, filename)
+
+
+def loadCache(filename, version):
+    '''Read dict from a cache-file, or None if it's missing, unreadable or a different version:'''
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'r') as f:
+            doc = json.load(f)
+    except (IOError, ValueError) as err:
+        print("  Unreadable cache-file %s (%s), ignoring file" % (filename, err))
+        return None
+
+    if (not isinstance(doc, dict)) or (doc.get('version') != version):
+        print("  Invalid cache-version, ignoring file")
+        return None
+    return doc
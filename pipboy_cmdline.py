@@ -19,7 +19,7 @@ class CmdLineClass:
         self.canvas = pygame.Surface(self.parent.canvasSize)
 
         # Use scanlines as base, with tint:
-        self.baseOverlay = self.parent.scanLines.convert()
+        self.baseOverlay = self.parent.scanlines.convert()
         self.baseOverlay.fill(config.TINTCOLOUR, None, pygame.BLEND_RGB_MULT)
         self.cursorRect = [0, 0, config.charWidth, config.charWidth]
         self.cursorYoffset = (config.charHeight - config.charWidth - 4)
@@ -30,6 +30,46 @@ class CmdLineClass:
 
         self.maxCursorY = config.HEIGHT - (3 * config.charHeight)
 
+    def drawScreen(self, showCursor=True):
+        '''Display printed text, with optional cursor:'''
+
+        # Generate draw-image, including cursor:
+        drawImage = self.canvas.convert()
+        if showCursor:
+            pygame.draw.rect(drawImage, config.DRAWCOLOUR, self.cursorRect, 0)
+
+        drawImage.blit(self.parent.background, (0, 0), None, pygame.BLEND_RGB_ADD)
+        drawImage.blit(self.baseOverlay, (0, 0), None, pygame.BLEND_RGB_MULT)
+
+        # Scale up and display:
+        self.parent.blitToScreen(drawImage)
+
+        pygame.display.update()
+
+    def waitForTask(self, task, loopSound=None):
+        '''Blink cursor until a background-task has finished, optionally looping a sound meanwhile.
+        Returns task's result, or None if it failed:'''
+        if task.is_alive() and config.USE_SOUND and loopSound:
+            config.SOUNDS[loopSound].play(loops=-1)
+
+        blinkOn = False
+        while task.is_alive():
+            if not config.QUICKLOAD:
+                blinkOn = not blinkOn
+                self.drawScreen(blinkOn)
+            task.join(0.25)
+
+        if config.USE_SOUND and loopSound:
+            config.SOUNDS[loopSound].stop()
+
+        # Show failures in boot-log; callers carry on without the task's result:
+        if task.error is not None:
+            self.printText("\tFAILED: %s" % (task.error))
+
+        if not config.QUICKLOAD:
+            self.drawScreen()
+        return task.result
+
     def printText(self, thisLine):
         if config.QUICKLOAD:
             print(thisLine)
@@ -85,18 +125,7 @@ class CmdLineClass:
                     else:
                         self.cursorRect[0] = (printX + 1)
 
-                    # Generate draw-image, including cursor:
-                    drawImage = self.canvas.convert()
-                    pygame.draw.rect(drawImage, config.DRAWCOLOUR, self.cursorRect, 0)
-
-                    drawImage.blit(self.parent.background, (0, 0), None, pygame.BLEND_RGB_ADD)
-                    drawImage.blit(self.baseOverlay, (0, 0), None, pygame.BLEND_RGB_MULT)
-
-                    # Scale up and display:
-                    drawImage = pygame.transform.scale(drawImage, self.parent.screenSize)
-                    self.parent.screen.blit(drawImage, (0, 0))
-
-                    pygame.display.update()
+                    self.drawScreen()
                     # self.clock.tick(config.FPS)
                     # print self.parent.clock.get_fps()
 
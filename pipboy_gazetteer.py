@@ -0,0 +1,192 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Offline reverse-geocoding, via a local gazetteer in a k-d tree
+#
+# Gazetteer is a GeoNames cities-extract (e.g. cities15000.txt from http://download.geonames.org/export/dump/),
+# set by config.GAZETTEERFILE. It's parsed and built into a tree once, then loaded from a binary index-file.
+
+import os
+import re
+import math
+import threading
+import numpy
+import config
+
+EARTH_RADIUS = 6371000.0
+
+# GeoNames columns:
+NAME_COLUMN, LAT_COLUMN, LON_COLUMN, POPULATION_COLUMN = 1, 4, 5, 14
+
+
+def nameKey(name):
+    '''Normalise place-name for lookups, so "Washington DC" matches "Washington, D.C.":'''
+    return re.sub(r'\W+', '', name, flags=re.UNICODE).lower()
+
+
+def latLonToUnitVectors(lats, lons):
+    '''Convert lat/lon arrays to (n, 3) array of points on the unit sphere:'''
+    lats, lons = numpy.radians(lats), numpy.radians(lons)
+    cosLats = numpy.cos(lats)
+    return numpy.column_stack((cosLats * numpy.cos(lons), cosLats * numpy.sin(lons), numpy.sin(lats)))
+
+
+class Gazetteer:
+    '''Localities in an array-backed k-d tree: each [lo, hi) range of the arrays is a subtree, with its
+    splitting point at the middle and the smaller/larger points along that point's axis before/after it.
+    Points are unit-vectors, so the nearest in straight-line distance is also the nearest on the globe.'''
+
+    saveVersion = 2
+
+    def __init__(self, sourceFilename, indexFilename):
+        sourceStat = os.stat(sourceFilename)
+        sourceKey = "%s %s %s %s" % (self.saveVersion, os.path.abspath(sourceFilename), sourceStat.st_size, int(sourceStat.st_mtime))
+
+        if not self.loadIndex(indexFilename, sourceKey):
+            print("  Building gazetteer index: %s" % (sourceFilename))
+            self.build(*self.readSource(sourceFilename))
+            self.saveIndex(indexFilename, sourceKey)
+
+        # Tree is walked one point at a time, which is quicker with plain lists than array-indexing:
+        self.pointList = self.points.tolist()
+        self.axisList = self.axes.tolist()
+
+        # Name-lookup table is only built if it's used:
+        self.nameIndex = None
+
+    def readSource(self, sourceFilename):
+        '''Get names and lat/lon arrays from a GeoNames tab-separated file:'''
+        names, lats, lons, populations = [], [], [], []
+        with open(sourceFilename, 'rb') as f:
+            for line in f:
+                columns = line.rstrip('\r\n').split('\t')
+                try:
+                    lat, lon = float(columns[LAT_COLUMN]), float(columns[LON_COLUMN])
+                except (IndexError, ValueError):
+                    continue
+                try:
+                    population = int(columns[POPULATION_COLUMN])
+                except (IndexError, ValueError):
+                    population = 0
+                names.append(columns[NAME_COLUMN].decode('utf-8'))
+                lats.append(lat)
+                lons.append(lon)
+                populations.append(population)
+        return names, numpy.array(lats), numpy.array(lons), numpy.array(populations, dtype=numpy.int64)
+
+    def build(self, names, lats, lons, populations):
+        '''Reorder points into k-d tree order, splitting each range along its widest axis:'''
+        points = latLonToUnitVectors(lats, lons)
+        order = numpy.arange(len(points))
+        self.axes = numpy.zeros(len(points), dtype=numpy.int8)
+
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if (hi - lo) < 1:
+                continue
+            mid = (lo + hi) // 2
+            segment = order[lo:hi]
+            axis = numpy.argmax(points[segment].max(0) - points[segment].min(0))
+            order[lo:hi] = segment[numpy.argpartition(points[segment, axis], mid - lo)]
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+        self.points = points[order]
+        self.populations = populations[order]
+        self.names = [names[n] for n in order]
+
+    def loadIndex(self, indexFilename, sourceKey):
+        '''Load tree from index-file, if it was built from the current source-file:'''
+        if not os.path.exists(indexFilename):
+            return False
+        try:
+            index = numpy.load(indexFilename)
+            if index['key'].tostring() != sourceKey:
+                return False
+            self.points = index['points']
+            self.axes = index['axes']
+            self.populations = index['populations']
+            names = index['names'].tostring().decode('utf-8')
+            # An empty gazetteer's names are saved as "", which split() would make [""]:
+            self.names = (names.split('\n') if names else [])
+        except (IOError, ValueError, KeyError) as err:
+            print("  Unreadable gazetteer index %s (%s), rebuilding" % (indexFilename, err))
+            return False
+        return (len(self.names) == len(self.points))
+
+    def saveIndex(self, indexFilename, sourceKey):
+        # Write to temporary file first, so an interrupted write can't leave a broken index:
+        tempFilename = (indexFilename + ".tmp")
+        with open(tempFilename, 'wb') as f:
+            numpy.savez(f,
+                        key=numpy.frombuffer(sourceKey, dtype=numpy.uint8),
+                        points=self.points,
+                        axes=self.axes,
+                        populations=self.populations,
+                        names=numpy.frombuffer(u'\n'.join(self.names).encode('utf-8'), dtype=numpy.uint8))
+        os.rename(tempFilename, indexFilename)
+
+    def nearest(self, lat, lon):
+        '''Get (name, distance in metres) of the locality nearest a lat/lon position, or None if there are none:'''
+        if not self.names:
+            return None
+        target = latLonToUnitVectors([lat], [lon])[0].tolist()
+        x, y, z = target
+        points, axes = self.pointList, self.axisList
+
+        bestNum, bestDist = -1, float('inf')
+        # Ranges to search, with the least squared-distance any of their points can be:
+        stack = [(0, len(points), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if (lo >= hi) or (bound >= bestDist):
+                continue
+            mid = (lo + hi) // 2
+            point = points[mid]
+            dist = ((point[0] - x) ** 2) + ((point[1] - y) ** 2) + ((point[2] - z) ** 2)
+            if dist < bestDist:
+                bestNum, bestDist = mid, dist
+
+            # Search the target's side of the splitting-plane first:
+            diff = (target[axes[mid]] - point[axes[mid]])
+            if diff < 0:
+                stack.append((mid + 1, hi, max(bound, diff * diff)))
+                stack.append((lo, mid, bound))
+            else:
+                stack.append((lo, mid, max(bound, diff * diff)))
+                stack.append((mid + 1, hi, bound))
+
+        # Convert chord-length to distance on globe:
+        return self.names[bestNum], (2 * math.asin(min(1.0, math.sqrt(bestDist) / 2)) * EARTH_RADIUS)
+
+    def find(self, name):
+        '''Get (lat, lon) of the most populous locality with a given name, or None if there isn't one.
+        Addresses like "London, UK" are also tried with just the part before the first comma:'''
+        if self.nameIndex is None:
+            populations = self.populations.tolist()
+            self.nameIndex = {}
+            for num, placeName in enumerate(self.names):
+                key = nameKey(placeName)
+                if (key not in self.nameIndex) or (populations[num] > populations[self.nameIndex[key]]):
+                    self.nameIndex[key] = num
+
+        for tryName in (name, name.split(',')[0]):
+            num = self.nameIndex.get(nameKey(tryName))
+            if num is not None:
+                x, y, z = self.pointList[num]
+                return math.degrees(math.asin(max(-1.0, min(1.0, z)))), math.degrees(math.atan2(y, x))
+        return None
+
+
+gazetteer = None
+gazetteerLock = threading.Lock()
+
+
+def getGazetteer():
+    '''Get shared gazetteer for config.GAZETTEERFILE, or None if there's no gazetteer-file:'''
+    global gazetteer
+    with gazetteerLock:
+        if (gazetteer is None) and os.path.exists(config.GAZETTEERFILE):
+            gazetteer = Gazetteer(config.GAZETTEERFILE, "%s/gazetteer.npz" % (config.CACHEPATH))
+        return gazetteer
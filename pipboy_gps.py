@@ -3,13 +3,16 @@
 # GPS/position functions
 
 import os
+import re
 import time
 import math
-import urllib
-import urllib2
-import StringIO
-import json
+import socket
+import threading
+import collections
 import config
+from pipboy_provider import getProvider
+from pipboy_cache import loadCache, saveCache
+from pipboy_gazetteer import getGazetteer
 
 if config.USE_GPS:
     # Load libraries used by GPS, if present:
@@ -23,12 +26,133 @@ if config.USE_GPS:
             config.USE_GPS = False
     loadGPS()
 
+# Immutable position-snapshot; speed is in metres/second, track in degrees from true north,
+# mode is gpsd's fix-mode (0/1: no fix, 2: 2D, 3: 3D) and time is gpsd's fix-time string:
+GpsFix = collections.namedtuple('GpsFix', ['lat', 'lon', 'speed', 'track', 'mode', 'time'])
+noFix = GpsFix(0, 0, float('nan'), float('nan'), 0, None)
+
+
+class GpsStream(threading.Thread):
+    '''Long-lived gpsd client, publishing each report's position as a new GpsFix in .fix.
+    Readers just take the current snapshot, with no locking, as it's only ever replaced whole.
+    Reconnects if gpsd goes away; ready is set once there's a fix, or gpsd/device can't be found.'''
+
+    reconnectDelay = 5
+
+    def __init__(self, host="localhost", port="2947", onFix=None):
+        threading.Thread.__init__(self, name="GPS stream")
+        # Set as daemon, so it'll die with main process:
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.onFix = onFix
+        self.fix = noFix
+        self.noDevice = False
+        self.ready = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                session = gps.gps(host=self.host, port=self.port)
+                session.stream(gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE)
+                for report in session:
+                    self.readReport(report)
+                print("GPSD has terminated")
+            except (socket.error, StopIteration) as err:
+                print("GPSD connection failed: %s" % (err))
+            except Exception as err:
+                # Anything else (e.g. a malformed report) mustn't end the stream:
+                print("GPS STREAM FAILED: %s" % (err))
+
+            # Don't keep boot waiting for a fix while gpsd is unavailable:
+            self.ready.set()
+            time.sleep(self.reconnectDelay)
+
+    def readReport(self, report):
+        reportClass = report.get('class')
+        if reportClass == 'DEVICES':
+            # Don't wait for a fix if no devices were found:
+            self.noDevice = (len(report.get('devices', [])) == 0)
+            if self.noDevice:
+                print("GPS MODULE NOT FOUND!")
+                self.ready.set()
+        elif reportClass == 'TPV':
+            mode = report.get('mode', 0)
+            if (mode >= 2) and ('lat' in report) and ('lon' in report):
+                fix = GpsFix(report['lat'], report['lon'], report.get('speed', float('nan')),
+                             report.get('track', float('nan')), mode, report.get('time'))
+            elif self.fix.mode >= 2:
+                # Fix lost: keep last known position, with the new mode:
+                fix = self.fix._replace(speed=float('nan'), track=float('nan'), mode=mode, time=report.get('time'))
+            else:
+                return
+            self.noDevice = False
+            self.fix = fix
+            if self.onFix is not None:
+                self.onFix(fix)
+            if fix.mode >= 2:
+                self.ready.set()
+
+
+class GeocodeCache:
+    '''Geocoding results, kept in a cache-file between boots, dropping least-recently-used results when full.
+    Forward lookups are keyed by normalised address, reverse lookups by coordinates rounded to reverseDecimals.'''
+
+    saveVersion = 1
+    cacheFilename = ("%s/geocode_cache.json" % (config.CACHEPATH))
+
+    # 2 decimal places is roughly 1km; locality won't change within that:
+    reverseDecimals = 2
+
+    def __init__(self, maxEntries=config.GEOCODECACHESIZE):
+        self.maxEntries = maxEntries
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def addressKey(self, address):
+        '''Ignore case, punctuation and spacing in addresses:'''
+        return "address:" + " ".join(re.sub(r'[^\w\s]', ' ', address.lower()).split())
+
+    def latLongKey(self, lat, lon):
+        return "latlng:%.*f,%.*f" % (self.reverseDecimals, lat, self.reverseDecimals, lon)
+
+    def load(self):
+        if self.entries is None:
+            savedCache = loadCache(self.cacheFilename, self.saveVersion)
+            # Saved as [key, value] pairs, in least- to most-recently-used order:
+            self.entries = collections.OrderedDict(savedCache['entries'] if savedCache else [])
+
+    def get(self, key):
+        with self.lock:
+            self.load()
+            value = self.entries.pop(key, None)
+            if value is not None:
+                # Move to most-recently-used end:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.load()
+            self.entries.pop(key, None)
+            while len(self.entries) >= self.maxEntries:
+                self.entries.popitem(last=False)
+            self.entries[key] = value
+            saveCache(self.cacheFilename, self.saveVersion, {'entries': list(self.entries.items())})
+
+
+geocodeCache = GeocodeCache()
+
 
 class GpsModuleClass:
 
-    saveVersion = 1
+    saveVersion = 2
+
+    cacheFilename = ("%s/map_coords.json" % (config.CACHEPATH))
 
-    cacheFilename = ("%s/map_coords.txt" % (config.CACHEPATH))
+    # Current position-snapshot, replaced whole whenever it changes:
+    position = noFix
+    stream = None
 
     lat, lon = 0, 0
     locality = ""
@@ -44,40 +168,49 @@ class GpsModuleClass:
 
     @classmethod
     def addressToLatLong(self, address):
-        '''Return Lat/Lon value for a given address:'''
-        urlParams = {
-            'address': address,
-            'sensor': 'false',
-        }
-        url = 'http://maps.google.com/maps/api/geocode/json?' + urllib.urlencode(urlParams)
-        print(url)
-        response = urllib2.urlopen(url)
-        responseBody = response.read()
-
-        body = StringIO.StringIO(responseBody)
-        result = json.load(body)
-        if 'status' not in result or result['status'] != 'OK':
+        '''Return Lat/Lon value for a given address, or None if it can't be found:'''
+        if not address:
             return None
+        cacheKey = geocodeCache.addressKey(address)
+        latLong = geocodeCache.get(cacheKey)
+        if latLong is not None:
+            return tuple(latLong)
+
+        result = {}
+        if config.USE_INTERNET:
+            print("addressToLatLong: %s" % (address))
+            try:
+                result = getProvider().geocode(address)
+            except (IOError, ValueError) as err:
+                print("addressToLatLong failed: %s" % (err))
+
+        if 'status' not in result or result['status'] != 'OK':
+            # Fall back to local gazetteer; as with localities, its results aren't cached:
+            return self.offlineLatLong(address)
         else:
-            return result['results'][0]['geometry']['location']['lat'], result['results'][0]['geometry']['location']['lng']
+            location = result['results'][0]['geometry']['location']
+            geocodeCache.put(cacheKey, [location['lat'], location['lng']])
+            return location['lat'], location['lng']
 
     @classmethod
     def latLongToLocality(self, lat, lon):
         '''Return Locality for a given lat/lon value:'''
-        urlParams = {
-            'latlng': (str(lat) + "," + str(lon)),
-            'sensor': 'false',
-        }
-        url = 'http://maps.google.com/maps/api/geocode/json?' + urllib.urlencode(urlParams)
-        print("latLongToLocality:")
-        print(url)
-        response = urllib2.urlopen(url)
-        responseBody = response.read()
-
-        body = StringIO.StringIO(responseBody)
-        result = json.load(body)
+        cacheKey = geocodeCache.latLongKey(lat, lon)
+        locality = geocodeCache.get(cacheKey)
+        if locality is not None:
+            return locality
+
+        result = {}
+        if config.USE_INTERNET:
+            print("latLongToLocality: %s,%s" % (lat, lon))
+            try:
+                result = getProvider().reverseGeocode(lat, lon)
+            except (IOError, ValueError) as err:
+                print("latLongToLocality failed: %s" % (err))
+
         if 'status' not in result or result['status'] != 'OK':
-            return None
+            # Fall back to local gazetteer; its results aren't cached, so online results can replace them later:
+            return self.offlineLocality(lat, lon)
         else:
             addressComps = result['results'][0]['address_components']
 
@@ -91,8 +224,35 @@ class GpsModuleClass:
                     if compType == 'locality':
                         notLocality = False
                 compNum += 1
+
+            geocodeCache.put(cacheKey, retVal)
             return retVal
 
+    @classmethod
+    def offlineLocality(self, lat, lon):
+        '''Return nearest Locality in local gazetteer, or None if there's no gazetteer:'''
+        gazetteer = getGazetteer()
+        nearest = (gazetteer.nearest(lat, lon) if (gazetteer is not None) else None)
+        if nearest is None:
+            return None
+        locality, distance = nearest
+        print("offlineLocality: %s,%s: %s (%dm)" % (lat, lon, locality, distance))
+        return locality
+
+    @classmethod
+    def offlineLatLong(self, address):
+        '''Return Lat/Lon of locality named by address in local gazetteer, or None if it's not there:'''
+        gazetteer = getGazetteer()
+        latLong = (gazetteer.find(address) if (gazetteer is not None) else None)
+        if latLong is not None:
+            print("offlineLatLong: %s: %s,%s" % (address, latLong[0], latLong[1]))
+        return latLong
+
+    def setPosition(self, fix):
+        '''Publish new position-snapshot (called from GPS-stream thread):'''
+        self.position = fix
+        self.lat, self.lon = fix.lat, fix.lon
+
     def hasCoords(self):
         badCoords = (((self.lat == 0) or math.isnan(self.lat)))
         return not badCoords
@@ -114,29 +274,20 @@ class GpsModuleClass:
                 # config.SOUNDS["static"].play(loops=-1)
                 downloadSound.play(loops=-1)
 
-            # Initialise GPS module:
-            session = gps.gps(host="localhost", port="2947")
-            session.stream(gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE)
+            # Start continuous GPS stream, and wait for its first fix:
+            self.stream = GpsStream(onFix=self.setPosition)
+            self.stream.start()
+            # Stream carries on after a timeout, so a later fix still updates position:
+            self.stream.ready.wait(config.GPSFIXTIMEOUT)
 
-            time.sleep(1)
-
-            # Don't use GPS if no devices were found:
-            if len(session.devices) == 0:
-                config.USE_GPS = False
-                print("GPS MODULE NOT FOUND!")
-
-            if config.USE_GPS:
-                try:
-                    while (self.lat == 0) and (self.lat == 0):
-                        session.next()
-                        self.lat = session.fix.latitude
-                        self.lon = session.fix.longitude
-                        self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
-                except StopIteration:
-                    self.cmdLinePrint(cmdLine, "GPSD has terminated")
-                    config.USE_GPS = False
-
-            del session
+            if self.stream.fix.mode >= 2:
+                self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
+            elif self.stream.noDevice:
+                self.cmdLinePrint(cmdLine, "GPS MODULE NOT FOUND!")
+            elif self.stream.ready.is_set():
+                self.cmdLinePrint(cmdLine, "GPSD not available")
+            else:
+                self.cmdLinePrint(cmdLine, "No GPS fix yet")
 
             if (config.USE_SOUND) and (cmdLine != 0):
                 downloadSound.stop()
@@ -148,51 +299,57 @@ class GpsModuleClass:
             if os.path.exists(self.cacheFilename):
                 self.cmdLinePrint(cmdLine, ">GPSD.LOADCACHE %s" % (config.defaultPlace))
                 self.cmdLinePrint(cmdLine, "Getting cached coords from %s..." % (self.cacheFilename))
-                with open(self.cacheFilename, 'r') as f:
-                    savedVersion = eval(f.readline())
-
-                    # Only use coordinates-cache file if its version matches current version:
-                    if savedVersion == self.saveVersion:
-                        self.lat = eval(f.readline())
-                        self.lon = eval(f.readline())
-                        self.locality = (f.readline()).rstrip()
-                        self.localityLat = eval(f.readline())
-                        self.localityLon = eval(f.readline())
-                        self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
-                        newCoords = False
-                    else:
-                        self.cmdLinePrint("\tInvalid cache-version, ignoring file")
+
+                # Only use coordinates-cache file if its version matches current version:
+                savedCoords = loadCache(self.cacheFilename, self.saveVersion)
+                if savedCoords is not None:
+                    self.lat, self.lon = savedCoords['lat'], savedCoords['lon']
+                    self.locality = savedCoords['locality']
+                    self.localityLat, self.localityLon = savedCoords['localityLat'], savedCoords['localityLon']
+                    self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
+                    newCoords = False
+                else:
+                    self.cmdLinePrint(cmdLine, "\tInvalid cache-file, ignoring file")
 
             # If cache wasn't available, generate coords from defaultPlace:
             if newCoords:
                 self.cmdLinePrint(cmdLine, ">GPSD.DEFAULTLOC %s" % (config.defaultPlace))
                 self.cmdLinePrint(cmdLine, "Getting coords via geocode for Default Location %s..." % config.defaultPlace)
 
-                self.lat, self.lon = self.addressToLatLong(config.defaultPlace)
-                self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
+                latLong = self.addressToLatLong(config.defaultPlace)
+                if latLong is not None:
+                    self.lat, self.lon = latLong
+                    self.cmdLinePrint(cmdLine, "\t(%s,%s)" % (str(self.lat), str(self.lon)))
+                else:
+                    self.cmdLinePrint(cmdLine, "\tDefault Location not found, using (%s,%s)" % (str(self.lat), str(self.lon)))
+
+                self.locality = (self.latLongToLocality(self.lat, self.lon) or "")
 
-                self.locality = self.latLongToLocality(self.lat, self.lon)
+                # Get map-centre coordinates for Locality, or centre on coords if it's unknown:
+                localityLatLong = self.addressToLatLong(self.locality)
+                self.localityLat, self.localityLon = (localityLatLong or (self.lat, self.lon))
 
-                # Get map-centre coordinates for Locality:
-                self.localityLat, self.localityLon = self.addressToLatLong(self.locality)
+            # Use saved/default coords until there's a GPS-fix:
+            if self.position.mode < 2:
+                self.position = noFix._replace(lat=self.lat, lon=self.lon)
 
         # Get locality (i.e. city) for current coordinates via reverse-geocoding, if connection is available:
         self.cmdLinePrint(cmdLine, ">GPSD.LOCALITY")
         if not self.locality:
-            self.locality = self.latLongToLocality(self.lat, self.lon)
+            self.locality = (self.latLongToLocality(self.lat, self.lon) or "")
             newCoords = True
 
         self.cmdLinePrint(cmdLine, "\tLocality: \"%s\"" % (self.locality))
 
-        # Output new coordinates/locality to cache-file:
-        if newCoords:
+        # Output new coordinates/locality to cache-file, if there are any to save:
+        if newCoords and self.hasCoords():
             self.cmdLinePrint(cmdLine, ">GPSD.SAVECACHE %s" % (self.cacheFilename))
-            with open(self.cacheFilename, 'w') as out:
-                out.write("%s\n%s\n%s\n%s\n%s\n%s\n" % (self.saveVersion,
-                                                        repr(self.lat),
-                                                        repr(self.lon),
-                                                        self.locality,
-                                                        repr(self.localityLat),
-                                                        repr(self.localityLon)))
+            saveCache(self.cacheFilename, self.saveVersion, {
+                'lat': self.lat,
+                'lon': self.lon,
+                'locality': self.locality,
+                'localityLat': self.localityLat,
+                'localityLon': self.localityLon,
+            })
 
         return self.lat, self.lon
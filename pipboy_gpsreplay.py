@@ -0,0 +1,329 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Local stand-in for gpsd, replaying recorded tracks
+#
+# Speaks enough of gpsd's JSON protocol for pipboy_gps's GpsStream: VERSION on connect, then DEVICES/WATCH
+# and a TPV report per track-point once a client sends ?WATCH. Tracks are gpsd JSON logs (e.g. from 'gpspipe -w')
+# or NMEA logs ($GPRMC/$GPGGA); with no track-file, a straight track is generated.
+#   python pipboy_gpsreplay.py [--track drive.nmea] [--rate 10] [--fix-loss 0.1] [--jitter 5] [--no-device]
+# Then start RasPipBoy as usual; it connects to gpsd's port, 2947.
+
+import sys
+import time
+import json
+import math
+import random
+import select
+import socket
+import calendar
+import argparse
+import threading
+import SocketServer
+
+METRES_PER_DEGREE = 111320.0
+DEVICE_PATH = "/dev/ttyReplay"
+
+# Default generated track: Washington DC, heading east at 15m/s:
+DEFAULT_LAT, DEFAULT_LON = 38.8951, -77.0364
+
+
+class TrackPoint:
+    '''Track position, with time in seconds from the track's start; no-fix points have no lat/lon'''
+
+    def __init__(self, time, lat, lon, speed=float('nan'), track=float('nan'), mode=3):
+        self.time = time
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.track = track
+        self.mode = mode
+
+
+def isoTimeToSeconds(timeStr):
+    '''Convert gpsd's ISO-8601 time-string (or older float seconds) to seconds since epoch:'''
+    if isinstance(timeStr, (int, float)):
+        return float(timeStr)
+    seconds = calendar.timegm(time.strptime(timeStr[:19], "%Y-%m-%dT%H:%M:%S"))
+    fraction = timeStr[19:].rstrip('Z')
+    if fraction.startswith('.'):
+        seconds += float(fraction)
+    return seconds
+
+
+def secondsToIsoTime(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + (".%03dZ" % (int((seconds % 1) * 1000)))
+
+
+def relativeTimes(points):
+    '''Make point-times relative to the first one:'''
+    if points:
+        startTime = points[0].time
+        for point in points:
+            point.time -= startTime
+    return points
+
+
+def parseJsonTrack(lines):
+    '''Get track-points from TPV reports in a gpsd JSON log:'''
+    points = []
+    for line in lines:
+        try:
+            report = json.loads(line)
+        except ValueError:
+            continue
+        if report.get('class') != 'TPV':
+            continue
+        # Keep no-fix reports, so recorded fix-losses are replayed too:
+        mode = report.get('mode', 2)
+        if (mode >= 2) and (('lat' not in report) or ('lon' not in report)):
+            continue
+
+        pointTime = isoTimeToSeconds(report['time']) if ('time' in report) else len(points)
+        points.append(TrackPoint(pointTime, report.get('lat'), report.get('lon'), report.get('speed', float('nan')),
+                                 report.get('track', float('nan')), mode))
+    return relativeTimes(points)
+
+
+def nmeaCoord(value, hemisphere):
+    '''Convert NMEA (d)ddmm.mmmm coordinate to signed degrees:'''
+    degreeDigits = (value.index('.') - 2)
+    degrees = float(value[:degreeDigits]) + (float(value[degreeDigits:]) / 60.0)
+    return (-degrees if hemisphere in ('S', 'W') else degrees)
+
+
+def parseNmeaTrack(lines):
+    '''Get track-points from an NMEA log; RMC gives position/speed/track, GGA gives fix-quality.
+    Sentences with the same time-of-day are merged into one point.'''
+    points = []
+    point, pointTimeStr = None, None
+    dayOffset, lastTime = 0, None
+
+    for line in lines:
+        line = line.strip()
+        if not line.startswith('$'):
+            continue
+        # Drop checksum; sentence-type ignores talker-id (GP, GN, etc):
+        fields = line[1:].split('*')[0].split(',')
+        sentence = fields[0][2:]
+        if (sentence not in ('RMC', 'GGA')) or (len(fields) < 7) or (not fields[1]):
+            continue
+
+        if fields[1] != pointTimeStr:
+            if (point is not None) and ((point.lat is not None) or (point.mode < 2)):
+                points.append(point)
+            timeStr = fields[1]
+            pointTime = (int(timeStr[0:2]) * 3600) + (int(timeStr[2:4]) * 60) + float(timeStr[4:])
+            # Times are time-of-day, so wrap past midnight:
+            if (lastTime is not None) and (pointTime + dayOffset) < lastTime:
+                dayOffset += 86400
+            lastTime = (pointTime + dayOffset)
+            point, pointTimeStr = TrackPoint(lastTime, None, None), fields[1]
+
+        try:
+            if sentence == 'RMC':
+                if fields[2] != 'A':
+                    point.mode = 1
+                if fields[3] and fields[5]:
+                    point.lat, point.lon = nmeaCoord(fields[3], fields[4]), nmeaCoord(fields[5], fields[6])
+                if (len(fields) > 8) and fields[7]:
+                    point.speed = float(fields[7]) * 0.514444
+                if (len(fields) > 8) and fields[8]:
+                    point.track = float(fields[8])
+            else:
+                if fields[2] and fields[4]:
+                    point.lat, point.lon = nmeaCoord(fields[2], fields[3]), nmeaCoord(fields[4], fields[5])
+                if fields[6] == '0':
+                    point.mode = 1
+        except (ValueError, IndexError):
+            continue
+
+    if (point is not None) and ((point.lat is not None) or (point.mode < 2)):
+        points.append(point)
+    return relativeTimes(points)
+
+
+def loadTrack(filename):
+    '''Load a gpsd JSON or NMEA track-file, telling them apart by their first non-blank character:'''
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+    firstChars = [line.strip()[:1] for line in lines if line.strip()]
+    if firstChars and (firstChars[0] == '{'):
+        return parseJsonTrack(lines)
+    return parseNmeaTrack(lines)
+
+
+def generateTrack(lat=DEFAULT_LAT, lon=DEFAULT_LON, speed=15.0, heading=90.0, duration=600, interval=1.0):
+    '''Generate straight track at constant speed (m/s) and heading (degrees from north):'''
+    points = []
+    dLat = (speed * interval * math.cos(math.radians(heading))) / METRES_PER_DEGREE
+    dLon = (speed * interval * math.sin(math.radians(heading))) / (METRES_PER_DEGREE * math.cos(math.radians(lat)))
+    for n in range(int(duration / interval)):
+        points.append(TrackPoint(n * interval, lat + (n * dLat), lon + (n * dLon), speed, heading, 3))
+    return points
+
+
+class ReplayHandler(SocketServer.BaseRequestHandler):
+    '''One gpsd client: replies to its commands, and streams track-reports while it's watching'''
+
+    def handle(self):
+        self.rng = random.Random(self.server.seed)
+        self.sendVersion()
+
+        buffer = ""
+        self.nextTime = None
+        try:
+            while True:
+                timeout = (max(0, self.nextTime - time.time()) if (self.nextTime is not None) else None)
+                if select.select([self.request], [], [], timeout)[0]:
+                    data = self.request.recv(4096)
+                    if not data:
+                        return
+                    # Commands end with ';' or newline:
+                    buffer += data.replace('\n', ';')
+                    while ';' in buffer:
+                        command, buffer = buffer.split(';', 1)
+                        self.command(command.strip())
+                else:
+                    self.sendReport()
+        except socket.error:
+            # Client went away:
+            return
+
+    def command(self, command):
+        if command.startswith('?WATCH'):
+            self.watch(command)
+        elif command.startswith('?DEVICES'):
+            self.sendDevices()
+        elif command.startswith('?VERSION'):
+            self.sendVersion()
+        elif command:
+            self.send({'class': 'ERROR', 'message': "Unrecognized request '%s'" % (command)})
+
+    def watch(self, command):
+        '''Handle ?WATCH={...}, starting the replay when enabled:'''
+        args = {}
+        if '=' in command:
+            try:
+                args = json.loads(command.split('=', 1)[1])
+            except ValueError:
+                self.send({'class': 'ERROR', 'message': "Invalid WATCH: %s" % (command)})
+                return
+
+        enable = args.get('enable', True)
+        self.sendDevices()
+        self.send({'class': 'WATCH', 'enable': enable, 'json': args.get('json', True)})
+
+        if not enable:
+            self.nextTime = None
+        elif (self.nextTime is None) and (not self.server.noDevice):
+            # Track starts once the cold-start delay is over:
+            now = time.time()
+            self.fixTime = (now + self.server.fixDelay)
+            self.trackStart, self.pointNum = self.fixTime, 0
+            self.nextTime = now
+
+    def sendReport(self):
+        '''Send next report, and schedule the one after:'''
+        server = self.server
+        now = time.time()
+
+        # Cold-start: no fix until fixDelay has passed, reported once per second:
+        if now < self.fixTime:
+            self.send({'class': 'TPV', 'device': DEVICE_PATH, 'mode': 1, 'time': secondsToIsoTime(now)})
+            self.nextTime = min(now + 1, self.fixTime)
+            return
+
+        point = server.track[self.pointNum]
+        report = {'class': 'TPV', 'device': DEVICE_PATH, 'time': secondsToIsoTime(now)}
+        if (point.mode < 2) or (point.lat is None) or (server.fixLoss and (self.rng.random() < server.fixLoss)):
+            report['mode'] = 1
+        else:
+            lat, lon = point.lat, point.lon
+            if server.jitter:
+                lat += self.rng.gauss(0, server.jitter) / METRES_PER_DEGREE
+                lon += self.rng.gauss(0, server.jitter) / (METRES_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+            report.update({'mode': point.mode, 'lat': lat, 'lon': lon})
+            if not math.isnan(point.speed):
+                report['speed'] = point.speed
+            if not math.isnan(point.track):
+                report['track'] = point.track
+        self.send(report)
+
+        self.pointNum += 1
+        if self.pointNum >= len(server.track):
+            if not server.loop:
+                self.nextTime = None
+                return
+            # Restart track a second after its last point:
+            self.trackStart, self.pointNum = (now + (1.0 / server.rate)), 0
+        self.nextTime = self.trackStart + (server.track[self.pointNum].time / server.rate)
+
+    def sendVersion(self):
+        self.send({'class': 'VERSION', 'release': "3.11", 'rev': "replay", 'proto_major': 3, 'proto_minor': 11})
+
+    def sendDevices(self):
+        devices = []
+        if not self.server.noDevice:
+            devices.append({'class': 'DEVICE', 'path': DEVICE_PATH, 'driver': "NMEA0183",
+                            'activated': secondsToIsoTime(time.time())})
+        self.send({'class': 'DEVICES', 'devices': devices})
+
+    def send(self, report):
+        self.request.sendall(json.dumps(report) + "\r\n")
+        if self.server.verbose:
+            print(json.dumps(report))
+
+
+class ReplayServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''gpsd stand-in; each client gets its own replay of the track, from its start.
+    rate speeds up replay; fixLoss is the fraction of reports sent with no fix; jitter is position-noise in metres;
+    fixDelay is seconds before the first fix; noDevice reports no GPS devices, and no positions.'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=2947, track=None, rate=1.0, fixLoss=0.0, jitter=0.0, fixDelay=0.0,
+                 noDevice=False, loop=True, seed=0, verbose=False):
+        SocketServer.TCPServer.__init__(self, ('localhost', port), ReplayHandler)
+        self.track = (track if track is not None else generateTrack())
+        self.rate = rate
+        self.fixLoss = fixLoss
+        self.jitter = jitter
+        self.fixDelay = fixDelay
+        self.noDevice = noDevice
+        self.loop = loop
+        self.seed = seed
+        self.verbose = verbose
+
+
+def startServer(port=2947, track=None, **options):
+    '''Start gpsd stand-in on a background thread, returning server:'''
+    server = ReplayServer(port, track, **options)
+    thread = threading.Thread(target=server.serve_forever, name="gpsd stand-in")
+    # Set as daemon, so it'll die with main process:
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="gpsd stand-in, replaying a recorded track")
+    parser.add_argument('--port', type=int, default=2947)
+    parser.add_argument('--track', help="gpsd JSON or NMEA track-file (default: generated straight track)")
+    parser.add_argument('--rate', type=float, default=1.0, help="Replay-speed multiplier")
+    parser.add_argument('--fix-loss', type=float, default=0, help="Fraction of reports with no fix")
+    parser.add_argument('--jitter', type=float, default=0, help="Position-noise standard deviation, in metres")
+    parser.add_argument('--fix-delay', type=float, default=0, help="Seconds before first fix")
+    parser.add_argument('--no-device', action='store_true', help="Report no GPS devices")
+    parser.add_argument('--once', action='store_true', help="Stop reporting at end of track, rather than looping")
+    parser.add_argument('--verbose', action='store_true', help="Print each report")
+    args = parser.parse_args()
+
+    track = (loadTrack(args.track) if args.track else None)
+    server = ReplayServer(args.port, track, args.rate, args.fix_loss, args.jitter, args.fix_delay,
+                          args.no_device, not args.once, verbose=args.verbose)
+    print("gpsd stand-in on localhost:%s, %s track-points" % (args.port, len(server.track)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -18,6 +18,10 @@ class Header:
         self.rootParent = self.parent.rootParent
         self.canvas = pygame.Surface((config.WIDTH, config.HEIGHT))
 
+        # Canvas-area touched by header-drawing, used for dirty-rect updates:
+        lineDn = (cornerPadding + (config.charHeight * 1.6))
+        self.dirtyRect = pygame.Rect(0, 0, config.WIDTH, int(lineDn) + 4)
+
     def drawHeader(self):
         self.canvas.fill((0, 0, 0))
         headerStrings = self.headerStrings
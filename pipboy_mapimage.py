@@ -0,0 +1,105 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Map-image post-processing: contrast/brightness, noise and grid in one NumPy pass, with a lossless cache
+
+import os
+import hashlib
+import numpy
+import pygame
+from PIL import Image
+
+
+def processPixels(pixels, contrast=1.0, brightness=1.0, noiseStep=0, noiseLevels=(), gridStep=0,
+                  gridWidth=2, gridValue=40, borderWidth=0, seed=0):
+    '''Process an RGB uint8 array (rows, columns, 3), returning a new uint8 array.
+    Contrast/brightness match PIL's ImageEnhance; noise multiplies square cells of noiseStep*level pixels
+    by random values; grid-lines are drawn every gridStep pixels, with an optional white border.'''
+    height, width = pixels.shape[:2]
+
+    # Contrast blends with the image's mean luminance, clipped as PIL does:
+    lum = ((pixels[:, :, 0] * 0.299) + (pixels[:, :, 1] * 0.587) + (pixels[:, :, 2] * 0.114)).mean()
+    out = pixels.astype(numpy.float32)
+    out *= contrast
+    out += (lum * (1.0 - contrast))
+    numpy.clip(out, 0, 255, out=out)
+
+    # Combine brightness and all noise-levels into one per-pixel gain:
+    gain = numpy.full((height, width), brightness, dtype=numpy.float32)
+    rng = numpy.random.RandomState(seed)
+    for level in noiseLevels:
+        cellSize = (noiseStep * level)
+        cellsY, cellsX = (-(-height // cellSize)), (-(-width // cellSize))
+        noise = (rng.random_sample((cellsY, cellsX)) * 0.6) + 0.5
+        gain *= noise.repeat(cellSize, 0).repeat(cellSize, 1)[:height, :width]
+    out *= gain[:, :, numpy.newaxis]
+    numpy.clip(out, 0, 255, out=out)
+    out = out.astype(numpy.uint8)
+
+    if gridStep:
+        for gridPos in range(0, max(width, height), gridStep):
+            out[gridPos:gridPos + gridWidth, :] = gridValue
+            out[:, gridPos:gridPos + gridWidth] = gridValue
+
+    if borderWidth:
+        out[:borderWidth, :] = 255
+        out[-borderWidth:, :] = 255
+        out[:, :borderWidth] = 255
+        out[:, -borderWidth:] = 255
+
+    return out
+
+
+def pixelsToSurface(pixels):
+    '''Convert RGB uint8 array (rows, columns, 3) to Pygame surface:'''
+    height, width = pixels.shape[:2]
+    return pygame.image.frombuffer(pixels.tostring(), (width, height), "RGB")
+
+
+def processImageFile(filename, params):
+    '''Load and process an image filename or file-object, returning a Pygame surface:'''
+    pixels = numpy.asarray(Image.open(filename).convert("RGB"))
+    return pixelsToSurface(processPixels(pixels, **params))
+
+
+def processedImageKey(sourceFilename, params):
+    '''Cache-key for an image: hash of source-file's contents and processing-parameters'''
+    keyHash = hashlib.sha1()
+    with open(sourceFilename, 'rb') as f:
+        keyHash.update(f.read())
+    keyHash.update(repr(sorted(params.items())).encode('utf-8'))
+    return keyHash.hexdigest()
+
+
+def loadProcessedImage(sourceFilename, cacheFilename, params):
+    '''Get processed version of an image-file, from the cache if it was made from the same source and
+    parameters. Cache-file holds a "key width height" header-line, then raw RGB pixels.'''
+    key = processedImageKey(sourceFilename, params)
+
+    if os.path.exists(cacheFilename):
+        with open(cacheFilename, 'rb') as f:
+            data = f.read()
+        headerEnd = data.find(b'\n')
+        try:
+            savedKey, width, height = data[:headerEnd].decode('ascii').split()
+            width, height = int(width), int(height)
+        except ValueError:
+            savedKey, width, height = None, 0, 0
+
+        if (savedKey == key) and (len(data) == (headerEnd + 1 + (width * height * 3))):
+            print("  Loading processed map: %s" % (cacheFilename))
+            return pygame.image.fromstring(data[headerEnd + 1:], (width, height), 'RGB')
+
+    print("  Processing map: %s" % (sourceFilename))
+    params = dict(params)
+    params.setdefault('seed', int(key[:8], 16))
+    image = processImageFile(sourceFilename, params)
+
+    # Write to temporary file first, so an interrupted write can't leave a broken cache:
+    width, height = image.get_size()
+    tempFilename = (cacheFilename + ".tmp")
+    with open(tempFilename, 'wb') as f:
+        f.write(("%s %s %s\n" % (key, width, height)).encode('ascii'))
+        f.write(pygame.image.tostring(image, 'RGB'))
+    os.rename(tempFilename, cacheFilename)
+
+    return image
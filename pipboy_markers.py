@@ -0,0 +1,66 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Map-marker sprite-atlas and name-label cache
+
+import collections
+import pygame
+import config
+
+
+class MarkerAtlas:
+    '''All sizes of a set of marker-icons, packed into one converted surface.
+    Each icon has a column, with a row per size; icons sharing an image-file share a column.'''
+
+    def __init__(self, iconFiles, sizes):
+        self.sizes = list(sizes)
+        columnSize = max(self.sizes)
+
+        # One column per image-file:
+        fileNames = sorted(set(iconFiles.values()))
+        fileColumns = dict((fileName, col) for col, fileName in enumerate(fileNames))
+
+        self.surface = pygame.Surface((len(fileNames) * columnSize, sum(self.sizes)))
+        self.surface.fill((0, 0, 0))
+
+        for fileName in fileNames:
+            image = pygame.image.load(fileName)
+            rowY = 0
+            for size in self.sizes:
+                self.surface.blit(pygame.transform.scale(image, (size, size)), (fileColumns[fileName] * columnSize, rowY))
+                rowY += size
+        self.surface = self.surface.convert()
+
+        # Sub-rect for each (icon, size):
+        self.rects = {}
+        for iconName, fileName in iconFiles.items():
+            rowY = 0
+            for size in self.sizes:
+                self.rects[(iconName, size)] = pygame.Rect(fileColumns[fileName] * columnSize, rowY, size, size)
+                rowY += size
+
+    def rect(self, iconName, size):
+        return self.rects[(iconName, size)]
+
+    def draw(self, canvas, rect, pos):
+        '''Add-blend an icon's sub-rect to canvas:'''
+        canvas.blit(self.surface, pos, rect, pygame.BLEND_RGB_ADD)
+
+
+class LabelCache:
+    '''Rendered place-name labels, dropping least-recently-used labels when full'''
+
+    def __init__(self, maxLabels=32, font=None):
+        self.maxLabels = maxLabels
+        self.font = font
+        self.labels = collections.OrderedDict()
+
+    def get(self, text):
+        label = self.labels.pop(text, None)
+        if label is None:
+            font = self.font or config.FONT_LRG
+            label = font.render(text, True, config.DRAWCOLOUR, (0, 0, 0))
+            while len(self.labels) >= self.maxLabels:
+                self.labels.popitem(last=False)
+        # Move to most-recently-used end:
+        self.labels[text] = label
+        return label
@@ -3,11 +3,13 @@
 # Map Place management
 
 import time
-import urllib
-import urllib2
-import StringIO
-import json
+import math
+import threading
+import numpy
 import config
+from pipboy_provider import getProvider
+from pipboy_cache import loadCache, saveCache
+from pipboy_tasks import startTask
 
 # Google Places custom-search documentation:
 #  https://developers.google.com/places/documentation/search
@@ -113,25 +115,50 @@ placeTypeIconNames = {
     'DEFAULT': 'ruins_town',
 }
 
+class PlaceTable:
+    '''Structure-of-arrays store of places: lat/lon columns, icon-ids indexing an interned icon-name list, and names'''
+
+    def __init__(self, places=()):
+        self.iconNames = []
+        iconIds = {}
+        iconCol = []
+        for placeItem in places:
+            iconName = placeItem['icon']
+            if iconName not in iconIds:
+                iconIds[iconName] = len(self.iconNames)
+                self.iconNames.append(iconName)
+            iconCol.append(iconIds[iconName])
+
+        self.lats = numpy.array([placeItem['lat'] for placeItem in places], dtype=numpy.float64)
+        self.lons = numpy.array([placeItem['lon'] for placeItem in places], dtype=numpy.float64)
+        self.iconIds = numpy.array(iconCol, dtype=numpy.int32)
+        self.names = [placeItem['name'] for placeItem in places]
+
+    def __len__(self):
+        return len(self.names)
+
+    def project(self, minLat, minLon, xPerLon, yPerLat, imageSize):
+        '''Convert all places to map-image pixel-positions in one pass, returning (xs, ys) arrays:'''
+        xs = (self.lons - minLon) * xPerLon
+        ys = imageSize - ((self.lats - minLat) * yPerLat)
+        return xs, ys
+
+
 def getPlaces(lat, lon, radius=2000, types='establishment'):
     '''Gets list of up to 60 establishments in area'''
     places = []
 
-    # These search-arguments will show the initial results-page:
-    pageArgs = "location=%s,%s&radius=%s&types=%s" % (lat, lon, radius, types)
-    pageNum = 0
-    while not pageArgs:
-        url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json?%s&sensor=false&key=%s" % (pageArgs, config.gKey)
-        pageArgs = None
+    provider = getProvider()
 
+    # No page-token gets the initial results-page:
+    pageToken = None
+    pageNum = 0
+    while True:
         pageNum += 1
-        # print("Page %s: %s" %(pageNum, url))
-
-        response = urllib2.urlopen(url)
-        responseBody = response.read()
+        # print("Page %s" %(pageNum))
 
-        body = StringIO.StringIO(responseBody)
-        result = json.load(body)
+        result = provider.nearbyPlaces(lat, lon, radius, types, pageToken)
+        pageToken = None
 
         if 'results' in result:
             # print("Page results: %s" %(len(result['results'])))
@@ -161,14 +188,204 @@ def getPlaces(lat, lon, radius=2000, types='establishment'):
                 print(placeItem)
 
         # Set loop to download next page - there'll be up to 3 pages, of up to 20 results each:
-        if 'next_page_token' in result:
-            # print("Next page...")
-            # Set up argument to download next page:
-            pageArgs = "pagetoken=%s" % (result['next_page_token'])
+        if 'next_page_token' not in result:
+            break
+        # print("Next page...")
+        pageToken = result['next_page_token']
 
-            # Pause, as Google delays enabling the next page:
-            time.sleep(2)
+        # Pause, as Google delays enabling the next page:
+        time.sleep(provider.nextPageDelay)
 
     return places
 
+
+# Places-cache: places are fetched per geohash-cell, so nearby positions share cached results.
+GEOHASH_CHARS = '0123456789bcdefghjkmnpqrstuvwxyz'
+METRES_PER_DEGREE = 111320.0
+
+
+def geohashEncode(lat, lon, precision):
+    '''Get geohash-string of given length for a lat/lon position:'''
+    latRange, lonRange = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bitCount, isLon = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between halving longitude and latitude ranges:
+        coordRange, coord = (lonRange, lon) if isLon else (latRange, lat)
+        mid = (coordRange[0] + coordRange[1]) / 2
+        if coord >= mid:
+            bits = (bits * 2) + 1
+            coordRange[0] = mid
+        else:
+            bits = (bits * 2)
+            coordRange[1] = mid
+        isLon = not isLon
+
+        bitCount += 1
+        if bitCount == 5:
+            chars.append(GEOHASH_CHARS[bits])
+            bits, bitCount = 0, 0
+    return ''.join(chars)
+
+
+def geohashCellSize(precision):
+    '''Get (latSize, lonSize) of geohash-cells of given length, in degrees:'''
+    lonBits = ((5 * precision) + 1) / 2
+    latBits = (5 * precision) / 2
+    return (180.0 / (2 ** latBits)), (360.0 / (2 ** lonBits))
+
+
+def geohashBounds(geohash):
+    '''Get (minLat, minLon, maxLat, maxLon) of a geohash-cell:'''
+    latRange, lonRange = [-90.0, 90.0], [-180.0, 180.0]
+    isLon = True
+    for char in geohash:
+        bits = GEOHASH_CHARS.index(char)
+        for bitNum in range(4, -1, -1):
+            coordRange = lonRange if isLon else latRange
+            mid = (coordRange[0] + coordRange[1]) / 2
+            if (bits >> bitNum) & 1:
+                coordRange[0] = mid
+            else:
+                coordRange[1] = mid
+            isLon = not isLon
+    return latRange[0], lonRange[0], latRange[1], lonRange[1]
+
+
+class PlacesCache:
+    '''Places fetched per geohash-cell, kept in a cache-file until they're older than config.PLACESCACHETTL.
+    Concurrent requests for the same cell wait for a single fetch.'''
+
+    saveVersion = 1
+    cacheFilename = ("%s/places_cache.json" % (config.CACHEPATH))
+
+    # Expired cells are kept as fallbacks for offline use, until this many TTLs old; at most maxCells are kept:
+    maxAgeTTLs = 4
+    maxCells = 256
+
+    def __init__(self):
+        self.cells = None
+        self.inFlight = {}
+        self.lock = threading.Lock()
+
+    def cellPrecision(self, radius):
+        '''Longest geohash whose cells are still at least radius high:'''
+        precision = 1
+        while (geohashCellSize(precision + 1)[0] * METRES_PER_DEGREE) >= radius:
+            precision += 1
+        return precision
+
+    def coveringCells(self, lat, lon, radius):
+        '''Get geohashes of all cells overlapping the square of given radius around a position:'''
+        precision = self.cellPrecision(radius)
+        latSize, lonSize = geohashCellSize(precision)
+        latRadius = (radius / METRES_PER_DEGREE)
+        lonRadius = latRadius / max(0.01, math.cos(math.radians(lat)))
+
+        minLat, maxLat = max(-89.999, lat - latRadius), min(89.999, lat + latRadius)
+        minLon, maxLon = (lon - lonRadius), (lon + lonRadius)
+
+        cells = set()
+        cellLat = minLat
+        while True:
+            cellLon = minLon
+            while True:
+                wrappedLon = (((cellLon + 180.0) % 360.0) - 180.0)
+                cells.add(geohashEncode(cellLat, wrappedLon, precision))
+                if cellLon >= maxLon:
+                    break
+                cellLon = min(maxLon, cellLon + lonSize)
+            if cellLat >= maxLat:
+                break
+            cellLat = min(maxLat, cellLat + latSize)
+        return sorted(cells)
+
+    def load(self):
+        if self.cells is None:
+            savedCache = loadCache(self.cacheFilename, self.saveVersion)
+            self.cells = savedCache['cells'] if savedCache else {}
+
+    def prune(self):
+        '''Drop cells too old to be worth keeping, then the oldest cells if there are still too many:'''
+        oldestTime = time.time() - (self.maxAgeTTLs * config.PLACESCACHETTL)
+        for key, entry in self.cells.items():
+            if entry['time'] < oldestTime:
+                del self.cells[key]
+
+        if len(self.cells) > self.maxCells:
+            byAge = sorted(self.cells, key=lambda key: self.cells[key]['time'])
+            for key in byAge[:(len(self.cells) - self.maxCells)]:
+                del self.cells[key]
+
+    def getCell(self, geohash, types):
+        '''Get places for a cell, from cache if fresh, otherwise fetching them (or waiting for a fetch in progress):'''
+        minLat, minLon, maxLat, maxLon = geohashBounds(geohash)
+        # Search-radius reaching cell's corners:
+        cellRadius = int(math.hypot((maxLat - minLat) * METRES_PER_DEGREE / 2,
+                                    (maxLon - minLon) * METRES_PER_DEGREE * math.cos(math.radians((minLat + maxLat) / 2)) / 2))
+        key = "%s/%s/%s" % (geohash, cellRadius, types)
+
+        with self.lock:
+            self.load()
+            entry = self.cells.get(key)
+            if (entry is not None) and ((time.time() - entry['time']) < config.PLACESCACHETTL):
+                return entry['places']
+            if not config.USE_INTERNET:
+                return entry['places'] if entry else []
+
+            fetchDone = self.inFlight.get(key)
+            isFetcher = (fetchDone is None)
+            if isFetcher:
+                fetchDone = self.inFlight[key] = threading.Event()
+
+        if not isFetcher:
+            fetchDone.wait()
+            with self.lock:
+                entry = self.cells.get(key)
+            return entry['places'] if entry else []
+
+        try:
+            places = getPlaces((minLat + maxLat) / 2, (minLon + maxLon) / 2, cellRadius, types)
+            with self.lock:
+                self.cells[key] = {'time': time.time(), 'places': places}
+                self.prune()
+                saveCache(self.cacheFilename, self.saveVersion, {'cells': self.cells})
+        except Exception as err:
+            # Stale places are better than none:
+            print("Places fetch for %s failed: %s" % (geohash, err))
+            places = entry['places'] if entry else []
+        finally:
+            with self.lock:
+                del self.inFlight[key]
+            fetchDone.set()
+        return places
+
+    def getPlaces(self, lat, lon, radius=2000, types='establishment'):
+        '''Get places within radius of a position, merged from all cells that the area covers:'''
+        latRadius = (radius / METRES_PER_DEGREE)
+        lonRadius = latRadius / max(0.01, math.cos(math.radians(lat)))
+
+        # Fetch cells at the same time, as each uncached one can take a few seconds:
+        cellTasks = [startTask("Places %s" % (geohash), lambda geohash=geohash: self.getCell(geohash, types))
+                     for geohash in self.coveringCells(lat, lon, radius)]
+
+        places = []
+        seen = set()
+        for task in cellTasks:
+            task.join()
+            for placeItem in (task.result or []):
+                placeKey = (placeItem['name'], placeItem['lat'], placeItem['lon'])
+                if (placeKey not in seen) and (abs(placeItem['lat'] - lat) <= latRadius) and (abs(placeItem['lon'] - lon) <= lonRadius):
+                    seen.add(placeKey)
+                    places.append(placeItem)
+        return places
+
+
+placesCache = PlacesCache()
+
+
+def getCachedPlaces(lat, lon, radius=2000, types='establishment'):
+    '''Get places in area via shared places-cache:'''
+    return placesCache.getPlaces(lat, lon, radius, types)
+
 # getPlaces(53.79420270000001,-1.5356686)
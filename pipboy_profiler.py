@@ -0,0 +1,77 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Per-stage frame profiler
+
+import time
+import collections
+import pygame
+import config
+
+# Use highest-resolution clock available:
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+
+class FrameProfiler:
+    '''Times each stage of a frame, keeping a rolling window of recent timings per stage'''
+
+    def __init__(self, stageNames, windowSize=256):
+        self.stageNames = list(stageNames)
+        self.windowSize = windowSize
+        self.samples = collections.OrderedDict()
+        for stageName in self.stageNames:
+            self.samples[stageName] = collections.deque(maxlen=windowSize)
+        self.lastMark = timer()
+
+    def startFrame(self):
+        '''Reset stage-timer at start of frame:'''
+        self.lastMark = timer()
+
+    def mark(self, stageName):
+        '''Record time since last mark against given stage:'''
+        now = timer()
+        if stageName not in self.samples:
+            self.stageNames.append(stageName)
+            self.samples[stageName] = collections.deque(maxlen=self.windowSize)
+        self.samples[stageName].append(now - self.lastMark)
+        self.lastMark = now
+
+    def percentile(self, stageName, fraction):
+        '''Get stage's timing at given percentile (0.0-1.0), in milliseconds:'''
+        samples = self.samples.get(stageName)
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(fraction * len(ordered)))
+        return 1000.0 * ordered[idx]
+
+    def summary(self):
+        '''Get [(stageName, p50, p99)] for each stage, in milliseconds:'''
+        return [(stageName, self.percentile(stageName, 0.5), self.percentile(stageName, 0.99))
+                for stageName in self.stageNames]
+
+    def dump(self):
+        '''Print stage-timings table:'''
+        print("FRAME PROFILE (last %s frames, ms):" % (self.windowSize))
+        print("  %-12s %8s %8s" % ("STAGE", "P50", "P99"))
+        for stageName, p50, p99 in self.summary():
+            print("  %-12s %8.2f %8.2f" % (stageName, p50, p99))
+
+    def drawHud(self):
+        '''Render stage-timings to an image, for overlaying on-screen:'''
+        lines = ["%-10s %6.1f %6.1f" % (stageName, p50, p99) for stageName, p50, p99 in self.summary()]
+        lines.insert(0, "%-10s %6s %6s" % ("ms", "p50", "p99"))
+
+        lineHeight = config.MONOFONT.get_linesize()
+        textImgs = [config.MONOFONT.render(line, True, config.DRAWCOLOUR, (0, 0, 0)) for line in lines]
+        hudWidth = max(textImg.get_width() for textImg in textImgs) + 4
+        hudImage = pygame.Surface((hudWidth, (lineHeight * len(lines)) + 4))
+
+        textY = 2
+        for textImg in textImgs:
+            hudImage.blit(textImg, (2, textY))
+            textY += lineHeight
+
+        return hudImage.convert()
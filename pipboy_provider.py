@@ -0,0 +1,151 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Map/places/geocode provider, fetched via pooled keep-alive HTTP connections
+
+import time
+import json
+import socket
+import threading
+import urllib
+import urlparse
+import httplib
+import config
+
+
+class HttpError(IOError):
+    '''Request failed with an HTTP error-status'''
+
+    def __init__(self, url, status):
+        IOError.__init__(self, "HTTP %s: %s" % (status, url))
+        self.url = url
+        self.status = status
+
+
+class HttpClient:
+    '''Fetches URLs, keeping idle connections open per host for re-use.
+    Connection-failures and server-errors (5xx) are retried, with increasing delays.'''
+
+    maxIdle = 4
+    retryDelay = 0.5
+
+    def __init__(self, timeout=config.HTTPTIMEOUT, retries=config.HTTPRETRIES):
+        self.timeout = timeout
+        self.retries = retries
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def getConnection(self, scheme, netloc):
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def releaseConnection(self, scheme, netloc, connection):
+        '''Return connection to idle-pool, or close it if pool is full:'''
+        with self.lock:
+            connections = self.idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.maxIdle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def get(self, url, params=None):
+        '''Get response-body for a URL, with optional query-parameters dict or list of (name, value) pairs:'''
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.urlencode(params)
+        parts = urlparse.urlsplit(url)
+        path = (parts.path or '/')
+        if parts.query:
+            path += ('?' + parts.query)
+
+        lastError = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retryDelay * (2 ** (attempt - 1)))
+
+            connection = self.getConnection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as err:
+                # Pooled connection may have been closed by server; retry on a new one:
+                connection.close()
+                lastError = err
+                continue
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.releaseConnection(parts.scheme, parts.netloc, connection)
+
+            if response.status >= 500:
+                lastError = HttpError(url, response.status)
+                continue
+            if response.status != 200:
+                raise HttpError(url, response.status)
+            return body
+
+        raise lastError
+
+    def getJson(self, url, params=None):
+        return json.loads(self.get(url, params))
+
+
+class MapProvider:
+    '''Static-map, map-tile, places and geocoding services, at URLs given in config.PROVIDERURLS'''
+
+    def __init__(self, name, client=None):
+        self.name = name
+        self.urls = config.PROVIDERURLS[name]
+        self.tileUrls = self.urls['tiles']
+        self.client = client or HttpClient()
+
+        # Google only enables a places next-page token after a short delay:
+        self.nextPageDelay = (2 if (name == 'google') else 0)
+
+    def staticMap(self, center, zoom, scale, size, extraArgs=()):
+        '''Get static map-image file-data; extraArgs is a list of (name, value) pairs, as names may repeat:'''
+        params = [('center', center), ('zoom', zoom), ('scale', scale), ('size', "%sx%s" % (size, size))]
+        params += list(extraArgs)
+        params.append(('sensor', 'true'))
+        print("staticMap: %s" % (center))
+        return self.client.get(self.urls['staticmap'], params)
+
+    def tile(self, url):
+        '''Get map-tile file-data, from a URL made from one of tileUrls:'''
+        return self.client.get(url)
+
+    def nearbyPlaces(self, lat, lon, radius, types, pageToken=None):
+        '''Get a page of places-search results:'''
+        if pageToken:
+            params = {'pagetoken': pageToken}
+        else:
+            params = {'location': "%s,%s" % (lat, lon), 'radius': radius, 'types': types}
+        params['sensor'] = 'false'
+        params['key'] = config.gKey
+        return self.client.getJson(self.urls['places'], params)
+
+    def geocode(self, address):
+        '''Get geocoding results for an address:'''
+        return self.client.getJson(self.urls['geocode'], {'address': address, 'sensor': 'false'})
+
+    def reverseGeocode(self, lat, lon):
+        '''Get reverse-geocoding results for a lat/lon position:'''
+        return self.client.getJson(self.urls['geocode'], {'latlng': "%s,%s" % (lat, lon), 'sensor': 'false'})
+
+
+provider = None
+providerLock = threading.Lock()
+
+
+def getProvider():
+    '''Get shared provider for config.MAPPROVIDER:'''
+    global provider
+    with providerLock:
+        if provider is None:
+            provider = MapProvider(config.MAPPROVIDER)
+        return provider
@@ -0,0 +1,127 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Serial-controller reader thread
+
+import time
+import threading
+import Queue
+import config
+
+if config.USE_SERIAL:
+    import serial
+
+
+def isReading(line):
+    '''Battery/temperature readings are replies to our own queries, so don't count as user-input:'''
+    return (line.startswith('volts') or line.startswith('temp'))
+
+
+class SerialReader(threading.Thread):
+    '''Reads lines from the serial-controller on its own thread, queueing them for the main loop.
+    Reconnects (with increasing delays) if the port goes away.'''
+
+    readTimeout = 0.1
+    minRetryDelay = 1.0
+    maxRetryDelay = 30.0
+
+    def __init__(self, port, baudRate, ser=None):
+        threading.Thread.__init__(self, name="Serial")
+        # Set as daemon, so it'll die with main process:
+        self.daemon = True
+
+        self.port = port
+        self.baudRate = baudRate
+        self.ser = ser
+        if ser is not None:
+            ser.timeout = self.readTimeout
+
+        self.lines = Queue.Queue()
+        # Set when a user-input line (i.e. not a reading) has been queued:
+        self.inputReady = threading.Event()
+        self.writeLock = threading.Lock()
+        self.running = True
+
+    def connect(self):
+        '''Open serial-port, retrying with increasing delays until it's available:'''
+        retryDelay = self.minRetryDelay
+        while self.running:
+            try:
+                print("Connecting serial: %s" % (self.port))
+                self.ser = serial.Serial(self.port, self.baudRate, timeout=self.readTimeout)
+                return
+            except Exception as err:
+                print("  Serial connect failed (%s), retrying in %ss" % (err, retryDelay))
+                time.sleep(retryDelay)
+                retryDelay = min(retryDelay * 2, self.maxRetryDelay)
+
+    def disconnect(self):
+        with self.writeLock:
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except Exception:
+                    pass
+                self.ser = None
+
+    def run(self):
+        buf = ""
+        while self.running:
+            if self.ser is None:
+                buf = ""
+                self.connect()
+                continue
+
+            try:
+                # Block for first byte (up to readTimeout), then take whatever else has arrived:
+                data = self.ser.read(1)
+                if data:
+                    data += self.ser.read(self.ser.inWaiting())
+            except Exception as err:
+                print("Serial-port failure! (%s)" % (err))
+                self.disconnect()
+                continue
+
+            if not data:
+                continue
+
+            # Split into lines, keeping any partial line for next read:
+            buf += data.replace('\r', '\n')
+            lines = buf.split('\n')
+            buf = lines.pop()
+
+            readTime = time.time()
+            for line in lines:
+                if line:
+                    self.lines.put((readTime, line))
+                    if not isReading(line):
+                        self.inputReady.set()
+
+    def hasInput(self):
+        '''Return True if user-input lines have arrived since last getLines call:'''
+        return self.inputReady.is_set()
+
+    def getLines(self):
+        '''Get list of (timestamp, line) received since last call:'''
+        # Clear before emptying queue, so a line arriving meanwhile still sets it again:
+        self.inputReady.clear()
+        lines = []
+        try:
+            while True:
+                lines.append(self.lines.get_nowait())
+        except Queue.Empty:
+            pass
+        return lines
+
+    def write(self, data):
+        '''Send data to controller; dropped if it's currently disconnected:'''
+        with self.writeLock:
+            if self.ser is None:
+                return
+            try:
+                self.ser.write(data)
+            except Exception as err:
+                print("Serial write failed! (%s)" % (err))
+
+    def close(self):
+        self.running = False
+        self.disconnect()
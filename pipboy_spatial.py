@@ -0,0 +1,67 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Spatial index for map-markers
+
+import numpy
+
+
+class GridIndex:
+    '''Uniform grid of items bucketed by their (x, y) position, for rectangle and nearest-item queries.
+    Items are referred to by their index in the position-arrays.'''
+
+    def __init__(self, cellSize):
+        self.cellSize = float(cellSize)
+        self.cells = {}
+        self.xs = numpy.zeros(0)
+        self.ys = numpy.zeros(0)
+
+    def cellKey(self, x, y):
+        return (int(numpy.floor(x / self.cellSize)), int(numpy.floor(y / self.cellSize)))
+
+    def build(self, xs, ys):
+        '''Rebuild index from arrays of x and y positions:'''
+        self.xs, self.ys = xs, ys
+        cellXs = numpy.floor(xs / self.cellSize).astype(int)
+        cellYs = numpy.floor(ys / self.cellSize).astype(int)
+
+        cells = {}
+        for idx, key in enumerate(zip(cellXs.tolist(), cellYs.tolist())):
+            cells.setdefault(key, []).append(idx)
+        self.cells = dict((key, numpy.array(items)) for key, items in cells.items())
+
+    def candidates(self, minX, minY, maxX, maxY):
+        '''Get array of indices of items in cells overlapping given rectangle:'''
+        minCellX, minCellY = self.cellKey(minX, minY)
+        maxCellX, maxCellY = self.cellKey(maxX, maxY)
+
+        # Large rectangles are quicker to test against occupied cells than to step through:
+        if ((maxCellX - minCellX + 1) * (maxCellY - minCellY + 1)) > len(self.cells):
+            found = [items for (cellX, cellY), items in self.cells.items()
+                     if (minCellX <= cellX <= maxCellX) and (minCellY <= cellY <= maxCellY)]
+        else:
+            found = []
+            for cellY in range(minCellY, maxCellY + 1):
+                for cellX in range(minCellX, maxCellX + 1):
+                    items = self.cells.get((cellX, cellY))
+                    if items is not None:
+                        found.append(items)
+
+        if not found:
+            return numpy.zeros(0, dtype=int)
+        return numpy.concatenate(found)
+
+    def query(self, minX, minY, maxX, maxY):
+        '''Get array of indices of items inside given rectangle:'''
+        found = self.candidates(minX, minY, maxX, maxY)
+        xs, ys = self.xs[found], self.ys[found]
+        return found[(xs >= minX) & (xs <= maxX) & (ys >= minY) & (ys <= maxY)]
+
+    def nearest(self, x, y, radius):
+        '''Get index of item nearest to (x, y) within a box of given half-size, or None:'''
+        found = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        dxs, dys = (self.xs[found] - x), (self.ys[found] - y)
+        inBox = (numpy.abs(dxs) < radius) & (numpy.abs(dys) < radius)
+        if not inBox.any():
+            return None
+        found, dxs, dys = found[inBox], dxs[inBox], dys[inBox]
+        return int(found[numpy.argmin((dxs * dxs) + (dys * dys))])
@@ -0,0 +1,226 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Local stand-in for the map/places/geocode services
+#
+# Serves canned static-maps, map-tiles, places and geocode JSON at the paths in config.PROVIDERURLS['standin'],
+# optionally with added latency and random server-errors, for benchmarking and testing with no network:
+#   python pipboy_standin.py [--port 8089] [--latency 200] [--fail-rate 0.1]
+# Then run with MAPPROVIDER = 'standin' (or PIPBOY_PROVIDER=standin in environment).
+
+import sys
+import time
+import json
+import math
+import random
+import zlib
+import argparse
+import threading
+import urlparse
+import StringIO
+import SocketServer
+import BaseHTTPServer
+from PIL import Image, ImageDraw
+
+# Canned geocoding data: (locality, lat, lon)
+CITIES = [
+    ("Washington", 38.9072, -77.0369),
+    ("New York", 40.7128, -74.0060),
+    ("Leeds", 53.7997, -1.5492),
+    ("London", 51.5074, -0.1278),
+    ("Boston", 42.3601, -71.0589),
+    ("Las Vegas", 36.1699, -115.1398),
+]
+ADDRESSES = {
+    "washington dc": CITIES[0],
+}
+
+PLACE_TYPES = ['bank', 'cafe', 'church', 'gas_station', 'hospital', 'museum', 'park', 'police',
+               'restaurant', 'school', 'store', 'subway_station', 'train_station', 'university']
+PLACES_PER_PAGE = 20
+PLACE_PAGES = 3
+
+
+def seededRandom(*key):
+    '''Random-generator seeded from key, so the same request always gets the same response:'''
+    return random.Random(zlib.crc32(repr(key)))
+
+
+def imageData(width, height, rng, gridStep, imageFormat):
+    '''Generate a noisy grey image with grid-lines, as encoded file-data:'''
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    blockSize = 32
+    for y in range(0, height, blockSize):
+        for x in range(0, width, blockSize):
+            grey = rng.randint(40, 160)
+            draw.rectangle((x, y, x + blockSize - 1, y + blockSize - 1), fill=(grey, grey, grey))
+    for pos in range(0, max(width, height), gridStep):
+        draw.line((0, pos, width, pos), fill=(200, 200, 200))
+        draw.line((pos, 0, pos, height), fill=(200, 200, 200))
+
+    data = StringIO.StringIO()
+    image.save(data, imageFormat)
+    return data.getvalue()
+
+
+class StandInData:
+    '''Canned responses for each service, cached once generated'''
+
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def cached(self, key, generate):
+        with self.lock:
+            data = self.cache.get(key)
+        if data is None:
+            data = generate()
+            with self.lock:
+                self.cache[key] = data
+        return data
+
+    def staticMap(self, query):
+        size = int(query.get('size', '640x640').split('x')[0])
+        scale = int(query.get('scale', '1'))
+        center = query.get('center', '')
+        return self.cached(('staticmap', center, size, scale),
+                           lambda: imageData(size * scale, size * scale, seededRandom(center), 64, "JPEG")), "image/jpeg"
+
+    def tile(self, name, zoom, x, y):
+        return self.cached(('tile', name, zoom, x, y),
+                           lambda: imageData(256, 256, seededRandom(name, zoom, x, y), 64, "PNG")), "image/png"
+
+    def places(self, query):
+        '''Places around the requested location, in pages linked by next_page_token:'''
+        if 'pagetoken' in query:
+            location, pageNum = query['pagetoken'].rsplit(':', 1)
+            pageNum = int(pageNum)
+        else:
+            location, pageNum = query.get('location', '0,0'), 0
+        lat, lon = [float(val) for val in location.split(',')]
+        radius = float(query.get('radius', 2000))
+
+        rng = seededRandom(location, pageNum)
+        results = []
+        for n in range(PLACES_PER_PAGE):
+            # Spread places over radius (in metres):
+            dist, angle = (radius * math.sqrt(rng.random())), (rng.random() * 2 * math.pi)
+            dLat = (dist * math.cos(angle)) / 111320.0
+            dLon = (dist * math.sin(angle)) / (111320.0 * max(0.01, math.cos(math.radians(lat))))
+            results.append({
+                'name': "Stand-in Place %s" % ((pageNum * PLACES_PER_PAGE) + n + 1),
+                'geometry': {'location': {'lat': lat + dLat, 'lng': lon + dLon}},
+                'types': [rng.choice(PLACE_TYPES), 'establishment'],
+            })
+
+        result = {'status': 'OK', 'results': results}
+        if (pageNum + 1) < PLACE_PAGES:
+            result['next_page_token'] = "%s:%s" % (location, pageNum + 1)
+        return json.dumps(result), "application/json"
+
+    def geocode(self, query):
+        '''Forward-geocode a known address, or reverse-geocode to the nearest known city:'''
+        if 'latlng' in query:
+            lat, lon = [float(val) for val in query['latlng'].split(',')]
+            city = min(CITIES, key=lambda city: ((city[1] - lat) ** 2) + ((city[2] - lon) ** 2))
+        else:
+            city = ADDRESSES.get(query.get('address', '').strip().lower())
+            if city is None:
+                city = [city for city in CITIES if city[0].lower() == query.get('address', '').strip().lower()]
+                city = (city[0] if city else None)
+        if city is None:
+            return json.dumps({'status': 'ZERO_RESULTS', 'results': []}), "application/json"
+
+        locality, lat, lon = city
+        result = {
+            'status': 'OK',
+            'results': [{
+                'geometry': {'location': {'lat': lat, 'lng': lon}},
+                'address_components': [
+                    {'long_name': "1 Stand-in Street", 'types': ['route']},
+                    {'long_name': locality, 'types': ['locality', 'political']},
+                ],
+            }],
+        }
+        return json.dumps(result), "application/json"
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1, so clients can keep connections alive:
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.failRate and (random.random() < server.failRate):
+            return self.reply(503, "Stand-in failure", "text/plain")
+
+        parts = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(parts.query))
+        path = parts.path.strip('/').split('/')
+
+        try:
+            if path[0] == 'staticmap':
+                body, contentType = server.data.staticMap(query)
+            elif (path[0] == 'tiles') and (len(path) == 5):
+                body, contentType = server.data.tile(path[1], int(path[2]), int(path[3]), int(path[4]))
+            elif path[0] == 'places':
+                body, contentType = server.data.places(query)
+            elif path[0] == 'geocode':
+                body, contentType = server.data.geocode(query)
+            else:
+                return self.reply(404, "Not found", "text/plain")
+        except (ValueError, KeyError) as err:
+            return self.reply(400, "Bad request: %s" % (err), "text/plain")
+
+        self.reply(200, body, contentType)
+
+    def reply(self, status, body, contentType):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, latency=0.0, failRate=0.0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', port), StandInHandler)
+        self.data = StandInData()
+        self.latency = latency
+        self.failRate = failRate
+        self.verbose = verbose
+
+
+def startServer(port=8089, latency=0.0, failRate=0.0):
+    '''Start stand-in server on a background thread, returning server:'''
+    server = StandInServer(port, latency, failRate)
+    thread = threading.Thread(target=server.serve_forever, name="Stand-in server")
+    # Set as daemon, so it'll die with main process:
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stand-in map/places/geocode server")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0, help="Added delay per request, in milliseconds")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of requests that get a 503 error")
+    parser.add_argument('--verbose', action='store_true', help="Log each request")
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.latency / 1000.0, args.fail_rate, args.verbose)
+    print("Stand-in server on http://localhost:%s" % (args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
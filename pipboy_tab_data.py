@@ -72,7 +72,11 @@ class Tab_Data:
 
     # Trigger page-functions
     def drawPage(self, modeNum):
-        pageCanvas, pageChanged = self.modes[modeNum].drawPage()
+        mode = self.modes[modeNum]
+        pageCanvas, pageChanged = mode.drawPage()
+
+        # Pass page's changed canvas-areas up to drawTab: (None if the whole page has changed)
+        self.dirtyRects = getattr(mode, 'dirtyRects', None)
         return pageCanvas, pageChanged
 
     def resetPage(self, modeNum):
@@ -8,13 +8,17 @@ import time
 import datetime
 import random
 import math
-import numpy
-import urllib
-from PIL import Image, ImageEnhance
-from gdal2tiles import GlobalMercator
+from gdal2tiles import SharedMercator
 from pygame.locals import *
 import config
 import pipboy_places
+from pipboy_tasks import startTask
+from pipboy_tiles import TileMap, MBTilesMap
+from pipboy_provider import getProvider
+from pipboy_spatial import GridIndex
+from pipboy_markers import MarkerAtlas, LabelCache
+from pipboy_cache import loadCache, saveCache
+from pipboy_mapimage import processImageFile, loadProcessedImage
 
 
 class Mode_Map:
@@ -23,7 +27,22 @@ class Mode_Map:
     places = []
     changed = True
 
-    saveVersion = 1
+    # Dirty-rect tracking: cursor-only moves just redraw the cursor's surroundings
+    dirtyRects = None
+    viewChanged = True
+    cursorArea = None
+
+    # Current-position marker's map-pixel position; the page is only redrawn when this changes:
+    posChanged = True
+    curPosX = 0
+    curPosY = 0
+
+    # Base-layer holds the map-texture, drawn with its top-left at integer view-position baseViewX/Y:
+    baseChanged = True
+    baseViewX = 0
+    baseViewY = 0
+
+    saveVersion = 2
 
     # User-view's zoom/position:
     viewZoom = 1.0
@@ -36,20 +55,48 @@ class Mode_Map:
 
     mapType = 0
     mapImage = 0
+    mapLoaded = False
+
+    # Fetch a replacement map once current position is within this fraction of the map's span of an edge:
+    refreshMargin = 0.2
+    refreshRetryDelay = 30
+    refreshTask = None
+    lastRefreshFailTime = 0
     mapSize = 640
     mapScale = 2
 
+    # Tiled map, used if config.MAPSOURCE is 'tiles' or 'mbtiles':
+    tileMap = None
+    tileZoom = 0
+    maxTileZoom = 20
+    mapOriginX = 0
+    mapOriginY = 0
+
+    # Zoom-levels: each level out halves the map's scale. Level 0 is the downloaded map's own scale;
+    # static maps use a precomputed image-pyramid, tiled maps can also zoom in past level 0.
+    zoomLevel = 0
+    minZoomLevel = 0
+    maxZoomLevel = 3
+    maxZoomInLevels = 2
+    levelScale = 1.0
+    mapLevels = []
+
     cursorSize = 16
     markerSizeSm = 32
     markerSizeBg = 48
     halfMarkerSizeSm = (markerSizeSm / 2)
     halfMarkerSizeBg = (markerSizeBg / 2)
 
+    # Size of spatial-index cells for places, in map-pixels:
+    placeCellSize = 128
+
     # Used to implement mouse-acceleration:
     moveStartTick = 0
     lastMoveTick = 0
 
     mapImageSize = (mapSize * mapScale)
+    # Map-image size at current zoom-level:
+    viewImageSize = mapImageSize
 
     def __init__(self, *args, **kwargs):
         self.parent = args[0]
@@ -57,6 +104,8 @@ class Mode_Map:
 
         self.pageCanvas = pygame.Surface((config.WIDTH, config.HEIGHT))
         self.mapCanvas = pygame.Surface((config.WIDTH, config.HEIGHT * 0.91))
+        self.baseCanvas = pygame.Surface(self.mapCanvas.get_size())
+        self.markerCanvas = pygame.Surface(self.mapCanvas.get_size())
         self.canvasWidth = self.mapCanvas.get_width()
         self.canvasHeight = self.mapCanvas.get_height()
 
@@ -102,18 +151,27 @@ class Mode_Map:
                           lnSize)
         self.cursorBox = self.cursorBox.convert()
         self.resetCursorPos()
+        self.placeIndex = GridIndex(self.placeCellSize)
+        self.placeTable = pipboy_places.PlaceTable()
 
         if self.mapType == 0:
             # LOCAL MAP DATA:
             self.rootParent.localMapPage = self
             self.name = "Local Map"
             self.mapFilename = ("%s/map_local.jpg" %(config.CACHEPATH))
-            self.dataFilename = ("%s/map_local.txt" %(config.CACHEPATH))
-            self.mapArgs = "&maptype=satellite&style=feature:road|visibility:off"
+            self.dataFilename = ("%s/map_local.json" % (config.CACHEPATH))
+            self.processedFilename = ("%s/map_local.rgb" % (config.CACHEPATH))
+            self.mapArgs = [('maptype', 'satellite'), ('style', 'feature:road|visibility:off')]
             self.mapZoom = 18
+            self.tileUrl = getProvider().tileUrls['local']
+            self.mbtilesFilename = config.MBTILESFILES['local']
 
-            self.images = {
-                "door":     pygame.image.load('images/mapmarkers/icon_local_door.png'),
+            # Image-processing: darkened satellite-image
+            self.imageParams = {'contrast': 1.5, 'brightness': 0.2}
+            self.tileParams = self.imageParams
+
+            self.iconFiles = {
+                "door":     'images/mapmarkers/icon_local_door.png',
             }
 
             self.places = [
@@ -129,39 +187,45 @@ class Mode_Map:
             self.rootParent.worldMapPage = self
             self.name = "World Map"
             self.mapFilename = ("%s/map_world.jpg" % (config.CACHEPATH))
-            self.dataFilename = ("%s/map_world.txt" % (config.CACHEPATH))
-            self.mapArgs = "&maptype=hybrid&style=feature:road|element:geometry|color:0xDDDDDD&style=element:labels|visibility:off"
+            self.dataFilename = ("%s/map_world.json" % (config.CACHEPATH))
+            self.processedFilename = ("%s/map_world.rgb" % (config.CACHEPATH))
+            self.mapArgs = [('maptype', 'hybrid'),
+                            ('style', 'feature:road|element:geometry|color:0xDDDDDD'),
+                            ('style', 'element:labels|visibility:off')]
             self.mapZoom = 14
-
-            # Load map-marker icons:
-            self.images = {
-                "door":             pygame.image.load('images/mapmarkers/icon_local_door.png'),
-                "encampment":       pygame.image.load('images/mapmarkers/icon_map_encampment.png'),
-                "military":         pygame.image.load('images/mapmarkers/icon_map_military.png'),
-                "office":           pygame.image.load('images/mapmarkers/icon_map_office.png'),
-                "urban":            pygame.image.load('images/mapmarkers/icon_map_ruins_urban.png'),
-                "vault":            pygame.image.load('images/mapmarkers/icon_map_vault.png'),
-                "cave":             pygame.image.load('images/mapmarkers/icon_map_cave.png'),
-                "factory":          pygame.image.load('images/mapmarkers/icon_map_factory.png'),
-                "monument":         pygame.image.load('images/mapmarkers/icon_map_monument.png'),
-                "ruins_sewer":      pygame.image.load('images/mapmarkers/icon_map_ruins_sewer.png'),
-                "settlement":       pygame.image.load('images/mapmarkers/icon_map_settlement.png'),
-                "city":             pygame.image.load('images/mapmarkers/icon_map_city.png'),
-                "metro":            pygame.image.load('images/mapmarkers/icon_map_metro.png'),
-                "natural_landmark": pygame.image.load('images/mapmarkers/icon_map_natural_landmark.png'),
-                "ruins_town":       pygame.image.load('images/mapmarkers/icon_map_ruins_town.png'),
-                "ruins_urban":      pygame.image.load('images/mapmarkers/icon_map_ruins_urban.png'),
-                "undiscovered":     pygame.image.load('images/mapmarkers/icon_map_undiscovered.png'),
+            self.tileUrl = getProvider().tileUrls['world']
+            self.mbtilesFilename = config.MBTILESFILES['world']
+
+            # Image-processing: darkened, with large-pixel noise on two levels of gridding, and grid-lines
+            gridStep = (self.mapImageSize / 16)
+            self.imageParams = {'contrast': 1.5, 'brightness': 0.2, 'noiseStep': gridStep, 'noiseLevels': (1, 2),
+                                'gridStep': gridStep, 'borderWidth': 2}
+            self.tileParams = {'contrast': 1.5, 'brightness': 0.2, 'gridStep': (TileMap.tileSize / 4)}
+
+            # Map-marker icon-files:
+            self.iconFiles = {
+                "door":             'images/mapmarkers/icon_local_door.png',
+                "encampment":       'images/mapmarkers/icon_map_encampment.png',
+                "military":         'images/mapmarkers/icon_map_military.png',
+                "office":           'images/mapmarkers/icon_map_office.png',
+                "urban":            'images/mapmarkers/icon_map_ruins_urban.png',
+                "vault":            'images/mapmarkers/icon_map_vault.png',
+                "cave":             'images/mapmarkers/icon_map_cave.png',
+                "factory":          'images/mapmarkers/icon_map_factory.png',
+                "monument":         'images/mapmarkers/icon_map_monument.png',
+                "ruins_sewer":      'images/mapmarkers/icon_map_ruins_sewer.png',
+                "settlement":       'images/mapmarkers/icon_map_settlement.png',
+                "city":             'images/mapmarkers/icon_map_city.png',
+                "metro":            'images/mapmarkers/icon_map_metro.png',
+                "natural_landmark": 'images/mapmarkers/icon_map_natural_landmark.png',
+                "ruins_town":       'images/mapmarkers/icon_map_ruins_town.png',
+                "ruins_urban":      'images/mapmarkers/icon_map_ruins_urban.png',
+                "undiscovered":     'images/mapmarkers/icon_map_undiscovered.png',
             }
 
-        # Scale images down to 32x32:
-        self.imagesSm = {}
-        for imgName in self.images:
-            img = self.images[imgName]
-            smImage = pygame.transform.scale(img, (self.markerSizeSm, self.markerSizeSm))
-            self.imagesSm[imgName] = smImage.convert()
-            bgImg = pygame.transform.scale(img, (self.markerSizeBg, self.markerSizeBg))
-            self.images[imgName] = bgImg.convert()
+        # Pack small and highlighted marker-sizes into one atlas:
+        self.markerAtlas = MarkerAtlas(self.iconFiles, (self.markerSizeSm, self.markerSizeBg))
+        self.labelCache = LabelCache()
 
         # Scale cursor down to 16x16
         self.mapCursor = pygame.image.load('images/cursor.png')
@@ -171,8 +235,8 @@ class Mode_Map:
     def getMapBounds(self, lat, lon, zoom, mapSize):
         '''Get latitude/longitude boundaries for a given map-image:'''
 
-        # Make instance of coordinates-converter:
-        mercator = GlobalMercator()
+        # Shared coordinates-converter:
+        mercator = SharedMercator()
 
         # Convert latitude/longitude to meters, and then to global-image pixel-coordinates:
         mx, my = mercator.LatLonToMeters(lat, lon)
@@ -188,218 +252,421 @@ class Mode_Map:
         minmx, minmy = mercator.PixelsToMeters(mapMinX, mapMinY, zoom)
         maxmx, maxmy = mercator.PixelsToMeters(mapMaxX, mapMaxY, zoom)
 
-        self.minLat, self.minLon = mercator.MetersToLatLon(minmx, minmy)
-        self.maxLat, self.maxLon = mercator.MetersToLatLon(maxmx, maxmy)
+        minLat, minLon = mercator.MetersToLatLon(minmx, minmy)
+        maxLat, maxLon = mercator.MetersToLatLon(maxmx, maxmy)
 
-        return self.minLat, self.minLon, self.maxLat, self.maxLon
+        return [minLat, minLon, maxLat, maxLon]
 
     def setViewToCentre(self):
         '''Set default user-view position:'''
-        self.viewPosX = (-0.5 * (self.mapImage.get_width()-config.WIDTH)) - 1
-        self.viewPosY = (-0.5 * (self.mapImage.get_height()-config.HEIGHT)) - 1
+        self.viewPosX = (-0.5 * (self.viewImageSize-config.WIDTH)) - 1
+        self.viewPosY = (-0.5 * (self.viewImageSize-config.HEIGHT)) - 1
+        self.viewChanged = True
 
     def setViewToCurPos(self):
-        '''Set user-view to centre in on current location:'''
-        # Get position on map:
-        px = (self.rootParent.gpsModule.lon - self.minLon) * self.xPerLon
-        py = self.mapImage.get_width() - ((self.rootParent.gpsModule.lat - self.minLat) * self.yPerLat)
+        '''Set user-view to centre in on current location (once a map has been loaded):'''
+        if not self.mapLoaded:
+            return
+        self.updateCurPos()
+        self.viewPosX = (0.5 * config.WIDTH) - self.curPosX
+        self.viewPosY = (0.5 * config.HEIGHT) - self.curPosY
+        self.viewChanged = True
+
+    def updateCurPos(self):
+        '''Project latest GPS position-snapshot to map-pixels, flagging a redraw only if it moved by a pixel or more:'''
+        position = self.rootParent.gpsModule.position
+        if self.tileMap is not None:
+            # Tiles are Mercator-projected, so places and position are too:
+            px, py = self.tileMap.latLonToPixels(position.lat, position.lon)
+            px, py = int(px - self.mapOriginX), int(py - self.mapOriginY)
+        else:
+            px = int((position.lon - self.minLon) * self.xPerLon)
+            py = int(self.viewImageSize - ((position.lat - self.minLat) * self.yPerLat))
+
+        if (px != self.curPosX) or (py != self.curPosY):
+            self.curPosX, self.curPosY = px, py
+            self.posChanged = True
+            self.changed = True
+
+    def processTile(self, tileFile, tx, ty):
+        '''Load and process a map-tile filename or file-object (called from tile-fetching thread):'''
+        return processImageFile(tileFile, self.tileParams)
+
+    def getTileMap(self, lat, lon):
+        '''Set up tiled map, with its origin matching the equivalent static map-image's top-left corner:'''
+        self.tileZoom = self.mapZoom + int(math.log(self.mapScale, 2))
+        tileMapName = self.name.replace(" ", "_").lower()
+        if (config.MAPSOURCE == 'mbtiles') and not os.path.exists(self.mbtilesFilename):
+            print("MBTiles file not found: %s, using tile-server" % (self.mbtilesFilename))
+
+        if (config.MAPSOURCE == 'mbtiles') and os.path.exists(self.mbtilesFilename):
+            self.tileMap = MBTilesMap(tileMapName, self.mbtilesFilename, self.tileZoom, self.processTile)
+
+            # Limit zooming to the tileset's zoom-range:
+            metadata = self.tileMap.metadata
+            packMinZoom, packMaxZoom = int(metadata.get('minzoom', 0)), int(metadata.get('maxzoom', self.maxTileZoom))
+            self.maxTileZoom = packMaxZoom
+            self.maxZoomLevel = max(0, min(self.maxZoomLevel, self.tileZoom - packMinZoom))
+            if not (packMinZoom <= self.tileZoom <= packMaxZoom):
+                print("MBTiles %s covers zooms %s-%s, not this map's zoom %s; some levels will be blank" %
+                      (self.mbtilesFilename, packMinZoom, packMaxZoom, self.tileZoom))
+        else:
+            self.tileMap = TileMap(tileMapName, self.tileUrl, self.tileZoom, self.processTile)
+        self.mapCentre = (lat, lon)
+
+        # Tiles exist at finer zooms than the static map, down to maxTileZoom; level 0 is always allowed:
+        self.minZoomLevel = min(0, max(-self.maxZoomInLevels, self.tileZoom - self.maxTileZoom))
+
+    def buildMapLevels(self, mapImage):
+        '''Precompute static map-image pyramid, halving size at each level, so zooming is just a blit:'''
+        mapLevels = [mapImage]
+        for level in range(1, self.maxZoomLevel + 1):
+            prevImage = mapLevels[-1]
+            levelSize = (prevImage.get_width() / 2, prevImage.get_height() / 2)
+            mapLevels.append(pygame.transform.smoothscale(prevImage, levelSize))
+        return mapLevels
+
+    def setZoomLevel(self, zoomLevel, anchorX=None, anchorY=None):
+        '''Switch to a cached zoom-level, keeping the map-point at anchor (default canvas-centre) in place:'''
+        zoomLevel = max(self.minZoomLevel, min(self.maxZoomLevel, zoomLevel))
+        levelScale = (2.0 ** -zoomLevel)
+
+        if anchorX is None:
+            anchorX, anchorY = (self.canvasWidth / 2), (self.canvasHeight / 2)
+        scaleChange = (levelScale / self.levelScale)
+        self.viewPosX = anchorX - ((anchorX - self.viewPosX) * scaleChange)
+        self.viewPosY = anchorY - ((anchorY - self.viewPosY) * scaleChange)
+
+        self.zoomLevel = zoomLevel
+        self.levelScale = levelScale
+        self.viewImageSize = (self.mapImageSize * levelScale)
+
+        # Lat/Lon to X/Y conversion-values for this level:
+        self.xPerLon = (self.baseXPerLon * levelScale)
+        self.yPerLat = (self.baseYPerLat * levelScale)
+
+        if self.tileMap is not None:
+            self.tileMap.setZoom(self.tileZoom - zoomLevel)
+            centreX, centreY = self.tileMap.latLonToPixels(*self.mapCentre)
+            self.mapOriginX = centreX - (self.viewImageSize / 2)
+            self.mapOriginY = centreY - (self.viewImageSize / 2)
+        else:
+            self.levelImage = self.mapLevels[zoomLevel]
 
-        self.viewPosX = (0.5 * config.WIDTH) - px
-        self.viewPosY = (0.5 * config.HEIGHT) - py
+        self.indexPlaces()
 
-    def getMap(self, doDownload=config.USE_INTERNET):
-
-        lat, lon = 0, 0
+        self.baseChanged = True
+        self.viewChanged = True
+        self.changed = True
 
+    def getMapCentre(self):
+        '''Get (lat, lon, mapLocation) that the map should currently be centred on:'''
+        gpsModule = self.rootParent.gpsModule
         if self.mapType == 0:
-            lat = self.rootParent.gpsModule.lat
-            lon = self.rootParent.gpsModule.lon
-            self.mapLocation = ("%s,%s" % (str(lat), str(lon)))
+            position = gpsModule.position
+            return position.lat, position.lon, ("%s,%s" % (str(position.lat), str(position.lon)))
         else:
-            self.mapLocation = self.rootParent.gpsModule.locality
-            lat = self.rootParent.gpsModule.localityLat
-            lon = self.rootParent.gpsModule.localityLon
+            return gpsModule.localityLat, gpsModule.localityLon, gpsModule.locality
+
+    def fetchMap(self, lat, lon, mapLocation, doDownload=config.USE_INTERNET):
+        '''Load map-data for a given centre, from cache or by downloading it.
+        Doesn't change the current map, so can run on a worker-thread; returns data to be swapped in by applyMap.'''
+        useTiles = (config.MAPSOURCE in ('tiles', 'mbtiles'))
+        mapData = {'lat': lat, 'lon': lon, 'mapLocation': mapLocation, 'places': self.places}
 
         # Load cached data, if found:
-        if (not config.FORCE_DOWNLOAD) and (os.path.exists(self.dataFilename)) and (os.path.exists(self.mapFilename)):
+        if (not config.FORCE_DOWNLOAD) and (useTiles or os.path.exists(self.mapFilename)):
             print("  Reading data: %s" % (self.dataFilename))
-            with open(self.dataFilename, 'r') as f:
-                savedVersion = eval(f.readline())
-                savedMapLocation = (f.readline()).rstrip()
-
-                # Only use coordinates-cache file if its version matches current version:
-                if savedVersion == self.saveVersion:
-                    if savedMapLocation == self.mapLocation:
-                        print("  Map-file is up-to-date, no need to download")
-                        self.minLat = eval(f.readline())
-                        self.minLon = eval(f.readline())
-                        self.maxLat = eval(f.readline())
-                        self.maxLon = eval(f.readline())
-
-                        self.places = []
-                        for item in f.readlines():
-                            self.places.append(eval(item))
-                        # print "YAY!"
-                        # print self.places
-
-                        doDownload = False
-                    True
-                else:
-                    print("  Invalid cache-version, ignoring file")
+            savedData = loadCache(self.dataFilename, self.saveVersion)
+
+            if (savedData is not None) and (savedData['mapLocation'] == mapLocation):
+                print("  Map-file is up-to-date, no need to download")
+                mapData['bounds'] = savedData['bounds']
+                mapData['places'] = savedData['places']
+                doDownload = False
 
         if doDownload:
             print("DOWNLOADING:")
-            mapUrl = "http://maps.googleapis.com/maps/api/staticmap?center=%s" % (self.mapLocation)
-            mapUrl += ("&zoom=%s&scale=%s&size=%sx%s%s&sensor=true" % (str(self.mapZoom), str(self.mapScale), str(self.mapSize), str(self.mapSize), self.mapArgs))
-            print(mapUrl)
-            urllib.urlretrieve(mapUrl, self.mapFilename)
-
             if self.mapType == 1:
-                # Download a set of places from Google for markers:
-                self.places = pipboy_places.getPlaces(lat,lon)
+                # Get a set of places for markers (cached by area), alongside map-image:
+                placesTask = startTask("Places", lambda: pipboy_places.getCachedPlaces(lat, lon))
 
-            # Work out coordinates for map's corners:
-            self.getMapBounds(lat, lon, self.mapZoom, self.mapSize)
-            print("  Lat/Lon Min:(%s,%s) Max:(%s,%s)" % (self.minLat, self.minLon, self.maxLat, self.maxLon))
-            print("  Writing to file: %s" % (self.dataFilename))
-            with open(self.dataFilename, 'w') as f:
-                f.write("%s\n" % (self.saveVersion))
-                f.write("%s\n" % (self.mapLocation))
-                f.write("%s\n%s\n%s\n%s\n" % (repr(self.minLat), repr(self.minLon), repr(self.maxLat), repr(self.maxLon)))
+            # Tiled maps fetch their images as they're needed:
+            if not useTiles:
+                imageData = getProvider().staticMap(mapLocation, self.mapZoom, self.mapScale, self.mapSize, self.mapArgs)
 
-                for place in self.places:
-                    f.write("%s\n" % (repr(place)))
+                # Write to temporary file first, so a failed write can't replace the current map:
+                tempFilename = (self.mapFilename + ".tmp")
+                with open(tempFilename, 'wb') as f:
+                    f.write(imageData)
+                os.rename(tempFilename, self.mapFilename)
 
-            # Load downloaded image via PIL, and tweak contrast/brightness:
-            im = Image.open(self.mapFilename)
-            im = ImageEnhance.Contrast(im).enhance(1.5)
-            im = ImageEnhance.Brightness(im).enhance(0.2)
-            im = im.convert("RGB")
-
-            # Convert PIL image to Pygame surface:
-            self.mapImage = pygame.image.frombuffer(im.tostring(), im.size, "RGB")
-
-            # Add lines to World Map:
             if self.mapType == 1:
-                imageSize = self.mapImage.get_width()
-                stepCount = 16
-                stepSize = (imageSize / stepCount)
-                lineWidth = 2
-                gridPos = stepSize
-
-                # Add large-pixel noise, on two levels of gridding:
-                for n in [1, 2]:
-                    mapArray = pygame.surfarray.pixels3d(self.mapImage)
-                    noisePixSize = (stepSize * n)
-                    noise_small = numpy.random.random((imageSize/noisePixSize, imageSize/noisePixSize)) * 0.6 + 0.5
-                    noise_big = noise_small.repeat(noisePixSize, 0).repeat(noisePixSize, 1)
-                    mapArray *= noise_big[:, :, numpy.newaxis]
-
-                gridVal = 40
-                gridColour = (gridVal, gridVal, gridVal)
-
-                while gridPos < imageSize:
-                    pygame.draw.lines(self.mapImage, gridColour, False, [(0, gridPos), (imageSize, gridPos)], lineWidth)
-                    pygame.draw.lines(self.mapImage, gridColour, False, [(gridPos, 0), (gridPos, imageSize)], lineWidth)
-                    gridPos += stepSize
-                pygame.draw.rect(self.mapImage, (255, 255, 255), (0, 0, imageSize, imageSize), lineWidth)
-                print("GRIDDED!")
-
-            # Save processed image to cache-folder:
-            pygame.image.save(self.mapImage, self.mapFilename)
-        else:
-            # Load pre-processed image:
-            self.mapImage = pygame.image.load(self.mapFilename)
+                placesTask.join()
+                if placesTask.error is None:
+                    mapData['places'] = placesTask.result
 
-        # Work out values for quickly converting Lat/Lon to X/Y:
-        self.xPerLon = (self.mapScale * self.mapSize)/(self.maxLon - self.minLon)
-        self.yPerLat = (self.mapScale * self.mapSize)/(self.maxLat - self.minLat)
-        print("xPerLon: %s  yPerLat:%s" % (self.xPerLon, self.yPerLat))
-
-        self.setViewToCurPos()
-
-    def drawCurrentPosToCanvas(self):
-        '''Draw current-position marker:'''
-        # Get position on map:
-        px = (self.rootParent.gpsModule.lon - self.minLon) * self.xPerLon
-        py = self.mapImageSize - ((self.rootParent.gpsModule.lat - self.minLat) * self.yPerLat)
+            # Work out coordinates for map's corners:
+            mapData['bounds'] = self.getMapBounds(lat, lon, self.mapZoom, self.mapSize)
+            print("  Lat/Lon Min:(%s,%s) Max:(%s,%s)" % tuple(mapData['bounds']))
+            print("  Writing to file: %s" % (self.dataFilename))
+            saveCache(self.dataFilename, self.saveVersion, {
+                'mapLocation': mapLocation,
+                'bounds': mapData['bounds'],
+                'places': mapData['places'],
+            })
+
+        if useTiles:
+            # Map-bounds don't need a download, so are always available:
+            mapData['bounds'] = self.getMapBounds(lat, lon, self.mapZoom, self.mapSize)
+        elif 'bounds' not in mapData:
+            raise IOError("No cached map for %s, and it can't be downloaded" % (mapLocation))
+        else:
+            # Processed image is cached, keyed by source-image and processing-parameters:
+            mapImage = loadProcessedImage(self.mapFilename, self.processedFilename, self.imageParams)
+            mapData['mapLevels'] = self.buildMapLevels(mapImage)
+
+        return mapData
+
+    def applyMap(self, mapData):
+        '''Swap in map-data from fetchMap, keeping the view on the same place if a map was already shown:'''
+        wasLoaded = self.mapLoaded
+        oldMinLat, oldMinLon = getattr(self, 'minLat', 0), getattr(self, 'minLon', 0)
+
+        self.mapLocation = mapData['mapLocation']
+        self.minLat, self.minLon, self.maxLat, self.maxLon = mapData['bounds']
+        self.places = mapData['places']
+
+        if 'mapLevels' in mapData:
+            self.mapLevels = mapData['mapLevels']
+            self.mapImage = self.mapLevels[0]
+        elif self.tileMap is None:
+            self.getTileMap(mapData['lat'], mapData['lon'])
+        else:
+            # Existing tile-map and its cached tiles carry on, with the new origin:
+            self.mapCentre = (mapData['lat'], mapData['lon'])
 
-        # Get position on screen:
-        px += self.viewPosX
-        py += self.viewPosY
+        # Shift view by the change in map-origin:
+        if wasLoaded:
+            self.viewPosX += (self.minLon - oldMinLon) * self.xPerLon
+            self.viewPosY -= (self.minLat - oldMinLat) * self.yPerLat
 
-        # Draw to map:
-        self.mapCanvas.blit(self.mapCursor, (px, py))
+        # Work out values for quickly converting Lat/Lon to X/Y at level 0:
+        self.baseXPerLon = (self.mapScale * self.mapSize)/(self.maxLon - self.minLon)
+        self.baseYPerLat = (self.mapScale * self.mapSize)/(self.maxLat - self.minLat)
+        print("xPerLon: %s  yPerLat:%s" % (self.baseXPerLon, self.baseYPerLat))
 
+        self.buildPlaceTable()
+        self.setZoomLevel(self.zoomLevel)
 
-    def drawMarkerToCanvas(self, placeItem):
-        '''Draw a given marker to mapCanvas at specific latitude/longitude coordinates:'''
+        self.mapLoaded = True
 
-        # self.drawMarkerToCanvas (self.imagesSm[markerType], , )
+        # First map is shown centred on current location:
+        if not wasLoaded:
+            self.setViewToCurPos()
 
-        # Get position on map:
-        px = (placeItem['lon'] - self.minLon) * self.xPerLon
-        py = self.mapImage.get_width() - ((placeItem['lat'] - self.minLat) * self.yPerLat)
+    def getMap(self, doDownload=config.USE_INTERNET):
+        '''Load map for current position, blocking until it's ready (used while booting):'''
+        lat, lon, mapLocation = self.getMapCentre()
+        self.applyMap(self.fetchMap(lat, lon, mapLocation, doDownload))
+
+    def startRefresh(self, lat, lon, mapLocation):
+        '''Fetch replacement map on a worker-thread; the current map stays in use until it's swapped in'''
+        print("Refreshing %s at (%s,%s)" % (self.name, lat, lon))
+        self.refreshTask = startTask("Refresh %s" % (self.name), lambda: self.fetchMap(lat, lon, mapLocation))
+
+    def checkRefresh(self):
+        '''Swap in finished map-refresh, or start a refresh if there's no map or the current position nears its edges:'''
+        if self.refreshTask is not None:
+            if self.refreshTask.is_alive():
+                return
+            task, self.refreshTask = self.refreshTask, None
+            if task.error is None:
+                self.applyMap(task.result)
+            else:
+                self.lastRefreshFailTime = time.time()
+            return
+
+        # Don't retry straight after a failed refresh:
+        if (time.time() - self.lastRefreshFailTime) < self.refreshRetryDelay:
+            return
+
+        gpsModule = self.rootParent.gpsModule
+        position = gpsModule.position
+        if not self.mapLoaded:
+            self.startRefresh(*self.getMapCentre())
+        elif gpsModule.hasCoords():
+            marginLat = (self.maxLat - self.minLat) * self.refreshMargin
+            marginLon = (self.maxLon - self.minLon) * self.refreshMargin
+            if not ((self.minLat + marginLat) < position.lat < (self.maxLat - marginLat)) or \
+                    not ((self.minLon + marginLon) < position.lon < (self.maxLon - marginLon)):
+                self.startRefresh(position.lat, position.lon, ("%s,%s" % (str(position.lat), str(position.lon))))
+
+    def drawCurrentPosToCanvas(self, canvas):
+        '''Draw current-position marker, at its last-projected map-position:'''
+        canvas.blit(self.mapCursor, (self.curPosX + self.baseViewX, self.curPosY + self.baseViewY))
+
+    def buildPlaceTable(self):
+        '''Convert places-list to array-backed table, with marker atlas-rects looked up by its icon-ids:'''
+        self.placeTable = pipboy_places.PlaceTable(self.places)
+        self.placeIcons = [self.markerAtlas.rect(iconName, self.markerSizeBg) for iconName in self.placeTable.iconNames]
+        self.placeIconsSm = [self.markerAtlas.rect(iconName, self.markerSizeSm) for iconName in self.placeTable.iconNames]
+
+    def indexPlaces(self):
+        '''Project places to map-pixels at current zoom-level, and bucket them for viewport/cursor queries:'''
+        if self.tileMap is not None:
+            xs, ys = self.tileMap.latLonToPixelsArray(self.placeTable.lats, self.placeTable.lons)
+            xs, ys = (xs - self.mapOriginX), (ys - self.mapOriginY)
+        else:
+            xs, ys = self.placeTable.project(self.minLat, self.minLon, self.xPerLon, self.yPerLat, self.viewImageSize)
+        self.placeIndex.build(xs, ys)
 
+    def drawMarkerToCanvas(self, canvas, placeNum, highlighted):
+        '''Draw a given place's marker to canvas, at its indexed map-position:'''
         # Get position on screen:
-        px += self.viewPosX
-        py += self.viewPosY
-
-        # Is this inside the cursor-box?
-        highlighted = (abs(px - self.cursorPosX) < self.cursorRadius) and (abs(py - self.cursorPosY) < self.cursorRadius)
+        px = self.placeIndex.xs[placeNum] + self.baseViewX
+        py = self.placeIndex.ys[placeNum] + self.baseViewY
 
         # Get appropriately-sized marker-icon/radius:
-        markerType = placeItem['icon']
+        iconId = self.placeTable.iconIds[placeNum]
         if highlighted:
-            markerImg, markerSize, halfMarkerSize = self.images[markerType], self.markerSizeBg, self.halfMarkerSizeBg
-            self.cursorName = placeItem['name']
+            markerRect, halfMarkerSize = self.placeIcons[iconId], self.halfMarkerSizeBg
         else:
-            markerImg, markerSize, halfMarkerSize = self.imagesSm[markerType], self.markerSizeSm, self.halfMarkerSizeSm
+            markerRect, halfMarkerSize = self.placeIconsSm[iconId], self.halfMarkerSizeSm
+
+        self.markerAtlas.draw(canvas, markerRect, (px - halfMarkerSize, py - halfMarkerSize))
+
+    def drawMarkersToCanvas(self, canvas, rect, skipNum=None):
+        '''Draw current-position marker, and unhighlighted markers that overlap given canvas-area:'''
+        canvas.set_clip(rect)
+        self.drawCurrentPosToCanvas(canvas)
+
+        # Map-pixel position of area, with margin for marker-size:
+        margin = self.halfMarkerSizeSm
+        minX, minY = (rect.left - self.baseViewX - margin), (rect.top - self.baseViewY - margin)
+        maxX, maxY = (rect.right - self.baseViewX + margin), (rect.bottom - self.baseViewY + margin)
+
+        for placeNum in self.placeIndex.query(minX, minY, maxX, maxY):
+            if placeNum != skipNum:
+                self.drawMarkerToCanvas(canvas, placeNum, False)
+        canvas.set_clip(None)
+
+    def drawBaseRect(self, rect):
+        '''Draw map-texture to an area of the base-layer:'''
+        if self.tileMap is not None:
+            self.tileMap.draw(self.baseCanvas.subsurface(rect),
+                              self.mapOriginX - self.baseViewX + rect.left, self.mapOriginY - self.baseViewY + rect.top)
+        else:
+            self.baseCanvas.set_clip(rect)
+            self.baseCanvas.fill((30, 30, 30))
+            self.baseCanvas.blit(self.levelImage, (self.baseViewX, self.baseViewY))
+            self.baseCanvas.set_clip(None)
+
+    def updateBaseLayer(self):
+        '''Bring base-layer up to date with view-position; panning scrolls the existing layer and draws the exposed strips'''
+        baseViewX, baseViewY = int(self.viewPosX), int(self.viewPosY)
+        dx, dy = (baseViewX - self.baseViewX), (baseViewY - self.baseViewY)
+        self.baseViewX, self.baseViewY = baseViewX, baseViewY
+
+        width, height = self.canvasWidth, self.canvasHeight
+        if self.baseChanged or (abs(dx) >= width) or (abs(dy) >= height):
+            self.drawBaseRect(self.baseCanvas.get_rect())
+            self.baseChanged = False
+            return
+
+        self.baseCanvas.scroll(dx, dy)
+        if dx > 0:
+            self.drawBaseRect(pygame.Rect(0, 0, dx, height))
+        elif dx < 0:
+            self.drawBaseRect(pygame.Rect(width + dx, 0, -dx, height))
+        if dy > 0:
+            self.drawBaseRect(pygame.Rect(0, 0, width, dy))
+        elif dy < 0:
+            self.drawBaseRect(pygame.Rect(0, height + dy, width, -dy))
+
+    def drawCursorLayer(self):
+        '''Draw cursor-box, highlighted marker and name-label to mapCanvas, returning the area they cover:'''
+        # Highlight the marker nearest the cursor-box's centre:
+        highlightNum = self.placeIndex.nearest(self.cursorPosX - self.baseViewX, self.cursorPosY - self.baseViewY, self.cursorRadius)
+
+        # Area around cursor that can hold the box, highlighted markers and name-label:
+        areaRadius = (self.cursorRadius + self.halfMarkerSizeBg)
+        cursorArea = pygame.Rect(self.cursorPosX - areaRadius, self.cursorPosY - areaRadius, 2 * areaRadius, 2 * areaRadius)
+
+        self.cursorName = ""
+        textImg = None
+        if highlightNum is not None:
+            self.cursorName = self.placeTable.names[highlightNum]
+            textImg = self.labelCache.get(self.cursorName)
+            textX = self.cursorPosX-(textImg.get_width() / 2)
+            textY = self.cursorPosY+self.cursorRadius+(config.charHeight / 2)
+            cursorArea.union_ip(textImg.get_rect(topleft=(textX, textY)))
+        cursorArea = cursorArea.clip(self.mapCanvas.get_rect())
+
+        # Rebuild area from base-layer, without the highlighted marker's small version:
+        self.mapCanvas.blit(self.baseCanvas, cursorArea, cursorArea)
+        self.drawMarkersToCanvas(self.mapCanvas, cursorArea, highlightNum)
+
+        if highlightNum is not None:
+            self.drawMarkerToCanvas(self.mapCanvas, highlightNum, True)
+
+        # Draw cursor-box:
+        self.mapCanvas.blit(self.cursorBox, (self.cursorPosX-self.cursorRadius, self.cursorPosY-self.cursorRadius), None, pygame.BLEND_RGB_ADD)
+
+        if textImg is not None:
+            self.mapCanvas.blit(textImg, (textX, textY), None, pygame.BLEND_ADD)
+
+        return cursorArea
+
+    def drawPage(self):
 
-        px -= halfMarkerSize
-        py -= halfMarkerSize
+        # Redraw when fetched map-tiles arrive:
+        if (self.tileMap is not None) and self.tileMap.takeChanged():
+            self.changed = True
+            self.baseChanged = True
 
-        # Draw marker if it is on-screen:
-        if ((px+markerSize) >= 0) and (px <= config.WIDTH) and ((py+markerSize) >= 0) and (py <= config.HEIGHT):
-            self.mapCanvas.blit(markerImg, (px, py), None, pygame.BLEND_RGB_ADD)
+        # Background map-refresh never blocks drawing; old map is shown until the new one is swapped in:
+        self.checkRefresh()
 
-    def drawPage(self):
+        # Live GPS position only invalidates the page once its marker moves:
+        if self.mapLoaded:
+            self.updateCurPos()
 
         pageChanged = self.changed
         self.changed = False
 
         if pageChanged:
 
-            self.mapCanvas.fill((30, 30, 30))
-
-            # Download map if required:
-            if self.mapImage == 0:
-                self.getMap()
-
-            # Blit map-texture to canvas:
-            self.mapCanvas.blit(self.mapImage, (self.viewPosX, self.viewPosY))
-
-            # Draw current-position marker:
-            self.drawCurrentPosToCanvas()
-
-            # Set blank cursorName:
-            self.cursorName = ""
-
-            # Draw location-markers:
-            for item in self.places:
-                self.drawMarkerToCanvas(item)
-
-            # Draw cursor-box:
-            self.mapCanvas.blit(self.cursorBox, (self.cursorPosX-self.cursorRadius, self.cursorPosY-self.cursorRadius), None, pygame.BLEND_RGB_ADD)
-
-            if self.cursorName != "":
-                textImg = config.FONT_LRG.render(self.cursorName, True, config.DRAWCOLOUR, (0, 0, 0))
-                textX = self.cursorPosX-(textImg.get_width() / 2)
-                textY = self.cursorPosY+self.cursorRadius+(config.charHeight / 2)
-                self.mapCanvas.blit(textImg, (textX, textY), None, pygame.BLEND_ADD)
-
-            # Blit to page-canvas:
-            self.pageCanvas.blit(self.mapCanvas, (0, 0))
+            # Nothing to draw until first map has been fetched:
+            if not self.mapLoaded:
+                self.mapCanvas.fill((30, 30, 30))
+                self.pageCanvas.blit(self.mapCanvas, (0, 0))
+                self.dirtyRects = None
+                return self.pageCanvas, pageChanged
+
+            if self.viewChanged or self.baseChanged or self.posChanged or (self.cursorArea is None):
+                # Scroll base-layer, and redraw markers over it:
+                self.updateBaseLayer()
+                self.markerCanvas.blit(self.baseCanvas, (0, 0))
+                self.drawMarkersToCanvas(self.markerCanvas, self.markerCanvas.get_rect())
+                self.mapCanvas.blit(self.markerCanvas, (0, 0))
+
+                self.cursorArea = self.drawCursorLayer()
+                self.dirtyRects = None
+                self.pageCanvas.blit(self.mapCanvas, (0, 0))
+            else:
+                # Cursor-only move: restore old cursor-area from marker-layer, then draw cursor at its new position:
+                oldCursorArea = self.cursorArea
+                self.mapCanvas.blit(self.markerCanvas, oldCursorArea, oldCursorArea)
+                self.cursorArea = self.drawCursorLayer()
+
+                # Only the old and new cursor-areas differ:
+                self.dirtyRects = [oldCursorArea, self.cursorArea]
+                for rect in self.dirtyRects:
+                    self.pageCanvas.blit(self.mapCanvas, rect, rect)
+
+            self.viewChanged = False
+            self.posChanged = False
 
         return self.pageCanvas, pageChanged
 
@@ -423,6 +690,10 @@ class Mode_Map:
             elif (type(event) is list):
                 mx, my, mzoom = event[0], event[1], event[2]
 
+                # Scroll up zooms in, around the cursor:
+                if (mzoom != 0) and self.mapLoaded:
+                    self.setZoomLevel(self.zoomLevel - mzoom, self.cursorPosX, self.cursorPosY)
+
                 # Mouse acceleration feature:
                 accelTime = 5000
                 maxAccel = 400
@@ -446,17 +717,21 @@ class Mode_Map:
                 if cursMinX < 0:
                     self.viewPosX -= (cursMinX)
                     self.cursorPosX = self.cursorRadius
+                    self.viewChanged = True
                 elif cursMaxX > self.canvasWidth:
                     self.viewPosX += (self.canvasWidth - cursMaxX)
                     self.cursorPosX = (self.canvasWidth - self.cursorRadius)
+                    self.viewChanged = True
 
                 self.cursorPosY += (accelMult * my)
                 cursMinY, cursMaxY = (self.cursorPosY-self.cursorRadius), (self.cursorPosY+self.cursorRadius)
                 if cursMinY < 0:
                     self.viewPosY -= (cursMinY)
                     self.cursorPosY = self.cursorRadius
+                    self.viewChanged = True
                 elif cursMaxY > self.canvasHeight:
                     self.viewPosY += (self.canvasHeight - cursMaxY)
                     self.cursorPosY = (self.canvasHeight - self.cursorRadius)
+                    self.viewChanged = True
 
                 self.changed = True
@@ -71,6 +71,7 @@ class Tab_Stats:
 
             changed = True
             firstDraw = True
+            dirtyRects = None
 
             # Default values:
             curVal = -1
@@ -135,6 +136,11 @@ class Tab_Stats:
                             newVal = string.atoi(token)
                         except:
                             pass
+                elif self.name == 'GPS':  # Show speed in km/h, from GPS position-snapshot
+                    newVal = 0
+                    position = self.rootParent.gpsModule.position
+                    if (position.mode >= 2) and not math.isnan(position.speed):
+                        newVal = int(position.speed * 3.6)
                 else:
                     newVal = self.minVal
 
@@ -194,6 +200,11 @@ class Tab_Stats:
                     self.arrowBtmY = (self.arrowHeadY + (2 * divHeight))
                     self.arrowTextY = (self.arrowBtmY - (0.9 * config.charHeight))
 
+                    # Later redraws only change the value arrow/text:
+                    gaugeRect = pygame.Rect(0, self.arrowTopY - 1, config.WIDTH, 0)
+                    gaugeRect.height = int(self.arrowBtmY - gaugeRect.top + config.charHeight)
+                    self.dirtyRects = [gaugeRect]
+
                     for n in range(0, 5):
                         for n in range(0, 2):
                             divPosX += divWidth
@@ -349,6 +360,12 @@ class Tab_Stats:
             subPageCanvas, subPageChanged = self.curSubPage.drawPage()
 
             pageChanged = (self.changed or subPageChanged)
+
+            # Switching sub-page redraws everything, otherwise use the sub-page's changed areas:
+            if self.changed:
+                self.dirtyRects = None
+            else:
+                self.dirtyRects = getattr(self.curSubPage, 'dirtyRects', None)
             self.changed = False
 
             return subPageCanvas, pageChanged
@@ -490,7 +507,11 @@ class Tab_Stats:
 
     def drawPage(self, modeNum):
         '''Trigger page-functions'''
-        pageCanvas, pageChanged = self.modes[modeNum].drawPage()
+        mode = self.modes[modeNum]
+        pageCanvas, pageChanged = mode.drawPage()
+
+        # Pass page's changed canvas-areas up to drawTab: (None if the whole page has changed)
+        self.dirtyRects = getattr(mode, 'dirtyRects', None)
         return pageCanvas, pageChanged
 
     def resetPage(self, modeNum):
@@ -0,0 +1,35 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Background tasks
+
+import threading
+
+
+class BackgroundTask(threading.Thread):
+    '''Runs a slow function (e.g. downloads, GPS) on its own thread, once any tasks it depends on have finished'''
+
+    def __init__(self, name, function, after=()):
+        threading.Thread.__init__(self, name=name)
+        # Set as daemon, so it'll die with main process:
+        self.daemon = True
+        self.function = function
+        self.after = after
+        self.result = None
+        self.error = None
+
+    def run(self):
+        for task in self.after:
+            task.join()
+        try:
+            self.result = self.function()
+        except Exception as err:
+            # Keep error for whoever joins this task:
+            self.error = err
+            print("TASK FAILED: %s: %s" % (self.name, err))
+
+
+def startTask(name, function, after=()):
+    '''Create and start a background-task:'''
+    task = BackgroundTask(name, function, after)
+    task.start()
+    return task
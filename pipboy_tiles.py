@@ -0,0 +1,256 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Slippy-map tiles: fetched on demand, cached on disk and in memory
+
+import os
+import time
+import threading
+import collections
+import Queue
+import sqlite3
+import StringIO
+import pygame
+from gdal2tiles import SharedMercator
+import config
+from pipboy_provider import getProvider
+
+
+def tileFilename(mapName, zoom, tx, ty):
+    '''Disk-cache filename for a given map's TMS-numbered tile:'''
+    return os.path.join(config.CACHEPATH, "tiles", mapName, str(zoom), str(tx), "%s.tile" % (ty))
+
+
+class TileCache:
+    '''Bounded in-memory cache of decoded tile-surfaces, dropping least-recently-used tiles when full'''
+
+    def __init__(self, maxTiles):
+        self.maxTiles = maxTiles
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.pop(key, None)
+            if tile is not None:
+                # Move to most-recently-used end:
+                self.tiles[key] = tile
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            self.tiles.pop(key, None)
+            self.tiles[key] = tile
+            while len(self.tiles) > self.maxTiles:
+                self.tiles.popitem(last=False)
+
+
+class TileMap:
+    '''Draws a map of any extent from 256px tiles, addressed in Google/OSM raster-pixels (origin top-left).
+    Missing tiles are fetched on a worker-thread, via the disk-cache, and drawn once they arrive.
+    Zoom can be changed with setZoom; tiles from all zoom-levels share one cache.'''
+
+    tileSize = 256
+    blankColour = (30, 30, 30)
+    # Seconds before a tile that failed to load is tried again, and max failed tiles remembered:
+    retryDelay = 30
+    maxUnavailable = 1024
+
+    def __init__(self, name, urlTemplate, zoom, processTile=None, maxTiles=config.TILECACHESIZE):
+        self.name = name
+        self.urlTemplate = urlTemplate
+        self.zoom = zoom
+        self.processTile = processTile
+
+        self.pending = set()
+        # Failure-times of tiles that couldn't be loaded, least-recently-failed first:
+        self.unavailable = collections.OrderedDict()
+        self.pendingLock = threading.Lock()
+
+        self.mercator = SharedMercator(self.tileSize)
+        self.setZoom(zoom)
+        self.cache = TileCache(maxTiles)
+
+        # Set when a fetched tile becomes available, so pages know to redraw:
+        self.changed = False
+
+        self.requests = Queue.Queue()
+        worker = threading.Thread(target=self.fetchLoop, name="Tiles %s" % (name))
+        # Set as daemon, so it'll die with main process:
+        worker.daemon = True
+        worker.start()
+
+    def setZoom(self, zoom):
+        '''Change zoom-level; previously-fetched tiles stay cached for other levels:'''
+        self.zoom = zoom
+        self.tileCount = (2 ** zoom)
+        # Give failed tiles a fresh try at the new level:
+        with self.pendingLock:
+            self.unavailable.clear()
+
+    def latLonToPixels(self, lat, lon):
+        '''Get raster-pixel position (origin top-left) of a lat/lon position at this map's zoom:'''
+        mx, my = self.mercator.LatLonToMeters(lat, lon)
+        px, py = self.mercator.MetersToPixels(mx, my, self.zoom)
+        return self.mercator.PixelsToRaster(px, py, self.zoom)
+
+    def latLonToPixelsArray(self, lats, lons):
+        '''Get raster-pixel position arrays of lat/lon position arrays at this map's zoom, in one pass:'''
+        px, py = self.mercator.LatLonToPixelsArray(lats, lons, self.zoom)
+        return px, ((self.tileSize << self.zoom) - py)
+
+    def tileUrl(self, zoom, tx, ty):
+        '''URL for given TMS tile, which may use Google/OSM tile-numbering or a quadkey:'''
+        gx, gy = self.mercator.GoogleTile(tx, ty, zoom)
+        return self.urlTemplate.format(x=gx, y=gy, z=zoom, quadkey=self.mercator.QuadTree(tx, ty, zoom))
+
+    def takeChanged(self):
+        '''Return True if new tiles have arrived since last call:'''
+        changed = self.changed
+        self.changed = False
+        return changed
+
+    def requestTile(self, key):
+        with self.pendingLock:
+            if key in self.pending:
+                return
+            failTime = self.unavailable.get(key)
+            if (failTime is not None) and ((time.time() - failTime) < self.retryDelay):
+                return
+            self.pending.add(key)
+        self.requests.put(key)
+
+    def fetchLoop(self):
+        '''Worker-thread: load requested tiles from disk-cache, downloading them first if required'''
+        while True:
+            key = self.requests.get()
+            zoom, tx, ty = key
+
+            # Skip tiles requested before a zoom-change; they'll be re-requested if still needed:
+            if zoom != self.zoom:
+                with self.pendingLock:
+                    self.pending.discard(key)
+                continue
+
+            tile = None
+            try:
+                tile = self.loadTile(zoom, tx, ty)
+            except Exception as err:
+                print("Tile %s/%s/%s failed: %s" % (zoom, tx, ty, err))
+
+            with self.pendingLock:
+                self.unavailable.pop(key, None)
+                if tile is not None:
+                    self.cache.put(key, tile)
+                    self.changed = True
+                else:
+                    self.unavailable[key] = time.time()
+                    while len(self.unavailable) > self.maxUnavailable:
+                        self.unavailable.popitem(last=False)
+                self.pending.discard(key)
+
+    def loadTile(self, zoom, tx, ty):
+        filename = tileFilename(self.name, zoom, tx, ty)
+
+        if (not os.path.exists(filename)) or config.FORCE_DOWNLOAD:
+            if not config.USE_INTERNET:
+                return None
+            dirName = os.path.dirname(filename)
+            if not os.path.exists(dirName):
+                os.makedirs(dirName)
+
+            # Download to temporary file first, so a failed download can't leave a broken tile:
+            tileData = getProvider().tile(self.tileUrl(zoom, tx, ty))
+            tempFilename = (filename + ".tmp")
+            with open(tempFilename, 'wb') as f:
+                f.write(tileData)
+            os.rename(tempFilename, filename)
+
+        if self.processTile:
+            return self.processTile(filename, tx, ty)
+        return pygame.image.load(filename)
+
+    def draw(self, canvas, left, top):
+        '''Draw map to canvas, with canvas top-left at given raster-pixel position'''
+        tileSize = self.tileSize
+        zoom = self.zoom
+        width, height = canvas.get_size()
+        left, top = int(left), int(top)
+
+        # Google-numbered tile-range covering canvas:
+        firstX, firstY = (left // tileSize), (top // tileSize)
+        lastX, lastY = ((left + width - 1) // tileSize), ((top + height - 1) // tileSize)
+
+        for gy in range(firstY, lastY + 1):
+            for gx in range(firstX, lastX + 1):
+                drawPos = ((gx * tileSize) - left, (gy * tileSize) - top)
+
+                # Nothing beyond the poles:
+                if (gy < 0) or (gy >= self.tileCount):
+                    canvas.fill(self.blankColour, (drawPos, (tileSize, tileSize)))
+                    continue
+
+                # Wrap around the antimeridian, and convert to TMS tile-numbering:
+                tx = (gx % self.tileCount)
+                tx, ty = self.mercator.GoogleTile(tx, gy, zoom)
+                key = (zoom, tx, ty)
+
+                tile = self.cache.get(key)
+                if tile is None:
+                    self.requestTile(key)
+                    canvas.fill(self.blankColour, (drawPos, (tileSize, tileSize)))
+                else:
+                    canvas.blit(tile, drawPos)
+
+
+class MBTilesMap(TileMap):
+    '''TileMap that reads tiles from a local MBTiles (SQLite) file, for use without a connection.
+    MBTiles rows are numbered TMS-style, matching GlobalMercator's tile-numbering, so need no y-flip.'''
+
+    # Same query-string every time, so sqlite3's statement-cache keeps it prepared:
+    tileQuery = "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?"
+
+    def __init__(self, name, filename, zoom, processTile=None, maxTiles=config.TILECACHESIZE):
+        self.filename = filename
+        # Connection is opened by fetch-thread, as SQLite connections can't be shared between threads:
+        self.db = None
+        self.metadata = self.readMetadata()
+        TileMap.__init__(self, name, None, zoom, processTile, maxTiles)
+
+    def readMetadata(self):
+        '''Read tileset's metadata (name, format, minzoom, maxzoom, etc) as a dict:'''
+        db = sqlite3.connect(self.filename)
+        try:
+            # Packs are only read, never altered; just warn if tile-lookups won't have the standard index:
+            tilesType = db.execute("SELECT type FROM sqlite_master WHERE name='tiles'").fetchone()
+            if (tilesType is not None) and (tilesType[0] == 'table') and (not self.hasTileIndex(db)):
+                print("MBTiles %s: no (zoom_level, tile_column, tile_row) index on tiles, so tile-lookups will be slow" % (self.filename))
+
+            try:
+                return dict(db.execute("SELECT name, value FROM metadata").fetchall())
+            except sqlite3.Error:
+                return {}
+        finally:
+            db.close()
+
+    def hasTileIndex(self, db):
+        '''Return True if tiles table has an index starting with the columns tile-lookups use:'''
+        lookupColumns = ['zoom_level', 'tile_column', 'tile_row']
+        for indexRow in db.execute("PRAGMA index_list(tiles)").fetchall():
+            indexInfo = db.execute("PRAGMA index_info(\"%s\")" % (indexRow[1])).fetchall()
+            columns = [column for (seqNum, colNum, column) in sorted(indexInfo)]
+            if columns[:len(lookupColumns)] == lookupColumns:
+                return True
+        return False
+
+    def loadTile(self, zoom, tx, ty):
+        if self.db is None:
+            self.db = sqlite3.connect(self.filename)
+
+        row = self.db.execute(self.tileQuery, (zoom, tx, ty)).fetchone()
+        if row is None:
+            return None
+
+        tileFile = StringIO.StringIO(bytes(row[0]))
+        if self.processTile:
+            return self.processTile(tileFile, tx, ty)
+        return pygame.image.load(tileFile)
@@ -0,0 +1,11 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Unit-tests: run from repository root with "python -m pytest tests" or "python -m unittest discover -s tests -t ."
+
+import os
+import tempfile
+
+# config is read on first import, so set up a headless run with a throwaway cache-folder before any test imports it:
+os.environ.setdefault('PIPBOY_HEADLESS', '1')
+os.environ.setdefault('PIPBOY_PROVIDER', 'standin')
+os.environ.setdefault('PIPBOY_CACHEPATH', tempfile.mkdtemp(prefix="pipboy_tests_"))
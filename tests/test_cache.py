@@ -0,0 +1,39 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for versioned JSON cache-files
+
+import os
+import shutil
+import tempfile
+import unittest
+from pipboy_cache import loadCache, saveCache
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempDir, "test_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testRoundTrip(self):
+        saveCache(self.filename, 3, {'lat': 1.5, 'locality': "Here"})
+        self.assertEqual(loadCache(self.filename, 3), {'lat': 1.5, 'locality': "Here", 'version': 3})
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+
+    def testVersionMismatch(self):
+        saveCache(self.filename, 1, {'lat': 1.5})
+        self.assertIsNone(loadCache(self.filename, 2))
+
+    def testUnversioned(self):
+        with open(self.filename, 'w') as f:
+            f.write('{"lat": 1.5}')
+        self.assertIsNone(loadCache(self.filename, 1))
+
+    def testMissingOrUnreadable(self):
+        self.assertIsNone(loadCache(self.filename, 1))
+        with open(self.filename, 'w') as f:
+            f.write('{"lat": ')
+        self.assertIsNone(loadCache(self.filename, 1))
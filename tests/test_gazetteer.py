@@ -0,0 +1,90 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for offline gazetteer lookups
+
+import os
+import math
+import shutil
+import tempfile
+import unittest
+import numpy
+from pipboy_gazetteer import Gazetteer, EARTH_RADIUS
+
+
+def writeSource(filename, places):
+    '''Write (name, lat, lon, population) tuples as a GeoNames-style tab-separated file:'''
+    with open(filename, 'wb') as f:
+        for num, (name, lat, lon, population) in enumerate(places):
+            columns = [str(num), name.encode('utf-8'), '', '', repr(lat), repr(lon)] + ([''] * 8) + [str(population)]
+            f.write('\t'.join(columns) + '\n')
+
+
+def greatCircle(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2) + (math.cos(lat1) * math.cos(lat2) * (math.sin((lon2 - lon1) / 2) ** 2))
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class GazetteerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.sourceFilename = os.path.join(self.tempDir, "cities.txt")
+        self.indexFilename = os.path.join(self.tempDir, "gazetteer.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testNearestMatchesBruteForce(self):
+        random = numpy.random.RandomState(2)
+        lats, lons = random.uniform(-80, 80, 300).tolist(), random.uniform(-180, 180, 300).tolist()
+        writeSource(self.sourceFilename, [(u"Place %d" % (num), lat, lon, 0) for num, (lat, lon) in enumerate(zip(lats, lons))])
+        gazetteer = Gazetteer(self.sourceFilename, self.indexFilename)
+
+        # Includes targets across the antimeridian and near the poles:
+        for lat, lon in [(0, 0), (51.5, -0.1), (-33.9, 151.2), (10, 179.9), (10, -179.9), (89, 45), (-89, -120)]:
+            dists = [greatCircle(lat, lon, placeLat, placeLon) for placeLat, placeLon in zip(lats, lons)]
+            bestNum = int(numpy.argmin(dists))
+            name, distance = gazetteer.nearest(lat, lon)
+            self.assertEqual(name, u"Place %d" % (bestNum))
+            self.assertAlmostEqual(distance, dists[bestNum], delta=1.0)
+
+    def testIndexReused(self):
+        writeSource(self.sourceFilename, [(u"Washington, D.C.", 38.895, -77.036, 689545), (u"Z\xfcrich", 47.367, 8.55, 341730)])
+        Gazetteer(self.sourceFilename, self.indexFilename)
+        indexTime = os.stat(self.indexFilename).st_mtime
+
+        gazetteer = Gazetteer(self.sourceFilename, self.indexFilename)
+        self.assertEqual(os.stat(self.indexFilename).st_mtime, indexTime)
+        self.assertEqual(sorted(gazetteer.names), [u"Washington, D.C.", u"Z\xfcrich"])
+        self.assertEqual(gazetteer.nearest(47.4, 8.5)[0], u"Z\xfcrich")
+
+    def testEmpty(self):
+        writeSource(self.sourceFilename, [])
+        Gazetteer(self.sourceFilename, self.indexFilename)
+        indexTime = os.stat(self.indexFilename).st_mtime
+
+        # Empty index loads as no names, rather than being rebuilt:
+        gazetteer = Gazetteer(self.sourceFilename, self.indexFilename)
+        self.assertEqual(os.stat(self.indexFilename).st_mtime, indexTime)
+        self.assertEqual(gazetteer.names, [])
+        self.assertIsNone(gazetteer.nearest(0, 0))
+        self.assertIsNone(gazetteer.find(u"Anywhere"))
+
+    def testFind(self):
+        writeSource(self.sourceFilename, [
+            (u"Washington", 40.174, -80.246, 13000),
+            (u"Washington, D.C.", 38.895, -77.036, 689545),
+            (u"London", 42.983, -81.233, 383822),
+            (u"London", 51.509, -0.126, 8961989),
+        ])
+        gazetteer = Gazetteer(self.sourceFilename, self.indexFilename)
+
+        # Punctuation and case are ignored:
+        lat, lon = gazetteer.find("washington dc")
+        self.assertAlmostEqual(lat, 38.895, places=6)
+        self.assertAlmostEqual(lon, -77.036, places=6)
+        # Most populous of same-named places, also found without a trailing country:
+        self.assertAlmostEqual(gazetteer.find("London")[1], -0.126, places=6)
+        self.assertAlmostEqual(gazetteer.find("London, UK")[1], -0.126, places=6)
+        self.assertIsNone(gazetteer.find("Atlantis"))
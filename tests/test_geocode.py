@@ -0,0 +1,60 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for persistent geocode-cache
+
+import os
+import shutil
+import tempfile
+import unittest
+from pipboy_gps import GeocodeCache
+
+
+class GeocodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempDir, "geocode_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def newCache(self, maxEntries=3):
+        cache = GeocodeCache(maxEntries)
+        cache.cacheFilename = self.filename
+        return cache
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = self.newCache()
+        for key in ['a', 'b', 'c']:
+            cache.put(key, key.upper())
+
+        # Reading 'a' makes 'b' the least-recently-used:
+        self.assertEqual(cache.get('a'), 'A')
+        cache.put('d', 'D')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in ['a', 'c', 'd']], ['A', 'C', 'D'])
+
+    def testReplaceDoesntEvict(self):
+        cache = self.newCache()
+        for key in ['a', 'b', 'c']:
+            cache.put(key, key.upper())
+        cache.put('a', 'A2')
+        self.assertEqual([cache.get(key) for key in ['a', 'b', 'c']], ['A2', 'B', 'C'])
+
+    def testPersistsOrder(self):
+        cache = self.newCache()
+        for key in ['a', 'b', 'c']:
+            cache.put(key, [1.0, 2.0])
+        cache.put('a', [1.0, 2.0])
+
+        # Reloaded cache keeps recency as of last put, so 'b' is still first to go:
+        reloaded = self.newCache()
+        reloaded.put('d', [3.0, 4.0])
+        self.assertIsNone(reloaded.get('b'))
+        self.assertEqual(reloaded.get('a'), [1.0, 2.0])
+
+    def testKeys(self):
+        cache = self.newCache()
+        self.assertEqual(cache.addressKey("Washington,  DC"), cache.addressKey("washington dc"))
+        self.assertEqual(cache.latLongKey(38.8912, -77.0364), cache.latLongKey(38.8949, -77.0401))
+        self.assertNotEqual(cache.latLongKey(38.8951, -77.0364), cache.latLongKey(38.9051, -77.0364))
@@ -0,0 +1,48 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for GlobalMercator's array conversions, against its per-value ones
+
+import unittest
+import numpy
+from gdal2tiles import GlobalMercator, SharedMercator
+from pipboy_tiles import TileMap
+
+
+class MercatorArrayTest(unittest.TestCase):
+
+    lats = [-85.0, -33.86, 0.0, 38.8951, 51.5085, 84.9]
+    lons = [-179.9, 151.21, 0.0, -77.0364, -0.1257, 179.9]
+    zooms = [0, 5, 13, 21, 30]
+
+    def setUp(self):
+        self.mercator = GlobalMercator()
+
+    def assertArrayParity(self, arrays, scalars):
+        for array, values in zip(arrays, zip(*scalars)):
+            numpy.testing.assert_allclose(array, values, rtol=1e-12, atol=1e-6)
+
+    def testLatLonToMeters(self):
+        self.assertArrayParity(self.mercator.LatLonToMetersArray(self.lats, self.lons),
+                               [self.mercator.LatLonToMeters(lat, lon) for lat, lon in zip(self.lats, self.lons)])
+
+    def testPixels(self):
+        mx, my = self.mercator.LatLonToMetersArray(self.lats, self.lons)
+        for zoom in self.zooms:
+            px, py = self.mercator.MetersToPixelsArray(mx, my, zoom)
+            self.assertArrayParity((px, py), [self.mercator.MetersToPixels(x, y, zoom) for x, y in zip(mx, my)])
+            self.assertArrayParity(self.mercator.LatLonToPixelsArray(self.lats, self.lons, zoom), zip(px, py))
+
+    def testTileMapPixels(self):
+        # Places on tiled maps are projected in one pass, matching the per-position projection of the cursor:
+        tileMap = TileMap("test", None, 16)
+        xs, ys = tileMap.latLonToPixelsArray(self.lats, self.lons)
+        self.assertArrayParity((xs, ys), [tileMap.latLonToPixels(lat, lon) for lat, lon in zip(self.lats, self.lons)])
+
+    def testResolution(self):
+        # Cached resolutions match the formula, beyond the cached levels too:
+        for zoom in self.zooms + [40]:
+            self.assertAlmostEqual(self.mercator.Resolution(zoom), self.mercator.initialResolution / (2 ** zoom))
+
+    def testShared(self):
+        self.assertIs(SharedMercator(256), SharedMercator(256))
+        self.assertEqual(SharedMercator(512).tileSize, 512)
@@ -0,0 +1,172 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for map-places table and places-cache
+
+import os
+import math
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import config
+import pipboy_places
+from pipboy_cache import loadCache
+from pipboy_places import PlaceTable, PlacesCache, geohashEncode, geohashBounds, geohashCellSize, METRES_PER_DEGREE
+
+
+class PlaceTableTest(unittest.TestCase):
+
+    places = [
+        {'name': "Bar", 'lat': 38.90, 'lon': -77.03, 'icon': 'office'},
+        {'name': "Zoo", 'lat': 38.93, 'lon': -77.05, 'icon': 'monument'},
+        {'name': "Shop", 'lat': 38.88, 'lon': -77.01, 'icon': 'office'},
+    ]
+
+    def testColumns(self):
+        table = PlaceTable(self.places)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.names, ["Bar", "Zoo", "Shop"])
+        self.assertEqual(table.lats.tolist(), [38.90, 38.93, 38.88])
+        self.assertEqual(table.lons.tolist(), [-77.03, -77.05, -77.01])
+
+        # Icon-names are stored once each:
+        self.assertEqual(table.iconNames, ['office', 'monument'])
+        self.assertEqual([table.iconNames[iconId] for iconId in table.iconIds], ['office', 'monument', 'office'])
+
+    def testEmpty(self):
+        table = PlaceTable()
+        self.assertEqual(len(table), 0)
+        xs, ys = table.project(0, 0, 1, 1, 100)
+        self.assertEqual((len(xs), len(ys)), (0, 0))
+
+    def testProject(self):
+        table = PlaceTable(self.places)
+        minLat, minLon, xPerLon, yPerLat, imageSize = 38.85, -77.10, 4000.0, 5000.0, 640
+        xs, ys = table.project(minLat, minLon, xPerLon, yPerLat, imageSize)
+        for num, placeItem in enumerate(self.places):
+            self.assertAlmostEqual(xs[num], (placeItem['lon'] - minLon) * xPerLon)
+            self.assertAlmostEqual(ys[num], imageSize - ((placeItem['lat'] - minLat) * yPerLat))
+
+
+class PlacesCacheTest(unittest.TestCase):
+    '''PlacesCache, with getPlaces stubbed to record fetches instead of using the provider:'''
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.cache = PlacesCache()
+        self.cache.cacheFilename = os.path.join(self.tempDir, "places_cache.json")
+
+        self.fetches = []
+        self.fetchDelay = 0
+        self.fetchPlaces = []
+        self.savedGetPlaces, self.savedUseInternet = pipboy_places.getPlaces, config.USE_INTERNET
+        pipboy_places.getPlaces = self.stubGetPlaces
+        config.USE_INTERNET = True
+
+    def tearDown(self):
+        pipboy_places.getPlaces, config.USE_INTERNET = self.savedGetPlaces, self.savedUseInternet
+        shutil.rmtree(self.tempDir)
+
+    def stubGetPlaces(self, lat, lon, radius, types):
+        self.fetches.append((lat, lon, radius, types))
+        time.sleep(self.fetchDelay)
+        return list(self.fetchPlaces)
+
+    def testCoveringCells(self):
+        for lat, lon, radius in [(38.8951, -77.0364, 2000), (-33.86, 151.21, 500), (0.001, 179.999, 2000)]:
+            cells = self.cache.coveringCells(lat, lon, radius)
+            self.assertTrue(1 <= len(cells) <= 4)
+
+            # Cells are at least radius high, and include the search-square's centre and corners:
+            latSize, lonSize = geohashCellSize(len(cells[0]))
+            self.assertGreaterEqual(latSize * METRES_PER_DEGREE, radius)
+            latRadius = radius / METRES_PER_DEGREE
+            lonRadius = latRadius / math.cos(math.radians(lat))
+            for cornerLat, cornerLon in [(lat, lon), (lat - latRadius, lon - lonRadius), (lat + latRadius, lon + lonRadius)]:
+                cornerLon = (((cornerLon + 180.0) % 360.0) - 180.0)
+                self.assertIn(geohashEncode(cornerLat, cornerLon, len(cells[0])), cells)
+
+    def testGeohashBounds(self):
+        geohash = geohashEncode(38.8951, -77.0364, 6)
+        minLat, minLon, maxLat, maxLon = geohashBounds(geohash)
+        self.assertTrue((minLat <= 38.8951 <= maxLat) and (minLon <= -77.0364 <= maxLon))
+        self.assertAlmostEqual(maxLat - minLat, geohashCellSize(6)[0])
+        self.assertAlmostEqual(maxLon - minLon, geohashCellSize(6)[1])
+
+    def testCellTTL(self):
+        self.fetchPlaces = [{'name': "Bar", 'lat': 1.0, 'lon': 2.0, 'icon': 'office'}]
+        geohash = geohashEncode(38.8951, -77.0364, 5)
+        self.assertEqual(self.cache.getCell(geohash, 'establishment'), self.fetchPlaces)
+        self.assertEqual(self.cache.getCell(geohash, 'establishment'), self.fetchPlaces)
+        self.assertEqual(len(self.fetches), 1)
+
+        # Reloaded from file, then re-fetched once expired:
+        reloaded = PlacesCache()
+        reloaded.cacheFilename = self.cache.cacheFilename
+        self.assertEqual(reloaded.getCell(geohash, 'establishment'), self.fetchPlaces)
+        self.assertEqual(len(self.fetches), 1)
+        for entry in reloaded.cells.values():
+            entry['time'] -= (config.PLACESCACHETTL + 1)
+        reloaded.getCell(geohash, 'establishment')
+        self.assertEqual(len(self.fetches), 2)
+
+    def testOfflineUsesStale(self):
+        self.fetchPlaces = [{'name': "Bar", 'lat': 1.0, 'lon': 2.0, 'icon': 'office'}]
+        geohash = geohashEncode(38.8951, -77.0364, 5)
+        self.cache.getCell(geohash, 'establishment')
+        for entry in self.cache.cells.values():
+            entry['time'] -= (config.PLACESCACHETTL + 1)
+
+        config.USE_INTERNET = False
+        self.assertEqual(self.cache.getCell(geohash, 'establishment'), self.fetchPlaces)
+        self.assertEqual(self.cache.getCell(geohashEncode(0, 0, 5), 'establishment'), [])
+        self.assertEqual(len(self.fetches), 1)
+
+    def testConcurrentRequestsShareFetch(self):
+        self.fetchDelay = 0.2
+        geohash = geohashEncode(38.8951, -77.0364, 5)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.getCell(geohash, 'establishment')))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual(len(results), 4)
+
+    def testMergesCells(self):
+        lat, lon, radius = 38.8951, -77.0364, 2000
+        cells = self.cache.coveringCells(lat, lon, radius)
+        self.assertGreater(len(cells), 1)
+
+        # Every cell returns the same places, one of them outside the search-square:
+        self.fetchPlaces = [
+            {'name': "Near", 'lat': lat + 0.001, 'lon': lon, 'icon': 'office'},
+            {'name': "Far", 'lat': lat + 0.1, 'lon': lon, 'icon': 'office'},
+        ]
+        self.fetchDelay = 0.2
+        startTime = time.time()
+        places = self.cache.getPlaces(lat, lon, radius)
+        fetchTime = time.time() - startTime
+
+        self.assertEqual([placeItem['name'] for placeItem in places], ["Near"])
+        self.assertEqual(len(self.fetches), len(cells))
+        # Cells are fetched at the same time:
+        self.assertLess(fetchTime, self.fetchDelay * 2)
+
+    def testPrune(self):
+        self.cache.maxCells = 3
+        self.cache.load()
+        now = time.time()
+        self.cache.cells['ancient'] = {'time': now - (self.cache.maxAgeTTLs * config.PLACESCACHETTL) - 1, 'places': []}
+        self.cache.cells['stale'] = {'time': now - config.PLACESCACHETTL - 1, 'places': []}
+        for num in range(3):
+            self.cache.getCell(geohashEncode(10 * num, 10 * num, 5), 'establishment')
+
+        # Too-old cell goes first, then oldest of the rest:
+        self.assertEqual(len(self.cache.cells), 3)
+        self.assertNotIn('ancient', self.cache.cells)
+        self.assertNotIn('stale', self.cache.cells)
+        self.assertEqual(len(loadCache(self.cache.cacheFilename, PlacesCache.saveVersion)['cells']), 3)
@@ -0,0 +1,75 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for map-provider requests, against the stand-in server
+
+import unittest
+import urlparse
+from pipboy_provider import HttpClient, MapProvider
+import pipboy_standin
+
+
+class RecordingClient(HttpClient):
+    '''HttpClient that records the path of each request it sends:'''
+
+    def __init__(self):
+        HttpClient.__init__(self, timeout=5, retries=0)
+        self.paths = []
+
+    def getConnection(self, scheme, netloc):
+        connection = HttpClient.getConnection(self, scheme, netloc)
+        request = connection.request
+
+        def recordRequest(method, path, *args, **kwargs):
+            self.paths.append(path)
+            return request(method, path, *args, **kwargs)
+        connection.request = recordRequest
+        return connection
+
+
+class StaticMapTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Port 0 gets any free port:
+        cls.server = pipboy_standin.startServer(0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.clients = []
+
+    def tearDown(self):
+        # Close kept-alive connections, so stand-in's handler-threads finish before the interpreter exits:
+        for client in self.clients:
+            for connections in client.idle.values():
+                for connection in connections:
+                    connection.close()
+
+    def newProvider(self):
+        provider = MapProvider('standin', RecordingClient())
+        self.clients.append(provider.client)
+        provider.urls = dict(provider.urls, staticmap=("http://localhost:%s/staticmap" % (self.server.server_address[1])))
+        return provider
+
+    def testLocalityWithSpace(self):
+        provider = self.newProvider()
+        imageData = provider.staticMap("New York", 14, 1, 320)
+
+        # Stand-in's image is seeded by the centre it decoded, so matches only if "New York" arrived intact:
+        expected, contentType = pipboy_standin.StandInData().staticMap({'center': "New York", 'size': "320x320", 'scale': "1"})
+        self.assertEqual(imageData, expected)
+        self.assertNotIn(" ", provider.client.paths[0])
+
+    def testExtraArgsEncoded(self):
+        provider = self.newProvider()
+        extraArgs = [('maptype', 'hybrid'),
+                     ('style', 'feature:road|element:geometry|color:0xDDDDDD'),
+                     ('style', 'element:labels|visibility:off')]
+        provider.staticMap("Las Vegas", 18, 2, 256, extraArgs)
+
+        query = urlparse.parse_qsl(urlparse.urlsplit(provider.client.paths[0]).query)
+        self.assertEqual(query, [('center', "Las Vegas"), ('zoom', '18'), ('scale', '2'), ('size', "256x256")] +
+                         extraArgs + [('sensor', 'true')])
@@ -0,0 +1,46 @@
+# RasPipBoy: A Pip-Boy 3000 implementation for Raspberry Pi
+#   Neal D Corbett, 2013
+# Tests for map-marker spatial index
+
+import unittest
+import numpy
+from pipboy_spatial import GridIndex
+
+
+class GridIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # Random points, including negative positions and several per cell:
+        random = numpy.random.RandomState(1)
+        self.xs = random.uniform(-300, 300, 500)
+        self.ys = random.uniform(-200, 400, 500)
+        self.index = GridIndex(50)
+        self.index.build(self.xs, self.ys)
+
+    def bruteQuery(self, minX, minY, maxX, maxY):
+        inside = (self.xs >= minX) & (self.xs <= maxX) & (self.ys >= minY) & (self.ys <= maxY)
+        return sorted(numpy.nonzero(inside)[0].tolist())
+
+    def testQueryMatchesBruteForce(self):
+        # Small rectangles step through cells, large ones test occupied cells:
+        for rect in [(-20, -20, 20, 20), (0, 0, 75, 120), (-125, 33, -124, 34), (-1000, -1000, 1000, 1000)]:
+            self.assertEqual(sorted(self.index.query(*rect).tolist()), self.bruteQuery(*rect))
+
+    def testQueryEmpty(self):
+        self.assertEqual(len(self.index.query(1000, 1000, 1100, 1100)), 0)
+
+        emptyIndex = GridIndex(50)
+        emptyIndex.build(numpy.zeros(0), numpy.zeros(0))
+        self.assertEqual(len(emptyIndex.query(0, 0, 100, 100)), 0)
+        self.assertIsNone(emptyIndex.nearest(0, 0, 10))
+
+    def testNearest(self):
+        for x, y in [(0, 0), (-299, 399), (123.4, -56.7)]:
+            dists = ((self.xs - x) ** 2) + ((self.ys - y) ** 2)
+            self.assertEqual(self.index.nearest(x, y, 1000), int(numpy.argmin(dists)))
+
+    def testNearestOutsideRadius(self):
+        index = GridIndex(10)
+        index.build(numpy.array([0.0, 30.0]), numpy.array([0.0, 0.0]))
+        self.assertEqual(index.nearest(24, 0, 8), 1)
+        self.assertIsNone(index.nearest(15, 0, 8))